@@ -2,14 +2,15 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+from src.datastore import loadCrashData, datasetFingerprint
+from src.timeseries import getLandingFigures
+from src import instrumentation, shareddata
 
-@st.cache_data
-def loadData():
-    roadAccidents_df = pd.read_csv("data/Road_Crashes_for_five_Years_Victoria.csv")
-    roadAccidents_df['ACCIDENT_DATE'] = pd.to_datetime(roadAccidents_df['ACCIDENT_DATE'])
+@instrumentation.stage(cache=shareddata.shared(max_entries=1))
+def loadData(fingerprint):
+    roadAccidents_df = loadCrashData()
     roadAccidents_df['ACCIDENT_YEAR'] = roadAccidents_df['ACCIDENT_DATE'].dt.year
-    roadAccidents_df['ACCIDENT_YEARMONTH'] = roadAccidents_df['ACCIDENT_DATE'].dt.strftime('%Y-%m')
-    roadAccidents_df['ACCIDENT_MONTH'] = roadAccidents_df['ACCIDENT_DATE'].dt.strftime('%m')
+    roadAccidents_df['ACCIDENT_MONTH'] = roadAccidents_df['ACCIDENT_DATE'].dt.month
     return roadAccidents_df
 
 
@@ -42,7 +43,7 @@ This project aims to provide valuable insights to the government, which can help
 def visualisation():
     st.header("Visualisation")
     st.subheader("Road Accidents of Victoria")
-    roadAccidents_df = loadData()
+    roadAccidents_df = loadData(datasetFingerprint())
 
     with st.expander("Show raw data"):
         st.dataframe(roadAccidents_df)
@@ -50,127 +51,17 @@ def visualisation():
     st.subheader("Road Accidents Analysis")
     st.write("The following is the analysis of road accidents in Victoria in time series")
 
-    roadAccidents_df_by_year = roadAccidents_df.groupby(['ACCIDENT_YEARMONTH']).agg({
-        'TOTAL_PERSONS': 'sum',
-        "FATALITY" : "sum",
-        'SERIOUSINJURY': 'sum',
-        'OTHERINJURY': 'sum',
-        'NONINJURED': 'sum'
-        }).reset_index()
-    
-
-    # number of casualties by year using plotly using stacked bar chart
-    fig = px.bar(
-        roadAccidents_df_by_year, 
-        x="ACCIDENT_YEARMONTH", 
-        y=["FATALITY", "SERIOUSINJURY", "OTHERINJURY", "NONINJURED"], 
-        title="Number of casualties by year month", 
-        barmode='stack')
-    
-    # add line chart for total number of casualties
-    fig.add_scatter(x=roadAccidents_df_by_year['ACCIDENT_YEARMONTH'], y=roadAccidents_df_by_year['TOTAL_PERSONS'], name="TOTAL_PERSONS", mode='lines')
-
-    fig.update_layout(
-        xaxis_title="Year Month",
-        yaxis_title="Number of casualties",
-        legend_title="Casualties Type"
-    )
-    st.plotly_chart(fig)
-
-    roadAccidents_df_by_month = roadAccidents_df.groupby(['ACCIDENT_MONTH']).agg({
-        'TOTAL_PERSONS': 'mean',
-        "FATALITY" : "mean",
-        'SERIOUSINJURY': 'mean',
-        'OTHERINJURY': 'mean',
-        'NONINJURED': 'mean',
-        }).reset_index()
-    
-
-    fig = px.bar(
-        roadAccidents_df_by_month, 
-        x="ACCIDENT_MONTH", 
-        y=["FATALITY", "SERIOUSINJURY", "OTHERINJURY", "NONINJURED"], 
-        title="Average Number of Casualties by month", 
-        barmode='stack')
-    fig.add_scatter(x=roadAccidents_df_by_month['ACCIDENT_MONTH'], y=roadAccidents_df_by_month['TOTAL_PERSONS'], name="TOTAL_PERSONS", mode='lines')
-    fig.update_layout(
-        xaxis_title="Month",
-        yaxis_title="Average Number of casualties",
-        legend_title="Casualties Type"
-    )
-    st.plotly_chart(fig)
+    figures = getLandingFigures()
+    instrumentation.plotlyChart(figures["year_month"])
+    instrumentation.plotlyChart(figures["month"])
 
     #type of accidents
     st.subheader("Type of Accidents")
-
-    roadAccidents_df_by_accident_type = roadAccidents_df.groupby(['ACCIDENT_TYPE']).agg({
-        'TOTAL_PERSONS': 'sum',
-        "FATALITY" : "sum",
-        'SERIOUSINJURY': 'sum',
-        'OTHERINJURY': 'sum',
-        'NONINJURED': 'sum',
-        }).reset_index()
-    
-    fig = px.bar(
-        roadAccidents_df_by_accident_type.sort_values(by=['TOTAL_PERSONS'], ascending=False),
-        x="ACCIDENT_TYPE", 
-        y=["FATALITY", "SERIOUSINJURY", "OTHERINJURY", "NONINJURED"], 
-        title="Average Number of Casualties by Accident Type", 
-        barmode='stack')
-    # fig.add_scatter(x=roadAccidents_df_by_accident_type['ACCIDENT_TYPE'], y=roadAccidents_df_by_accident_type['TOTAL_PERSONS'], name="TOTAL_PERSONS", mode='lines')
-    fig.update_layout(
-        xaxis_title="Accident Type",
-        yaxis_title="Average Number of casualties in log scale",
-        legend_title="Casualties Type",
-    )
-    # log y
-    fig.update_yaxes(type="log")
-    # add number to the bar
-
-    fig.update_traces(
-        texttemplate='%{y:.2s}',
-        textposition='outside'
-    )
-
-
-    st.plotly_chart(fig)
+    instrumentation.plotlyChart(figures["accident_type"])
 
     # rank of RMA type by number of casualties in each category 
     st.subheader("Rank of RMA Type by Number of Casualties in Each Category")
-
-    roadAccidents_df_by_rma_type = roadAccidents_df.groupby(['RMA_ALL']).agg({
-        'TOTAL_PERSONS': 'sum',
-        "FATALITY" : "sum",
-        'SERIOUSINJURY': 'sum',
-        'OTHERINJURY': 'sum',
-        'NONINJURED': 'sum',
-        }).reset_index()
-    
-    # horizontal bar chart
-    fig = px.bar(
-        roadAccidents_df_by_rma_type.sort_values(by=['TOTAL_PERSONS'], ascending=True),
-        y="RMA_ALL", 
-        x=["FATALITY", "SERIOUSINJURY", "OTHERINJURY", "NONINJURED"], 
-        title="Average Number of Casualties by RMA Type", 
-        barmode='stack',
-        orientation='h',
-        height=800,
-        )
-        
-    
-    fig.update_layout(
-        yaxis_title="RMA Type",
-        xaxis_title="Number of casualties",
-        legend_title="Casualties Type",
-    )
-
-    fig.update_traces(
-        texttemplate='%{x:.2s}',
-        textposition='outside'
-    )
-
-    fig.update_xaxes(type="log")
-    st.plotly_chart(fig)
+    instrumentation.plotlyChart(figures["rma"])
     
 
     # fig = px.bar(
@@ -193,6 +84,7 @@ def main():
     projectScope()
     st.divider()
     visualisation()
+    instrumentation.sidebarPanel()
 
 
 if __name__ == "__main__":
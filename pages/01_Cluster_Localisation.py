@@ -1,7 +1,6 @@
 import streamlit as st 
 import pandas as pd
 import numpy as np
-from sklearn.cluster import DBSCAN
 import plotly.express as px
 import plotly.graph_objects as go
 
@@ -10,36 +9,69 @@ import plotly.graph_objects as go
 
 import matplotlib.pyplot as plt
 import seaborn
-from pysal.viz import splot
-from splot.esda import plot_moran
 import contextily
 
 import geopandas
 import pandas
-from pysal.explore import esda
 from pysal.lib import weights
 from numpy.random import seed
-@st.cache_data
-def get_data(num_years_offset=3):
-    crashsite_df = pd.read_csv("data/Road_Crashes_for_five_Years_Victoria.csv",parse_dates=["ACCIDENT_DATE"])
+from src.datastore import loadCrashData, datasetFingerprint, windowPartitions
+from src import clustering, instrumentation, pointlayer, resultcache, scheduler, shareddata, spatialindex
+def get_window(num_years_offset=3):
+    # only the months inside the date window key the clustering, appending an older month keeps it cached
+    return datasetFingerprint(windowPartitions(num_years_offset))
+
+@instrumentation.stage(cache=shareddata.shared(max_entries=1))
+def get_data(window, num_years_offset=3):
+    crashsite_df = loadCrashData()
     last_data = crashsite_df['ACCIDENT_DATE'].max()
     last_data_year = last_data - pd.DateOffset(years=num_years_offset)
     last_year_selection = (crashsite_df['ACCIDENT_DATE'] > last_data_year) & (crashsite_df['ACCIDENT_DATE'] <= last_data)
     lat_long_df = crashsite_df[last_year_selection][['LATITUDE', 'LONGITUDE']]
     return lat_long_df,crashsite_df
 
-@st.cache_data
-def get_cluster(params,lat_long_df):
-    clustering = DBSCAN(
-    **params,
-    algorithm='ball_tree',
-    metric='haversine' # haversine is the distance between two points on a sphere 
-    ).fit(np.radians(lat_long_df)) #need to be radians for haversine
-    return clustering
+@instrumentation.stage(cache=st.cache_resource(max_entries=1))
+def get_neighbour_graph(window, num_years_offset=3):
+    # the expensive neighbour search runs once per date window at the largest selectable distance
+    lat_long_df,_ = get_data(window, num_years_offset)
+    return clustering.NeighbourGraph(lat_long_df[['LATITUDE', 'LONGITUDE']], radius_m=1000)
+
+@instrumentation.stage(cache=st.cache_data)
+@resultcache.cached(depends=(clustering, get_data, get_neighbour_graph))
+@scheduler.heavy
+def get_cluster(params,window,num_years_offset=3):
+    # haversine DBSCAN labels filtered out of the precomputed graph, eps in radians,
+    # long windows are clustered in parallel spatial blocks with the same labels;
+    # labels of every window and parameters are kept on disk for all server processes
+    lat_long_df,_ = get_data(window, num_years_offset)
+    if len(lat_long_df) > clustering.PARTITION_THRESHOLD:
+        return clustering.partitionedDBSCAN(lat_long_df[['LATITUDE', 'LONGITUDE']], **params)
+    return get_neighbour_graph(window, num_years_offset).dbscan(**params)
+
+@instrumentation.stage(cache=st.cache_resource(max_entries=4))
+def get_cluster_index(params,window,num_years_offset=3):
+    # crashes of every cluster label, positions are rows of the crash frame
+    lat_long_df,crashsite_df = get_data(window, num_years_offset)
+    labels = get_cluster(params, window, num_years_offset)
+    return spatialindex.SortedIndex(labels, crashsite_df.index.get_indexer(lat_long_df.index))
+
+@instrumentation.stage(cache=st.cache_resource(max_entries=1))
+def get_window_index(window, num_years_offset=3):
+    # spatial index of the window's crashes built from the frame get_data holds for the same window,
+    # positions are rows of that frame even after a month outside the window was appended
+    lat_long_df,crashsite_df = get_data(window, num_years_offset)
+    return spatialindex.buildIndex(lat_long_df, crashsite_df.index.get_indexer(lat_long_df.index))
+
+@instrumentation.stage(cache=st.cache_data(max_entries=4))
+def get_density(window, num_years_offset=3):
+    # per zoom density cells of the window's crashes, the zoomed out map only ever sends these
+    lat_long_df,_ = get_data(window, num_years_offset)
+    return pointlayer.densityPyramid(lat_long_df)
 
 st.title('Welcome to the Road Accident Project!')
 st.caption("This is a project to help you understand the road accident in Victoria by various analysis and visualisation.")
-lat_long_df,crashsite_df = get_data()
+window = get_window()
+lat_long_df,crashsite_df = get_data(window)
 
 with st.expander("Show raw data"):
     st.dataframe(crashsite_df)
@@ -60,11 +92,12 @@ with st.form("cluster_form"):
 
 
 
-clustering = get_cluster(DBSCAN_params,lat_long_df)
+# sessions asking for the same parameters share one run, a newer submit cancels the one it replaces
+cluster_labels = scheduler.run("cluster", get_cluster, DBSCAN_params, window, label="Clustering crash sites")
 
 _lat_long_df = lat_long_df.copy()
 
-_lat_long_df["cluster"]=clustering.labels_
+_lat_long_df["cluster"]=cluster_labels
 non_outliner_selector = _lat_long_df["cluster"]!=-1
 _lat_long_df = _lat_long_df.loc[non_outliner_selector]
 cluster_index = _lat_long_df.index
@@ -87,6 +120,23 @@ cluster_info_df =  clusterd_crashsite_df.groupby("cluster").agg(
 
 map_center = cluster_info_df[['LATITUDE', 'LONGITUDE']].mean().values.tolist()
 
+st.header("Cluster Information Visualisation")
+st.caption("""
+The following is the information of each cluster of the road accident collected in Victoria. 
+The size of the circle represents the number of accidents in the cluster. 
+The color of the circle represents the average number of people injured or killed in the cluster. 
+The darker the color, the more people are injured or killed in the cluster.
+The green circle represents each data point that are similar to each cluster.
+""")
+col1, col2, col3 = st.columns(3)
+largest_clusters = cluster_info_df["ACCIDENT_NO"].sort_values(ascending=False).index[:100].tolist()
+centre_on = col1.selectbox("Centre on cluster", ["All clusters"] + largest_clusters)
+map_zoom = col2.slider("Map zoom", min_value=4, max_value=16, value=8,
+                       help=f"Individual crashes are shown from zoom {pointlayer.DETAIL_ZOOM}, density cells below it")
+show_map = col3.toggle("Show map", value=True)
+if centre_on != "All clusters":
+    map_center = cluster_info_df.loc[centre_on, ['LATITUDE', 'LONGITUDE']].values.tolist()
+
 
 fig = px.scatter_mapbox(cluster_info_df, 
     lat="LATITUDE", lon="LONGITUDE", 
@@ -99,29 +149,49 @@ fig = px.scatter_mapbox(cluster_info_df,
     color_continuous_scale="agsunset",
     zoom=3, height=600)
 
-# add another layer of scatter plot
-fig.add_scattermapbox(
-    lat=crashsite_df['LATITUDE'],
-    lon=crashsite_df['LONGITUDE'],
-    mode='markers',
-    name='data point',
-    marker=go.scattermapbox.Marker(
-        # x shape
-        size=5,
-        color='black',
-        opacity=0.1
-    ),
-    hoverinfo='none'
-)
+# add another layer of scatter plot, crashes of the date window as density cells or the points in view
+detail, data_points = pointlayer.levelOfDetail(lat_long_df, get_density(window), map_zoom, map_center)
+if detail == "density":
+    fig.add_scattermapbox(
+        lat=data_points['LATITUDE'],
+        lon=data_points['LONGITUDE'],
+        mode='markers',
+        name='data point',
+        marker=go.scattermapbox.Marker(
+            size=np.clip(3 + 2 * np.log2(data_points['count']), 3, 15),
+            color='black',
+            opacity=0.1
+        ),
+        text=data_points['count'],
+        hovertemplate='%{text} crashes<extra></extra>'
+    )
+else:
+    fig.add_scattermapbox(
+        lat=data_points['LATITUDE'],
+        lon=data_points['LONGITUDE'],
+        mode='markers',
+        name='data point',
+        marker=go.scattermapbox.Marker(
+            # x shape
+            size=5,
+            color='black',
+            opacity=0.1
+        ),
+        hoverinfo='none'
+    )
 
+cluster_points = clusterd_crashsite_df
+if detail == "points":
+    cluster_points = pointlayer.inViewport(cluster_points, pointlayer.viewport(*map_center, map_zoom))
+cluster_points = pointlayer.decimate(cluster_points)
 fig.add_scattermapbox(
-    lat=clusterd_crashsite_df['LATITUDE'],
-    lon=clusterd_crashsite_df['LONGITUDE'],
+    lat=cluster_points['LATITUDE'],
+    lon=cluster_points['LONGITUDE'],
     mode='markers',
     name='cluster point',
     marker=go.scattermapbox.Marker(
         size=10,
-        color=clusterd_crashsite_df['cluster'],
+        color=cluster_points['cluster'],
         colorscale='tempo',
         opacity=1
     ),
@@ -145,29 +215,25 @@ fig.update_layout(
 
 
 
-fig.update_layout(mapbox_style="open-street-map")
+fig.update_layout(mapbox_style="open-street-map" if show_map else "white-bg")
 fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
 
-fig.update_layout(mapbox_zoom=8)
-
+fig.update_layout(mapbox_zoom=map_zoom, mapbox_center={"lat": map_center[0], "lon": map_center[1]})
 
+selection = instrumentation.plotlyChart(fig, use_container_width=True, on_select="rerun", selection_mode=("points", "box", "lasso"), key="cluster_selection")
 
-
-st.header("Cluster Information Visualisation")
-st.caption("""
-The following is the information of each cluster of the road accident collected in Victoria. 
-The size of the circle represents the number of accidents in the cluster. 
-The color of the circle represents the average number of people injured or killed in the cluster. 
-The darker the color, the more people are injured or killed in the cluster.
-The green circle represents each data point that are similar to each cluster.
-""")
-tab1, tab2 = st.tabs(["With Map", "Without Map"])
-
-with tab1:
-    st.plotly_chart(fig, use_container_width=True)
-with tab2:
-    fig.update_layout(mapbox_style="white-bg")
-    st.plotly_chart(fig, use_container_width=True)
+# drill down into the clusters selected on the map, or the one the map is centred on
+selected_clusters = [cluster_info_df.index[point["point_index"]] for point in selection.selection.points if point["curve_number"] == 0]
+if not selected_clusters and centre_on != "All clusters":
+    selected_clusters = [centre_on]
+in_view = get_window_index(window).bbox(*pointlayer.viewport(*map_center, map_zoom))
+st.caption(f"{len(in_view)} crashes of the date window in the map view.")
+if selected_clusters:
+    selected_df = spatialindex.select(crashsite_df, get_cluster_index(DBSCAN_params, window).lookup(selected_clusters))
+    st.subheader(f"Crashes in cluster {', '.join(str(cluster) for cluster in selected_clusters[:10])}{' …' if len(selected_clusters) > 10 else ''}")
+    for column, (label, value) in zip(st.columns(4), spatialindex.summary(selected_df).items()):
+        column.metric(label, value)
+    st.dataframe(selected_df, hide_index=True)
 
 
 
@@ -218,4 +284,5 @@ fig.update_traces(
     texttemplate='%{y:.0s}', 
     textposition='outside'
 )
-st.plotly_chart(fig)
\ No newline at end of file
+instrumentation.plotlyChart(fig)
+instrumentation.sidebarPanel()
@@ -2,24 +2,20 @@ import streamlit as st
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn
-from pysal.viz import splot
-from splot.esda import plot_moran
 import contextily
 import os 
 import geopandas as gpd
 import pandas as pd
-from pysal.explore import esda
 from pysal.lib import weights
 from numpy.random import seed
-from dask.threaded import get
 import plotly.express as px
-import dask
-from dask.graph_manipulation import bind
 import plotly.graph_objects as go
 import geopandas as gpd
 from plotly.subplots import make_subplots
-from src import autocorrelation
+from src import autocorrelation, hexpyramid, instrumentation, scheduler, spacetime, spatialindex
+from src.datastore import loadCrashData, datasetFingerprint
 os.environ['USE_PYGEOS'] = '0'
+MAX_ANIMATION_VALUES = 300_000
 
 
 
@@ -32,28 +28,69 @@ with headerContainer:
         st.markdown("Spatial Autocorrelation, also known as spatial autocorrelation analysis, is a statistical technique used to examine and quantify the degree to which the values of a variable are correlated or related to their spatial locations. In other words, it assesses whether nearby observations are more similar to each other than those that are farther apart. This concept is often applied in fields like geography, ecology, urban planning, and epidemiology, where understanding spatial patterns and dependencies is crucial.")
 
 
-joined_gdf,groupedHexGrid_gdf = autocorrelation.getResults()
-
-
 with SpatialLagPlotContainer:
+    resolution = st.select_slider("Hexagon resolution",options=list(hexpyramid.LEVELS),value="5 km")
     zoom = st.slider("Zoom",min_value=6,max_value=20,value=8)
 
+    # cached results are keyed by the data version, an appended month is picked up on the next rerun
+    fingerprint = datasetFingerprint()
+    groupedHexGrid_gdf = scheduler.run("hexgrid", autocorrelation.getResults, fingerprint, hexpyramid.LEVELS[resolution], label=f"Computing the {resolution} hexagon grid")
+
     spatialCountPlotFig = autocorrelation.make_plot(groupedHexGrid_gdf,"count",zoom=zoom)
     spatialCountPlotFig_lag= autocorrelation.make_plot(groupedHexGrid_gdf,"count_lag",zoom=zoom)
     with st.expander("Number of accidents mapped with hexagonal grid"):
         st.subheader("Number of accidents mapped with hexagonal grid")
-        st.plotly_chart(spatialCountPlotFig)
+        instrumentation.plotlyChart(spatialCountPlotFig)
 
     st.subheader("Autocorrelation of number of accidents mapped with hexagonal grid")
-    st.plotly_chart(spatialCountPlotFig_lag)
+    st.caption("Click or lasso hexagons to list their crashes.")
+    selection = instrumentation.plotlyChart(spatialCountPlotFig_lag, on_select="rerun", selection_mode=("points", "box", "lasso"), key="hex_selection")
+    # the trace's locations are the grid's index, a selected point is a row of it
+    selected_cells = groupedHexGrid_gdf.index[[point["point_index"] for point in selection.selection.points]]
+    if len(selected_cells):
+        selected_df = spatialindex.select(loadCrashData(), spatialindex.getIndex().cell(selected_cells, hexpyramid.LEVELS[resolution]))
+        st.markdown(f"**Crashes in the {len(selected_cells)} selected {resolution} cells**")
+        for column, (label, value) in zip(st.columns(4), spatialindex.summary(selected_df).items()):
+            column.metric(label, value)
+        st.dataframe(selected_df, hide_index=True)
 
 
     spatialCountPlotFig = autocorrelation.make_plot(groupedHexGrid_gdf,"INJ_OR_FATAL",zoom=zoom)
     spatialCountPlotFig_lag= autocorrelation.make_plot(groupedHexGrid_gdf,"INJ_OR_FATAL_lag",zoom=zoom)
     with st.expander("Number of injuries and fatality mapped with hexagonal grid"):
         st.subheader("Number of injuries and fatality mapped with hexagonal grid")
-        st.plotly_chart(spatialCountPlotFig)
+        instrumentation.plotlyChart(spatialCountPlotFig)
 
     st.subheader("Autocorrelation of number of injuries and fatality mapped with hexagonal grid")
-    st.plotly_chart(spatialCountPlotFig_lag)
+    instrumentation.plotlyChart(spatialCountPlotFig_lag)
+
+    st.subheader("Significant local clusters of accidents (Local Moran's I, p < 0.05)")
+    significant_gdf = groupedHexGrid_gdf[groupedHexGrid_gdf["count_p_sim"] < 0.05]
+    instrumentation.plotlyChart(autocorrelation.make_plot(significant_gdf,"count_Is",title="Local Moran's I Rank Pct",zoom=zoom))
+    with st.expander("Global Moran's I of each aggregated column"):
+        st.dataframe(groupedHexGrid_gdf.attrs["global_moran"])
+
+    st.subheader("Hotspots over time")
+    col1, col2, col3 = st.columns(3)
+    period = col1.radio("Period", ["Year", "Month"], horizontal=True)
+    column_name = col2.selectbox("Value", ["count", "INJ_OR_FATAL", "FATALITY", "SERIOUSINJURY", "TOTAL_PERSONS"])
+    lag = col3.toggle("Spatial lag", value=True)
+    cube = scheduler.run("spacetime", autocorrelation.getSpaceTimeCube, fingerprint, hexpyramid.LEVELS[resolution], label=f"Computing the {resolution} space time cube")
+    if period == "Year":
+        cube = spacetime.rollUpPeriods(cube)
+    # animation frames hold every period's values, too many cells x periods falls back to a server side slider
+    if len(cube["cells"]) * len(cube["periods"]) > MAX_ANIMATION_VALUES:
+        selected = st.select_slider("Period", options=cube["periods"], value=cube["periods"][-1])
+        i = cube["periods"].index(selected)
+        cube = {**cube, "periods": [selected], "values": {column_name: cube["values"][column_name][:, [i]]},
+                "lags": {column_name: cube["lags"][column_name][:, [i]]}}
+    instrumentation.plotlyChart(autocorrelation.make_animation(cube, groupedHexGrid_gdf.attrs["geometry_url"], column_name, lag=lag, zoom=zoom))
+
+    st.subheader("Emerging hot spots")
+    st.caption("Getis-Ord Gi* of the monthly number of accidents in every cell, the Mann-Kendall trend of each cell's Gi* z-scores and the standard emerging hot spot categories.")
+    emerging_df = scheduler.run("emerging", autocorrelation.getEmergingHotSpots, fingerprint, hexpyramid.LEVELS[resolution], label=f"Computing the {resolution} emerging hot spots")
+    instrumentation.plotlyChart(autocorrelation.make_category_plot(emerging_df, groupedHexGrid_gdf.attrs["geometry_url"], zoom=zoom))
+    with st.expander("Number of cells in each category"):
+        st.dataframe(emerging_df["category"].value_counts())
 
+instrumentation.sidebarPanel()
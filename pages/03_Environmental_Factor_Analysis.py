@@ -1,27 +1,34 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-# import linear regression related libraries
-from sklearn.linear_model import LinearRegression
-@st.cache_resource
-def loadData():
-    roadAccidents_df = pd.read_parquet("out/crashsite_df_envcluster.parquet")
+from src import regression, factorcube, embedding, instrumentation, resultcache, scheduler, shareddata
+from src.envclustering import ENVCLUSTER_PATH, COMBINATIONS_PATH, artifactFingerprint
+@instrumentation.stage(cache=shareddata.shared(max_entries=1))
+def loadData(fingerprint):
+    # both artifacts are built offline by `python -m src.envclustering`,
+    # sessions share one mapped copy and get views of it
+    roadAccidents_df = shareddata.mappedFrame(ENVCLUSTER_PATH, fingerprint)
     roadAccidents_df['ACCIDENT_DATE'] = pd.to_datetime(roadAccidents_df['ACCIDENT_DATE'])
     roadAccidents_df['ACCIDENT_YEAR'] = roadAccidents_df['ACCIDENT_DATE'].dt.year
     roadAccidents_df['ACCIDENT_YEARMONTH'] = roadAccidents_df['ACCIDENT_DATE'].dt.strftime('%Y-%m')
     roadAccidents_df['ACCIDENT_MONTH'] = roadAccidents_df['ACCIDENT_DATE'].dt.strftime('%m')
     roadAccidents_df["labels"] = roadAccidents_df["predicted_environmental_cluster"].apply(lambda x: "Cluster #" + str(x))
-    roadAccidents_df["labels"][roadAccidents_df["labels"]=="Cluster #-1"] = "Noise"
+    roadAccidents_df.loc[roadAccidents_df["labels"]=="Cluster #-1","labels"] = "Noise"
     return roadAccidents_df
-@st.cache_resource
-def loadTsneData():
-    tsne_df = pd.read_parquet("out/tsne_df_10K.parquet")
+@instrumentation.stage()
+def dataFingerprint():
+    # recorded when the artifact is built, a rebuild is picked up on the next rerun
+    return artifactFingerprint()
+@instrumentation.stage(cache=shareddata.shared(max_entries=1))
+def loadTsneData(fingerprint):
+    # keyed by the build, a rebuild of the combinations replaces the reference coordinates
+    tsne_df = pd.read_parquet(COMBINATIONS_PATH)
     tsne_df["labels"] = tsne_df["labels"].apply(lambda x: "Cluster #" + str(x))
-    tsne_df["labels"][tsne_df["labels"]=="Cluster #-1"] = "Noise"
+    tsne_df.loc[tsne_df["labels"]=="Cluster #-1","labels"] = "Noise"
     return tsne_df
-@st.cache_resource
-def getGroupedSeverityData():
-    grouped = crashsite_df.groupby("labels").agg(
+@instrumentation.stage(cache=shareddata.shared(max_entries=1))
+def getGroupedSeverityData(fingerprint):
+    grouped = loadData(fingerprint).groupby("labels").agg(
     {
         "TOTAL_PERSONS":"mean",
         "INJ_OR_FATAL":"mean",
@@ -33,11 +40,17 @@ def getGroupedSeverityData():
     ).sort_values(by="SEVERITY",ascending=False)
 
     grouped["count"] = grouped["ACCIDENT_DATE"].astype(int)
-    grouped.drop("Noise",inplace=True)
+    grouped.drop("Noise",inplace=True,errors="ignore")
     return grouped
     
-crashsite_df = loadData()
-tsne_df = loadTsneData()
+fingerprint = dataFingerprint()
+crashsite_df = loadData(fingerprint)
+tsne_df = loadTsneData(fingerprint)
+@instrumentation.stage(cache=shareddata.shared(max_entries=1))
+def loadCrashEmbedding(fingerprint):
+    # every crash placed at its factor combination in the reference t-SNE embedding of the same build,
+    # persisted under the build's fingerprint
+    return embedding.crashEmbedding(loadData(fingerprint), loadTsneData(fingerprint), fingerprint)
 
 
 headerContainer = st.container()
@@ -68,30 +81,23 @@ with envEDAContainer:
 
     noneEnvironmentalColumns = crashsite_df.columns.difference(environmentalColumns)
 
+    # every chart here is drawn from the (factors x severity) count cube, not from the crash rows
+    factorFigures = factorcube.getFactorFigures()
+    instrumentation.plotlyChart(factorFigures["parcats"], use_container_width=True)
 
-    _df  = crashsite_df[environmentalColumns+["SEVERITY"]].copy()
-    _df = _df.dropna()
-    _df["count"] = 1
+    with st.expander("Sunburst of Environmental Factors"):
+        instrumentation.plotlyChart(factorFigures["sunburst"], use_container_width=True)
 
-    cols = environmentalColumns+["SEVERITY"]
-    fig = px.parallel_categories(_df, dimensions=cols)
-    
-    # fig = px.sunburst(_df, path=cols,values="count")
-    st.plotly_chart(fig, use_container_width=True)
-
-    
     with st.expander("Polar Chart of Each Environmental Factor"):
 
         for i,col in enumerate(environmentalColumns):
-            _series = crashsite_df[col].value_counts()
-            fig = px.line_polar(r=_series.values,theta=_series.index, line_close=True, title=f"{col} Distribution")
-            st.plotly_chart(fig, use_container_width=True)
+            instrumentation.plotlyChart(factorFigures[col], use_container_width=True)
 
 with tsneContainer:
     st.subheader("Clustering and Dimensionality Reduction")
     st.markdown("""
 The following is the analysis of clustering and dimensionality reduction of environmental factors.
-1. Dimensionality reduction using t-SNE by sampling 10000 data points into 3 components.
+1. Dimensionality reduction using t-SNE of every distinct combination of environmental factors into 3 components, each accident is placed at its combination.
 2. Clustering using DBSCAN to group the data points into similar groups.
 3. 3D scatter plot of t-SNE with cluster labels.
                 """.strip())
@@ -106,8 +112,10 @@ DBSCAN (Density-Based Spatial Clustering of Applications with Noise) is a cluste
 t-SNE (t-Distributed Stochastic Neighbor Embedding) is a dimensionality reduction algorithm that reduces the dimensionality of data points while preserving their local structure.
                     in this case of reducting categorical data, T-SNE is able to handle the `categorical data` and reduce the dimensionality of the data points into 3 components.
                     """)
+    max_points = st.select_slider("Accidents shown in the 3D plot", [2_000, 5_000, 10_000, 20_000, 50_000], value=embedding.MAX_POINTS)
+    plot_df = embedding.sampleForPlot(loadCrashEmbedding(fingerprint).assign(labels=crashsite_df["labels"]), max_points)
     fig = px.scatter_3d(
-        tsne_df,
+        plot_df,
         x='x', y='y', z='z',
         color='labels',
         opacity=0.2)
@@ -122,7 +130,7 @@ t-SNE (t-Distributed Stochastic Neighbor Embedding) is a dimensionality reductio
     )
     # legend name
     fig.for_each_trace(lambda t: t.update(name=t.name.replace("labels=", "Cluster ")))
-    st.plotly_chart(fig)
+    instrumentation.plotlyChart(fig)
 
     with st.expander("What does this 3D scatter plot mean?",expanded=True):
         st.markdown("""
@@ -151,7 +159,7 @@ with clusterPredictionContainer:
     st.write("The color of the bar represents the number of accidents in each cluster.")
     st.write("The graph shows that the clustering algorithm is able to group the accidents into similar groups and shows that the severity of the accidents in each cluster is different and can be ranked.")
     
-    grouped = getGroupedSeverityData()
+    grouped = getGroupedSeverityData(fingerprint)
     fig = px.bar(
         grouped,
         x=grouped.index,
@@ -162,34 +170,26 @@ with clusterPredictionContainer:
     fig.update_layout(
         title="Predicted Environmental Cluster Analysis")
 
-    st.plotly_chart(fig, use_container_width=True)
+    instrumentation.plotlyChart(fig, use_container_width=True)
 
-@st.cache_data(persist=True)
-def trainRegression(_df, metrices, norm,metrice="INJ_OR_FATAL"):
-    metrices_df = _df[metrices].div(_df[norm], axis=0) # normalize metrices
-    X = pd.get_dummies(crashsite_df[[*environ_col,"labels"]],columns=environ_col).groupby("labels").mean() # one hot encode environmental factors
-    # X = pd.get_dummies(crashsite_df[[*environ_col]],columns=environ_col) # one hot encode environmental factors
-    y = metrices_df[metrice].groupby(crashsite_df["predicted_environmental_cluster"]).mean() # get the mean of the metrices
-    reg = LinearRegression()
-    reg.fit(X, y)
-    return reg
+@instrumentation.stage(cache=st.cache_data)
+@resultcache.cached(depends=(regression,))
+@scheduler.heavy
+def trainRegression(fingerprint):
+    # one multi-output fit on the cluster level design matrix, the frame is the one of the fingerprint
+    return regression.fitCoefficients(loadData(fingerprint), fingerprint)
 
 with environmentalFactorCorrelationContainer:
     st.subheader("Environmental Factor Correlation")
 
-    environ_col = ['ALCOHOLTIME', 'LIGHT_CONDITION', 'ROAD_GEOMETRY', 'SPEED_ZONE', 'RMA']
-    metrices = ['INJ_OR_FATAL', 'FATALITY', 'SERIOUSINJURY', 'OTHERINJURY','NONINJURED']
-    norm = 'TOTAL_PERSONS'
-    models = {}
+    metrices = regression.SEVERITY_METRICS
+    models = {metrice: {} for metrice in metrices}
 
-    with st.status("Training Linear Regression Model"):
-        st.write("training linear regression model")
-        for metrice in metrices:
-            st.write(f"training linear regression model for {metrice}")
-            models[metrice] = { "model":trainRegression(crashsite_df, metrices, norm, metrice) }
+    coefficients = scheduler.run("regression", trainRegression, dataFingerprint(),
+                                 label="Training linear regression model for " + ", ".join(metrices))
 
     with st.expander("Trained Model"):
-        st.write(models)
+        st.dataframe(coefficients)
 
 
     st.write("The following is the correlation between environmental factors and accident severity.")
@@ -197,13 +197,10 @@ with environmentalFactorCorrelationContainer:
     st.write("The correlation is calculated by the coefficient of the linear regression model.")
 
 
-    X = pd.get_dummies(crashsite_df[environ_col])
-    X.head()
-
     tabs = st.tabs(metrices)
     for tab,matrice in zip(tabs,metrices):
         with tab:
-            coef_df = pd.DataFrame(models[matrice]["model"].coef_, X.columns, columns=['Coefficient'])
+            coef_df = coefficients.drop("intercept")[[matrice]].rename(columns={matrice: "Coefficient"})
             coef_df.sort_values("Coefficient",inplace=True,ascending=False) #sort by impact
 
             
@@ -223,7 +220,7 @@ with environmentalFactorCorrelationContainer:
                 fig.update_layout(
                     height=800
                 )
-                st.plotly_chart(fig)
+                instrumentation.plotlyChart(fig)
 
             coef_df.index = pd.MultiIndex.from_tuples([ (" ".join(i.split("_")[:-1]).capitalize(),i.split("_")[-1]) for i in coef_df.index ])
             coef_level0Index = coef_df.index.get_level_values(0).unique()
@@ -244,7 +241,7 @@ with environmentalFactorCorrelationContainer:
                         color_continuous_midpoint=0
                         )
                         
-                    st.plotly_chart(fig)
+                    instrumentation.plotlyChart(fig)
             
     st.caption("From the analysis we can quickly see the most impactful for each metrices.")
             #plotly barchart for each level 0 index
@@ -259,3 +256,4 @@ with environmentalFactorCorrelationContainer:
 
 
 
+instrumentation.sidebarPanel()
@@ -1,15 +1,59 @@
 import pandas as pd
-import pandas_profiling
 import streamlit as st
+import streamlit.components.v1 as components
 
-from streamlit_pandas_profiling import st_profile_report
+from src.datastore import datasetFingerprint
+from src import instrumentation, profiling
 
-# @st.cache_data
-def profilingReport():
 
-    df = pd.read_csv("data/Road_Crashes_for_five_Years_Victoria.csv")
-    pr = df.profile_report()
-    return st_profile_report(pr)
+@instrumentation.stage(cache=st.cache_data)
+def columnSummary(fingerprint):
+    # per month column statistics are cached on disk, a new month only adds its own partition
+    summary = profiling.columnSummary()
+    # dates and numbers share the min/max columns
+    return summary.astype({"min": str, "max": str})
 
 
-profilingReport()
\ No newline at end of file
+@instrumentation.stage(cache=st.cache_data)
+def readReport(path):
+    with open(path) as f:
+        return f.read()
+
+
+def profilingReport(mode):
+    # the minimal report is built once per dataset in a background worker and served from disk after that,
+    # a visitor never starts a full profile, it is only served once built offline
+    fingerprint = datasetFingerprint()
+    if mode not in profiling.BACKGROUND_MODES:
+        path = profiling.existingReport(fingerprint, mode)
+        if path is None:
+            st.info(f"The {mode} report of this dataset has not been built yet, it is built offline with")
+            st.code(f"python -m src.profiling {mode}", language="bash")
+        else:
+            components.html(readReport(path), height=1000, scrolling=True)
+        return
+    path = profiling.requestReport(fingerprint, mode)
+    if path is None:
+        error = profiling.reportError(fingerprint, mode)
+        if error is not None:
+            st.error(f"Profiling failed: {error}")
+            if st.button("Retry"):
+                profiling.retryReport(fingerprint, mode)
+                st.rerun()
+        else:
+            st.info("The report is being generated in the background, refresh in a minute.")
+            st.button("Refresh")
+        return
+    components.html(readReport(path), height=1000, scrolling=True)
+
+
+st.header("Column summary")
+st.dataframe(columnSummary(datasetFingerprint()))
+
+st.header("Profiling report")
+mode = st.radio("Report", ["minimal", "full"], horizontal=True,
+                help=f"minimal profiles a {profiling.SAMPLE_ROWS} row sample, "
+                     "the full report is only shown once built offline with `python -m src.profiling full`")
+profilingReport(mode)
+
+instrumentation.sidebarPanel()
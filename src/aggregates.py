@@ -0,0 +1,90 @@
+import os
+import json
+import hashlib
+import pandas as pd
+from src import datastore, pipeline
+
+# additive aggregates of the partitioned store: every partition contributes a piece, the stored total
+# is updated by adding the pieces of new or changed partitions and subtracting the ones they replace
+AGGREGATE_DIR = "out/cache/aggregates"
+
+_registry = {}
+
+
+def register(name, piece, columns=None):
+    # piece(partition_df) -> frame indexed by the aggregate's keys with additive numeric columns
+    _registry[name] = (piece, columns)
+
+
+def aggregatePaths(name, aggregate_dir=AGGREGATE_DIR):
+    directory = os.path.join(aggregate_dir, name)
+    return directory, os.path.join(directory, "total.parquet"), os.path.join(directory, "state.json")
+
+
+def piecePath(directory, partition, digest) -> str:
+    return os.path.join(directory, "pieces", f"{partition}-{digest}.parquet")
+
+
+def readState(state_path, version) -> dict:
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        if state["version"] == version:
+            return state
+    # a changed piece function invalidates every piece
+    return {"version": version, "partitions": {}}
+
+
+def mergeDeltas(deltas) -> pd.DataFrame:
+    keys = list(range(deltas[0].index.nlevels))
+    total = pd.concat(deltas).groupby(level=keys, dropna=False, observed=True, sort=True).sum()
+    # keys whose every contribution was subtracted again
+    return total[(total != 0).any(axis=1)]
+
+
+def writeParquet(df, path):
+    df.to_parquet(path + f".{os.getpid()}.tmp")
+    os.replace(path + f".{os.getpid()}.tmp", path)
+
+
+def updateAggregate(name, manifest_path=datastore.MANIFEST_PATH, aggregate_dir=AGGREGATE_DIR) -> pd.DataFrame:
+    piece, columns = _registry[name]
+    directory, total_path, state_path = aggregatePaths(name, aggregate_dir)
+    version = hashlib.sha256(pipeline.functionToken(piece).encode()).hexdigest()[:16]
+    # the state, its pieces and the total change together, concurrent updaters would subtract a piece twice
+    with datastore.fileLock(os.path.join(directory, ".lock")):
+        state = readState(state_path, version)
+        partitions = datastore.readManifest(manifest_path)["partitions"]
+
+        changed = [partition for partition, digest in partitions.items() if state["partitions"].get(partition) != digest]
+        replaced = [partition for partition in state["partitions"] if partitions.get(partition) != state["partitions"][partition]]
+        if not changed and not replaced and os.path.exists(total_path):
+            return pd.read_parquet(total_path)
+
+        # only the partitions whose digest moved are read, everything else is already in the total
+        deltas = [pd.read_parquet(total_path)] if state["partitions"] and os.path.exists(total_path) else []
+        for partition in replaced:
+            old_path = piecePath(directory, partition, state["partitions"][partition])
+            deltas.append(-pd.read_parquet(old_path))
+            os.remove(old_path)
+            del state["partitions"][partition]
+        os.makedirs(os.path.join(directory, "pieces"), exist_ok=True)
+        for partition in changed:
+            new_piece = piece(datastore.loadPartition(partition, columns))
+            writeParquet(new_piece, piecePath(directory, partition, partitions[partition]))
+            state["partitions"][partition] = partitions[partition]
+            deltas.append(new_piece)
+
+        total = mergeDeltas(deltas)
+        writeParquet(total, total_path)
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(state, f, sort_keys=True)
+        os.replace(state_path + ".tmp", state_path)
+        return total
+
+
+def updateAll() -> list:
+    # every aggregate registered by the modules imported so far
+    for name in _registry:
+        updateAggregate(name)
+    return list(_registry)
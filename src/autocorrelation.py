@@ -1,98 +1,119 @@
-# @dask.delayed
-import streamlit as st
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from dask.threaded import get
 import plotly.express as px
-from pysal.lib import weights
 import plotly.graph_objects as go
+from src.datastore import loadCrashData, datasetFingerprint
+from src import aggregates, hexbin, hexpyramid, hotspots, instrumentation, maplayer, pipeline, scheduler, shareddata, spacetime, spatialstats, spatialweights
 
 
-@st.cache_data
-def readCrashsiteGDF()->gpd.GeoDataFrame:
-    crashsite_df = pd.read_csv("./data/Road_Crashes_for_five_Years_Victoria.csv",parse_dates=["ACCIDENT_DATE"],index_col="ACCIDENT_NO")
-    crashsite_gdf = gpd.GeoDataFrame(
-        crashsite_df, geometry=gpd.points_from_xy(crashsite_df.LONGITUDE, crashsite_df.LATITUDE),crs="EPSG:4326"
-    )
+# circumradius of the hexagon cells in metres
+HEX_SIZE = 5000
+
 
-    crashsite_gdf = crashsite_gdf.to_crs(3857)
+def projectCrashsites(fingerprint=None)->gpd.GeoDataFrame:
+    return projectPoints(loadCrashData().set_index("ACCIDENT_NO"))
+
+def projectPoints(crashsite_df)->gpd.GeoDataFrame:
+    # the only reprojection of the points, every hex size bins these coordinates
+    geometry = gpd.GeoSeries.from_xy(
+        crashsite_df.LONGITUDE, crashsite_df.LATITUDE, crs="EPSG:4326", index=crashsite_df.index
+    ).to_crs(hexbin.PROJECTED_CRS)
+    # only the geometry is new, the crash columns stay views of the shared frame
+    crashsite_gdf = gpd.GeoDataFrame(crashsite_df, geometry=geometry, copy=False)
     return crashsite_gdf
 
-# @dask.delayed
-@st.cache_data
-def readHexGridGDF(path="./data/grid5KM.json"):
-    grid = gpd.read_file(
-        path,crs=None
-    )
-    grid["grid_id"] = grid.index
-    return grid
+def pyramidPiece(crashsite_df)->pd.DataFrame:
+    return hexpyramid.buildPyramid(projectPoints(crashsite_df)).set_index(["grid_id","hex_size"])
 
+aggregates.register("hex_pyramid", pyramidPiece, columns=["LATITUDE","LONGITUDE",*hexpyramid.METRIC_COLUMNS])
 
-# @dask.delayed
-# @st.cache_data
-def getDB(crashsite_gdf,hexgrid_gdf):
-    joined = gpd.GeoDataFrame(
-        hexgrid_gdf.sjoin(crashsite_gdf.to_crs(hexgrid_gdf.crs),how="left")
-    )
+def loadPyramid(fingerprint=None)->pd.DataFrame:
+    # hex sums of every level merged from per month pieces, an appended month only bins its own crashes
+    return aggregates.updateAggregate("hex_pyramid").reset_index()
+
+def spaceTimePiece(crashsite_df)->pd.DataFrame:
+    # the same pyramid with the accident month as an extra key, one grouped pass per partition
+    crashsite_gdf = projectPoints(crashsite_df.assign(**{spacetime.PERIOD_COLUMN: spacetime.accidentPeriods(crashsite_df)}))
+    return hexpyramid.buildPyramid(crashsite_gdf, by=[spacetime.PERIOD_COLUMN]).set_index(["grid_id","hex_size",spacetime.PERIOD_COLUMN])
+
+aggregates.register("hex_spacetime", spaceTimePiece, columns=["ACCIDENT_DATE","LATITUDE","LONGITUDE",*hexpyramid.METRIC_COLUMNS])
+
+def loadSpaceTimeLevel(fingerprint=None,hex_size=HEX_SIZE)->pd.DataFrame:
+    spacetime_sums = aggregates.updateAggregate("hex_spacetime").reset_index()
+    return spacetime_sums[spacetime_sums["hex_size"]==hex_size].drop(columns="hex_size")
+
+@instrumentation.stage(cache=shareddata.shared(max_entries=1))
+def readCrashsiteGDF(fingerprint)->gpd.GeoDataFrame:
+    # keyed by the dataset fingerprint so an appended month replaces the cached frame
+    return projectCrashsites(fingerprint)
+
+
+@instrumentation.stage()
+def getDB(crashsite_gdf,hex_size=HEX_SIZE):
+    # cell of every crash computed arithmetically from its projected coordinates, no polygon join
+    x = crashsite_gdf.geometry.x.to_numpy()
+    y = crashsite_gdf.geometry.y.to_numpy()
+    located = np.isfinite(x) & np.isfinite(y)
+    joined = pd.DataFrame(crashsite_gdf.drop(columns="geometry")).loc[located]
+    joined["grid_id"] = hexbin.hexCellIds(x[located], y[located], hex_size)
     return joined
-# @dask.delayed 
-# @st.cache_data
-def aggregation(joined_gdf,k=6,):
-    
-    agged = gpd.GeoDataFrame(
-    joined_gdf.groupby("grid_id").agg({
-        "FATALITY":"mean",
-        "geometry":"first",
-        "TOTAL_PERSONS": "mean",
-        "INJ_OR_FATAL": "mean",
-        "FATALITY": "mean",
-        "SERIOUSINJURY": "mean",
-        "index_right": "count",
-    })
-    )
-    agged.rename(columns={"index_right":"count"},inplace=True)
+@instrumentation.stage()
+def aggregation(joined_gdf,k=6,permutations=999,hex_size=HEX_SIZE):
+    return aggregateCells(hexpyramid.cellSums(joined_gdf),k=k,permutations=permutations,hex_size=hex_size)
 
-    data_buffer = agged.copy().dropna().query("count>0")
-    w = weights.KNN.from_dataframe(data_buffer, k=k) #k is the number of neighbour
-    w.transform = "R" #normalise the weights matrix
+def aggregateCells(cell_sums,k=6,permutations=999,hex_size=HEX_SIZE):
+    cells_gdf = cellFrame(cell_sums,hex_size)
+    return cellStatistics(cells_gdf,cellWeights(cells_gdf,k,hex_size),permutations,hex_size)
 
-    data_buffer["count_lag"] = weights.spatial_lag.lag_spatial(
-        w, data_buffer["count"]
+def cellFrame(cell_sums,hex_size=HEX_SIZE):
+    
+    agged = cell_sums[hexpyramid.METRIC_COLUMNS].div(cell_sums["count"], axis=0)
+    agged["count"] = cell_sums["count"]
+
+    data_buffer = agged.dropna().query("count>0")
+    # polygons are only built for the occupied cells
+    return gpd.GeoDataFrame(data_buffer, geometry=hexbin.hexPolygons(data_buffer.index, hex_size))
+
+def cellWeights(cells_gdf,k=6,hex_size=HEX_SIZE):
+    # neighbours are cached per (grid, occupied cells), k only slices the stored lists
+    return spatialweights.getWeights(cells_gdf, kind="knn", k=k, grid_key=f"hex{hex_size:g}") #k is the number of neighbour, row normalised
+
+def cellStatistics(cells_gdf,w,permutations=999,hex_size=HEX_SIZE):
+    data_buffer = cells_gdf
+    lag_columns = ["count","FATALITY","TOTAL_PERSONS","INJ_OR_FATAL","SERIOUSINJURY"]
+    data_buffer = data_buffer.join(spatialweights.spatialLag(w, data_buffer, lag_columns))
+
+    data_buffer["count_id_quantile"] = spatialstats.quadrantLabels(data_buffer["count"], data_buffer["count_lag"])
+
+    # local and global moran's I of every aggregated column with permutation significance
+    lisa_columns = ["count","FATALITY","TOTAL_PERSONS","INJ_OR_FATAL","SERIOUSINJURY"]
+    local_moran = spatialstats.moranLocal(w, data_buffer[lisa_columns].to_numpy(), permutations=permutations)
+    for i, column in enumerate(lisa_columns):
+        data_buffer[column+"_Is"] = local_moran["Is"][:, i]
+        data_buffer[column+"_p_sim"] = local_moran["p_sim"][:, i]
+        data_buffer[column+"_quadrant"] = local_moran["quadrant"][:, i]
+    data_buffer.attrs["global_moran"] = spatialstats.moranGlobal(
+        w, data_buffer[lisa_columns].to_numpy(), columns=lisa_columns, permutations=permutations
+    )
+    # cell geometry is encoded once per level and shared by every map of it
+    data_buffer.attrs["geometry_url"] = maplayer.cellGeometryURL(
+        data_buffer.geometry, spatialweights.cellsKey(f"hex{hex_size:g}", data_buffer.index)
     )
-    columns = ["FATALITY","TOTAL_PERSONS","INJ_OR_FATAL","FATALITY","SERIOUSINJURY"]
-    for column in columns:
-        data_buffer[column+"_lag"] = weights.spatial_lag.lag_spatial(
-            w, data_buffer[column]
-        )
-
-    qx = data_buffer["count"].mean()
-    qy = data_buffer["count_lag"].mean()
-    def get_quantile(x):
-
-        if(x["count"]>qx and x["count_lag"]>qy):
-            return "HotSpot"
-        elif(x["count"]<=qx and x["count_lag"]<=qy):
-            return "ColdSpot"
-        elif(x["count"]>qx and x["count_lag"]<=qy):
-            return "EmergingHotSpot"
-        elif(x["count"]<=qx and x["count_lag"]>qy):
-            return "DecliningHotSpot"
-    data_buffer["count_id_quantile"] = data_buffer.apply(get_quantile,axis=1)
-    return data_buffer
-
-# @st.cache_data
+    return data_buffer.to_crs(4326)
+
+@instrumentation.stage()
 def make_plot(groupedHexGrid_gdf,column_name="count",title=None,zoom=8):
-    # Assuming you have your GeoDataFrame named 'groupedHexGrid_gdf'
-    # Convert GeoDataFrame to GeoJSON for Plotly
-    geojson = groupedHexGrid_gdf.__geo_interface__
+    # the figure only carries ids and values, the geometry is fetched once by url
+    geojson = groupedHexGrid_gdf.attrs.get("geometry_url") or groupedHexGrid_gdf.__geo_interface__
     # Create a Choroplethmapbox trace
 
     title = title if title else f"{column_name.replace('_',' ')} Rank Pct"
 
     choropleth_trace = go.Choroplethmapbox(
         geojson=geojson,
-        locations=groupedHexGrid_gdf.index,  # Spatial coordinates
-        z=(groupedHexGrid_gdf[column_name].rank(pct=True)),        
+        locations=maplayer.cellLocations(groupedHexGrid_gdf.index),  # Spatial coordinates
+        z=maplayer.rankPct(groupedHexGrid_gdf[column_name]),
         colorscale="RdBu_r",
         colorbar={"title": title},
         marker_opacity=0.3,
@@ -114,15 +135,82 @@ def make_plot(groupedHexGrid_gdf,column_name="count",title=None,zoom=8):
     return fig_choropleth
 
 
-@st.cache_data
-def getResults():
-    dsk = {'crashsite_gdf': (readCrashsiteGDF,),
-        'hexgrid_gdf': (readHexGridGDF,),
-        'joined_gdf': (getDB, 'crashsite_gdf', 'hexgrid_gdf'),
-        'groupedHexGrid_gdf': (aggregation, 'joined_gdf'),
-        "plot": (make_plot, "groupedHexGrid_gdf","INJ_OR_FATAL"),
-        "lagplot": (make_plot, "groupedHexGrid_gdf", "INJ_OR_FATAL_lag")
+@instrumentation.stage()
+def make_animation(cube,geojson,column_name="count",lag=False,title=None,zoom=8):
+    # geometry and locations are sent once, every frame only carries the period's rank pct values
+    values = spacetime.denseValues(cube, column_name, lag)
+    z = np.round(pd.DataFrame(values).rank(pct=True).to_numpy(), 4)
+    title = title if title else f"{column_name.replace('_',' ')}{' lag' if lag else ''} Rank Pct"
+    periods = cube["periods"]
+
+    first = pd.DataFrame({column_name: z[:, 0]}, index=cube["cells"])
+    first.attrs["geometry_url"] = geojson
+    fig = make_plot(first, column_name, title, zoom)
+    fig.frames = [go.Frame(name=period, data=[go.Choroplethmapbox(z=z[:, i])], traces=[0]) for i, period in enumerate(periods)]
+    fig.update_layout(
+        sliders=[{
+            "active": 0,
+            "currentvalue": {"prefix": "Period: "},
+            "steps": [{"label": period, "method": "animate",
+                       "args": [[period], {"mode": "immediate", "frame": {"duration": 0, "redraw": True}}]} for period in periods],
+        }],
+        updatemenus=[{
+            "type": "buttons", "showactive": False, "x": 0, "y": 0,
+            "buttons": [{"label": "Play", "method": "animate",
+                         "args": [None, {"frame": {"duration": 700, "redraw": True}, "fromcurrent": True}]}],
+        }],
+    )
+    return fig
+
+
+@instrumentation.stage()
+def make_category_plot(emerging_df,geojson,column_name="category",zoom=8):
+    # one trace per category, every trace references the same cached geometry url
+    emerging_df = emerging_df[emerging_df[column_name] != "No Pattern Detected"]
+    fig = px.choropleth_mapbox(
+        emerging_df.reset_index(names="cell"),
+        geojson=geojson,
+        locations=maplayer.cellLocations(emerging_df.index),
+        color=column_name,
+        category_orders={column_name: [f"{category} {side}" for side in ["Hot Spot", "Cold Spot"] for category in hotspots.CATEGORIES]},
+        hover_data={"trend_z": ":.2f", "hot_share": ":.0%", "cold_share": ":.0%"},
+        opacity=0.5,
+        mapbox_style="carto-positron",
+        zoom=zoom,
+        center={"lat": -37.8, "lon": 144.95},
+    )
+    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    return fig
+
+
+def spatialGraph(fingerprint,hex_size=HEX_SIZE,k=6,permutations=999):
+    # every node is persisted under a key of its inputs, changing k only reruns weights and statistics
+    return {'pyramid': (loadPyramid, fingerprint),
+        'spacetime_sums': (loadSpaceTimeLevel, fingerprint, hex_size),
+        'cell_sums': (hexpyramid.pyramidLevel, 'pyramid', hex_size),
+        'cells_gdf': (cellFrame, 'cell_sums', hex_size),
+        'weights': (cellWeights, 'cells_gdf', k, hex_size),
+        'groupedHexGrid_gdf': (cellStatistics, 'cells_gdf', 'weights', permutations, hex_size),
+        'spacetime_cube': (spacetime.spaceTimeCube, 'spacetime_sums', 'cells_gdf', 'weights'),
+        'emerging_hotspots': (hotspots.emergingHotSpots, 'spacetime_cube', 'weights'),
         }
-    
-    joined_gdf,groupedHexGrid_gdf =  get(dsk, ['joined_gdf',"groupedHexGrid_gdf"])
-    return joined_gdf,groupedHexGrid_gdf
+
+
+@instrumentation.stage(cache=shareddata.shared)
+@scheduler.heavy
+def getResults(fingerprint,hex_size=HEX_SIZE,k=6):
+    # the page passes datasetFingerprint(), an appended month is a new key and a new graph
+    groupedHexGrid_gdf = pipeline.run(spatialGraph(fingerprint, hex_size, k), "groupedHexGrid_gdf")
+    return groupedHexGrid_gdf
+
+@instrumentation.stage(cache=shareddata.shared)
+@scheduler.heavy
+def getSpaceTimeCube(fingerprint,hex_size=HEX_SIZE,k=6):
+    # cells x months cube and the lag of every month, shares the weights node with getResults
+    return pipeline.run(spatialGraph(fingerprint, hex_size, k), "spacetime_cube")
+
+@instrumentation.stage(cache=shareddata.shared)
+@scheduler.heavy
+def getEmergingHotSpots(fingerprint,hex_size=HEX_SIZE,k=6):
+    # Gi* of every cell and month with the Mann-Kendall trend of each cell
+    return pipeline.run(spatialGraph(fingerprint, hex_size, k), "emerging_hotspots")
@@ -0,0 +1,138 @@
+import os
+import gc
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import pandas as pd
+from src import instrumentation, synthetic
+
+# headless run of the compute behind every page on synthetic data, wall time and peak memory per stage
+RESULTS_PATH = "out/benchmarks/results.jsonl"
+# the instrumented stages of a benchmark run, kept out of the app's out/logs/stages.jsonl
+LOG_PATH = "out/benchmarks/stages.jsonl"
+# the cluster page's defaults, 10 m and 5 crashes
+DBSCAN_PARAMS = {"eps": (10 / 1000) / 6371, "min_samples": 5}
+NUM_YEARS_OFFSET = 3
+# a stage this much slower than the previous run of the same size is flagged
+REGRESSION_RATIO = 1.25
+
+
+def measure(records, stage, func, *args, **kwargs):
+    # peak resident memory of this process during the stage, the benchmark runs one stage at a time so it is
+    # the stage's own; loky workers are not included
+    gc.collect()
+    with instrumentation.measure(stage) as entry:
+        result = func(*args, **kwargs)
+    records.append({
+        "stage": stage,
+        "seconds": entry["seconds"],
+        "peak_mb": entry["peak_mb"],
+        # rows of a frame, bytes of a serialised figure
+        "output": len(result) if hasattr(result, "shape") or isinstance(result, str) else None,
+    })
+    print(f"{stage:<28}{entry['seconds']:>10.2f} s{entry['peak_mb']:>10.1f} MB", flush=True)
+    return result
+
+
+def windowPoints(crashsite_df, num_years_offset=NUM_YEARS_OFFSET) -> pd.DataFrame:
+    # the cluster page's date window
+    last_data = crashsite_df["ACCIDENT_DATE"].max()
+    selection = (crashsite_df["ACCIDENT_DATE"] > last_data - pd.DateOffset(years=num_years_offset)) & (crashsite_df["ACCIDENT_DATE"] <= last_data)
+    return crashsite_df.loc[selection, ["LATITUDE", "LONGITUDE"]]
+
+
+def clusterWindow(lat_long_df, params=DBSCAN_PARAMS):
+    # same choice as the page, one neighbour graph or parallel blocks above the threshold
+    from src import clustering
+
+    if len(lat_long_df) > clustering.PARTITION_THRESHOLD:
+        return clustering.partitionedDBSCAN(lat_long_df, **params)
+    return clustering.NeighbourGraph(lat_long_df, radius_m=1000).dbscan(**params)
+
+
+def runBenchmark(n, seed=0, permutations=999):
+    # every stage runs in the current directory against empty caches
+    from src import autocorrelation, datastore, envclustering, regression
+
+    # the base extract path inside the working directory, never the data it points at outside of it
+    if os.path.isabs(datastore.CSV_PATH):
+        raise ValueError("unset CRASH_CSV_PATH, the benchmark generates its own base extract")
+    records = []
+    measure(records, "generate", synthetic.writeCrashCSV, n, datastore.CSV_PATH, seed)
+    measure(records, "ingestCrashCSV", datastore.ingestCrashCSV)
+    crashsite_df = measure(records, "loadData", datastore.loadCrashData)
+    crashsite_gdf = measure(records, "readCrashsiteGDF", autocorrelation.projectCrashsites)
+    joined_df = measure(records, "getDB", autocorrelation.getDB, crashsite_gdf)
+    grouped_gdf = measure(records, "aggregation", autocorrelation.aggregation, joined_df, permutations=permutations)
+    # the figure as it is sent to the browser
+    measure(records, "make_plot", lambda: autocorrelation.make_plot(grouped_gdf, "count").to_json())
+    measure(records, "get_cluster", clusterWindow, windowPoints(crashsite_df))
+    del crashsite_gdf, joined_df
+    envcluster_df, _ = measure(records, "buildEnvironmentalClusters", envclustering.buildEnvironmentalClusters)
+    measure(records, "trainRegression", regression.fitCoefficients, envcluster_df, envclustering.artifactFingerprint())
+    return records
+
+
+def gitRevision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previousRun(results_path, size):
+    # stage -> record of the last run of this size
+    previous = {}
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record["size"] == size:
+                    previous[record["stage"]] = record
+    return previous
+
+
+def compare(records, previous, ratio=REGRESSION_RATIO):
+    print(f"\n{'stage':<28}{'seconds':>10}{'previous':>10}{'peak MB':>10}{'previous':>10}")
+    for record in records:
+        before = previous.get(record["stage"], {})
+        flag = " slower" if before and record["seconds"] > ratio * max(before["seconds"], 0.01) else ""
+        print(f"{record['stage']:<28}{record['seconds']:>10.2f}{before.get('seconds', float('nan')):>10.2f}"
+              f"{record['peak_mb']:>10.1f}{before.get('peak_mb', float('nan')):>10.1f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the compute stages on synthetic crashes")
+    parser.add_argument("sizes", nargs="*", default=["100k"], help="rows to generate, e.g. 100k 1M 10M")
+    parser.add_argument("--workdir", help="directory for the generated data and caches, a new temporary one by default")
+    parser.add_argument("--permutations", type=int, default=999)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results_path = os.path.abspath(RESULTS_PATH)
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    instrumentation.setLogPath(os.path.abspath(LOG_PATH))
+    revision = gitRevision()
+    for size in args.sizes:
+        workdir = os.path.abspath(os.path.join(args.workdir, size)) if args.workdir else tempfile.mkdtemp(prefix=f"benchmark-{size}-")
+        os.makedirs(os.path.join(workdir, "out"), exist_ok=True)
+        previous = previousRun(results_path, size)
+        print(f"{size} rows in {workdir}")
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            records = runBenchmark(synthetic.parseSize(size), seed=args.seed, permutations=args.permutations)
+        finally:
+            os.chdir(cwd)
+        compare(records, previous)
+        run = {"size": size, "rows": synthetic.parseSize(size), "revision": revision, "timestamp": pd.Timestamp.now().isoformat(timespec="seconds")}
+        with open(results_path, "a") as f:
+            for record in records:
+                f.write(json.dumps({**run, **record}) + "\n")
+
+
+if __name__ == "__main__":
+    # python -m src.benchmark 100k 1M 10M
+    main(sys.argv[1:])
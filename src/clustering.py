@@ -0,0 +1,216 @@
+import numpy as np
+from concurrent.futures import as_completed
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from sklearn.neighbors import BallTree
+from src import pipeline, scheduler
+
+EARTH_RADIUS_KM = 6371
+# the page's largest "Distance in meters", any smaller eps is a filter of this graph
+GRAPH_RADIUS_M = 1000
+# above this many points the page clusters spatial blocks in parallel instead of one global graph
+PARTITION_THRESHOLD = 500_000
+BLOCK_SIZE_M = 5000
+# points (halos included) clustered by one future, neighbouring tiles share it
+BATCH_POINTS = 50_000
+
+
+def metresToRadians(metres) -> float:
+    return (metres / 1000) / EARTH_RADIUS_KM
+
+
+def numberClusters(n, core_index, core_component) -> np.ndarray:
+    # clusters are numbered by their smallest core point like sklearn, everything else is noise for now
+    labels = np.full(n, -1, dtype=np.int64)
+    components, inverse = np.unique(core_component, return_inverse=True)
+    first_core = np.full(len(components), n, dtype=np.int64)
+    np.minimum.at(first_core, inverse, core_index)
+    cluster_of_component = np.empty(len(components), dtype=np.int64)
+    cluster_of_component[np.argsort(first_core)] = np.arange(len(components))
+    labels[core_index] = cluster_of_component[inverse]
+    return labels
+
+
+def nearestCore(rows, cols, dists, core):
+    # a border point joins the cluster of its nearest core neighbour, lowest index on ties
+    border_edge = ~core[rows] & core[cols]
+    b_rows, b_cols, b_dists = rows[border_edge], cols[border_edge], dists[border_edge]
+    order = np.lexsort((b_cols, b_dists, b_rows))
+    b_rows, b_cols = b_rows[order], b_cols[order]
+    nearest = np.ones(len(b_rows), dtype=bool)
+    nearest[1:] = b_rows[1:] != b_rows[:-1]
+    return b_rows[nearest], b_cols[nearest]
+
+
+def dbscanLabels(rows, cols, dists, n, eps, min_samples) -> np.ndarray:
+    # DBSCAN from a neighbour edge list without self loops, distances in the same unit as eps
+    within = dists <= eps
+    rows, cols, dists = rows[within], cols[within], dists[within]
+    core = np.bincount(rows, minlength=n) + 1 >= min_samples
+
+    core_edge = core[rows] & core[cols]
+    core_graph = sparse.csr_matrix((np.ones(core_edge.sum()), (rows[core_edge], cols[core_edge])), shape=(n, n))
+    _, component = connected_components(core_graph, directed=False)
+
+    core_index = np.flatnonzero(core)
+    labels = numberClusters(n, core_index, component[core_index])
+    border, nearest = nearestCore(rows, cols, dists, core)
+    labels[border] = labels[nearest]
+    return labels
+
+
+class NeighbourGraph:
+    # haversine radius neighbour graph of the points, built once per date window
+
+    def __init__(self, lat_long, radius_m=GRAPH_RADIUS_M):
+        points = np.radians(np.asarray(lat_long, dtype=float))
+        self.n = len(points)
+        self.radius = metresToRadians(radius_m)
+        indices, distances = BallTree(points, metric="haversine").query_radius(
+            points, r=self.radius, return_distance=True
+        )
+        rows = np.repeat(np.arange(self.n), [len(i) for i in indices])
+        cols = np.concatenate(indices) if self.n else np.empty(0, dtype=np.int64)
+        dists = np.concatenate(distances) if self.n else np.empty(0)
+        not_self = rows != cols
+        self.rows, self.cols, self.dists = rows[not_self], cols[not_self], dists[not_self]
+
+    def dbscan(self, eps, min_samples) -> np.ndarray:
+        # eps in radians like sklearn's haversine DBSCAN
+        if eps > self.radius:
+            raise ValueError(f"eps {eps} is beyond the precomputed radius {self.radius}")
+        return dbscanLabels(self.rows, self.cols, self.dists, self.n, eps, min_samples)
+
+
+def _clusterBlock(points, ids, inner, owned, eps, min_samples):
+    # points are a tile grown by two eps, the neighbourhoods (and so core flags) of every point
+    # within one eps of the tile ("inner") are complete
+    tree = BallTree(points, metric="haversine")
+    inner_index = np.flatnonzero(inner)
+    indices, distances = tree.query_radius(points[inner_index], r=eps, return_distance=True)
+    rows = np.repeat(inner_index, [len(i) for i in indices])
+    cols = np.concatenate(indices)
+    dists = np.concatenate(distances)
+    not_self = rows != cols
+    rows, cols, dists = rows[not_self], cols[not_self], dists[not_self]
+
+    core = np.zeros(len(points), dtype=bool)
+    core[inner_index] = np.bincount(rows, minlength=len(points))[inner_index] + 1 >= min_samples
+
+    core_edge = core[rows] & core[cols]
+    core_graph = sparse.csr_matrix(
+        (np.ones(core_edge.sum()), (rows[core_edge], cols[core_edge])), shape=(len(points), len(points))
+    )
+    _, component = connected_components(core_graph, directed=False)
+
+    owned_rows = owned[rows]
+    border, nearest = nearestCore(rows[owned_rows], cols[owned_rows], dists[owned_rows], core)
+    core_index = np.flatnonzero(core)
+    return {
+        # local components of every core point the block can see, halo cores link it to its neighbours
+        "members": ids[core_index],
+        "member_component": component[core_index],
+        "member_owned": owned[core_index],
+        "border": ids[border],
+        "nearest_core": ids[nearest],
+    }
+
+
+def _clusterBlocks(blocks):
+    # one future clusters a batch of neighbouring tiles
+    return [_clusterBlock(*block) for block in blocks]
+
+
+def tileBlocks(lat_long, eps, block_size_m=BLOCK_SIZE_M):
+    # (ids, inner, owned) of every tile grown by two eps; points are bucketed once by their sorted tile key
+    # and a tile's halo is read from the key ranges of its neighbouring tile rows instead of masking them all
+    tile_lat = np.degrees(metresToRadians(block_size_m))
+    # equirectangular tiles, the longitude halo is widened for the most poleward latitude
+    tile_lon = tile_lat / np.cos(np.radians(np.abs(lat_long[:, 0]).max()))
+    halo_lat = np.degrees(eps) * 1.01
+    halo_lon = halo_lat / np.cos(np.radians(np.abs(lat_long[:, 0]).max() + halo_lat))
+    tile_y = np.floor(lat_long[:, 0] / tile_lat).astype(np.int64)
+    tile_x = np.floor(lat_long[:, 1] / tile_lon).astype(np.int64)
+
+    # the tiles two halos reach in a neighbouring row are one contiguous range of keys
+    reach_y = int(np.ceil(2 * halo_lat / tile_lat))
+    reach_x = int(np.ceil(2 * halo_lon / tile_lon))
+    x0 = tile_x.min() - reach_x
+    width = tile_x.max() - x0 + reach_x + 1
+    key = tile_y * width + (tile_x - x0)
+
+    order = np.argsort(key, kind="stable")
+    sorted_key = key[order]
+    sorted_lat = lat_long[order, 0]
+    sorted_lon = lat_long[order, 1]
+    tiles, starts = np.unique(sorted_key, return_index=True)
+    rows = np.arange(-reach_y, reach_y + 1) * width
+    for tile, start, stop in zip(tiles, starts, np.r_[starts[1:], len(order)]):
+        first = np.searchsorted(sorted_key, tile + rows - reach_x)
+        last = np.searchsorted(sorted_key, tile + rows + reach_x, side="right")
+        near = np.concatenate([np.arange(a, b) for a, b in zip(first, last)])
+
+        ty, tx = divmod(tile, width)
+        lat0, lon0 = ty * tile_lat, (tx + x0) * tile_lon
+        lat, lon = sorted_lat[near], sorted_lon[near]
+
+        def grown(times):
+            return (
+                (lat >= lat0 - times * halo_lat) & (lat < lat0 + tile_lat + times * halo_lat)
+                & (lon >= lon0 - times * halo_lon) & (lon < lon0 + tile_lon + times * halo_lon)
+            )
+
+        block = grown(2)
+        near = near[block]
+        yield order[near], grown(1)[block], (near >= start) & (near < stop)
+
+
+def partitionedDBSCAN(lat_long, eps, min_samples, block_size_m=BLOCK_SIZE_M, batch_points=BATCH_POINTS, executor=None) -> np.ndarray:
+    # haversine DBSCAN over spatial tiles with an eps halo clustered in parallel, clusters crossing
+    # tile boundaries are merged through the components of the halo cores, labels are identical to dbscanLabels
+    lat_long = np.asarray(lat_long, dtype=float)
+    n = len(lat_long)
+    points = np.radians(lat_long)
+
+    # neighbouring tiles are batched into futures of about `batch_points` points
+    executor = executor or pipeline.getExecutor()
+    futures, batch, batch_size = [], [], 0
+    for ids, inner, owned in tileBlocks(lat_long, eps, block_size_m):
+        batch.append((points[ids], ids, inner, owned, eps, min_samples))
+        batch_size += len(ids)
+        if batch_size >= batch_points:
+            futures.append(executor.submit(_clusterBlocks, batch))
+            batch, batch_size = [], 0
+    if batch:
+        futures.append(executor.submit(_clusterBlocks, batch))
+    # a superseded job stops between batches, batches not yet started are dropped
+    for done, future in enumerate(as_completed(futures), 1):
+        scheduler.reportProgress(done / len(futures), f"{done} of {len(futures)} tile batches clustered")
+        try:
+            scheduler.checkCancelled()
+        except scheduler.JobCancelled:
+            for future in futures:
+                future.cancel()
+            raise
+    blocks = [block for future in futures for block in future.result()]
+
+    # block components are numbered globally, every core point belongs to its owning block's component
+    offsets = np.cumsum([0] + [block["member_component"].max() + 1 if len(block["members"]) else 0 for block in blocks])
+    core = np.zeros(n, dtype=bool)
+    owner_component = np.full(n, -1, dtype=np.int64)
+    for offset, block in zip(offsets, blocks):
+        owned = block["member_owned"]
+        core[block["members"][owned]] = True
+        owner_component[block["members"][owned]] = block["member_component"][owned] + offset
+
+    # a halo core links the component its block saw it in to the one of its owning block
+    halo_from = np.concatenate([block["member_component"][~block["member_owned"]] + offset for offset, block in zip(offsets, blocks)])
+    halo_to = owner_component[np.concatenate([block["members"][~block["member_owned"]] for block in blocks])]
+    links = sparse.csr_matrix((np.ones(len(halo_from)), (halo_from, halo_to)), shape=(offsets[-1], offsets[-1]))
+    _, merged = connected_components(links, directed=False)
+
+    core_index = np.flatnonzero(core)
+    labels = numberClusters(n, core_index, merged[owner_component[core_index]])
+    for block in blocks:
+        labels[block["border"]] = labels[block["nearest_core"]]
+    return labels
@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import base64
+import fcntl
+import contextlib
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src import instrumentation, shareddata
+
+# the LFS extract, CRASH_CSV_PATH points the app at another one (e.g. generated by src.synthetic)
+CSV_PATH = os.environ.get("CRASH_CSV_PATH", "data/Road_Crashes_for_five_Years_Victoria.csv")
+# one parquet file per accident month, the manifest holds the digest of every partition
+STORE_PATH = "out/crashes"
+MANIFEST_PATH = "out/crashes/_manifest.json"
+# every appended delivery as it arrived, a rebuild from a new base extract applies them again
+DELIVERY_DIR = "_deliveries"
+UNDATED_PARTITION = "undated"
+
+# low cardinality text columns, stored as categoricals instead of object strings
+CATEGORICAL_COLUMNS = [
+    "ACCIDENT_STATUS", "ACCIDENT_TYPE", "ALCOHOLTIME", "DAY_OF_WEEK", "DCA_CODE",
+    "HIT_RUN_FLAG", "LIGHT_CONDITION", "POLICE_ATTEND", "ROAD_GEOMETRY", "SEVERITY",
+    "SPEED_ZONE", "RUN_OFFROAD", "NODE_TYPE", "LGA_NAME", "REGION_NAME",
+    "DEG_URBAN_NAME", "DEG_URBAN_ALL", "LGA_NAME_ALL", "REGION_NAME_ALL",
+    "SRNS", "SRNS_ALL", "RMA", "RMA_ALL", "DIVIDED", "DIVIDED_ALL", "STAT_DIV_NAME",
+]
+
+
+def fileDigest(path, chunk_size=1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def typedCrashFrame(crashsite_df) -> pd.DataFrame:
+    # every partition is written with the same schema so the store reads back as one table
+    categorical = {column: "category" for column in CATEGORICAL_COLUMNS if column in crashsite_df.columns}
+    crashsite_df = crashsite_df.astype(categorical)
+    crashsite_df["ACCIDENT_DATE"] = pd.to_datetime(crashsite_df["ACCIDENT_DATE"])
+    return crashsite_df
+
+
+def readCrashCSV(csv_path) -> pd.DataFrame:
+    header = pd.read_csv(csv_path, nrows=0).columns
+    dtype = {column: "category" for column in CATEGORICAL_COLUMNS if column in header}
+    return typedCrashFrame(pd.read_csv(csv_path, dtype=dtype))
+
+
+def partitionNames(crashsite_df) -> pd.Series:
+    return crashsite_df["ACCIDENT_DATE"].dt.strftime("%Y-%m").fillna(UNDATED_PARTITION)
+
+
+def partitionPath(name, store_path=STORE_PATH) -> str:
+    return os.path.join(store_path, f"{name}.parquet")
+
+
+def readManifest(manifest_path=MANIFEST_PATH) -> dict:
+    if not os.path.exists(manifest_path):
+        return {"source": None, "partitions": {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def writeManifest(manifest, manifest_path=MANIFEST_PATH):
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def storeSchema(crashsite_df) -> pa.Schema:
+    # categoricals get 32 bit indices, so a delivery with more categories than the base still fits
+    schema = pa.Schema.from_pandas(crashsite_df, preserve_index=False)
+    return pa.schema([
+        field.with_type(pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type) else field
+        for field in schema
+    ])
+
+
+def encodeSchema(schema) -> str:
+    return base64.b64encode(schema.serialize().to_pybytes()).decode()
+
+
+def decodeSchema(encoded) -> pa.Schema:
+    return pa.ipc.read_schema(pa.py_buffer(base64.b64decode(encoded)))
+
+
+def widenSchema(schema, crashsite_df) -> pa.Schema:
+    # an integer column that arrives with fractions or missing values is stored as float64 from then on
+    incoming = pa.Schema.from_pandas(crashsite_df, preserve_index=False)
+    missing = set(schema.names) - set(incoming.names)
+    if missing:
+        raise ValueError(f"the delivery lacks the stored columns {sorted(missing)}")
+    fields = []
+    for field in schema:
+        if pa.types.is_integer(field.type) and pa.types.is_floating(incoming.field(field.name).type):
+            field = field.with_type(pa.float64())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def writePartition(name, partition, manifest, store_path=STORE_PATH):
+    # every partition is cast to the manifest's schema, pyarrow reads the directory with the first one's;
+    # its digest is what derived artifacts compare to find the months that changed
+    os.makedirs(store_path, exist_ok=True)
+    path = partitionPath(name, store_path)
+    table = pa.Table.from_pandas(partition, preserve_index=False)
+    schema = decodeSchema(manifest["schema"])
+    # safe casts only, a value the stored type cannot hold raises instead of being truncated
+    table = table.select(schema.names).cast(schema)
+    # hidden while written, readers of the directory skip dot files
+    tmp_path = os.path.join(store_path, f".{name}.parquet.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    manifest["partitions"][name] = fileDigest(path)
+
+
+@contextlib.contextmanager
+def fileLock(lock_path):
+    # one writer at a time across sessions (threads) and server processes
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def storeLock(store_path=STORE_PATH):
+    # the lock file is hidden from readers of the directory
+    return fileLock(os.path.join(store_path, ".lock"))
+
+
+def deliveryPath(name, store_path=STORE_PATH) -> str:
+    # pyarrow skips underscore directories, delivered rows are not read twice with the store
+    return os.path.join(store_path, DELIVERY_DIR, f"{name}.parquet")
+
+
+@instrumentation.stage("ingestCrashCSV")
+def rebuildStore(csv_path=CSV_PATH, store_path=STORE_PATH, manifest_path=MANIFEST_PATH) -> pd.DataFrame:
+    # the base extract with every recorded delivery applied again in order, called with the store locked
+    crashsite_df = readCrashCSV(csv_path)
+    previous = readManifest(manifest_path)
+    deliveries = previous.get("deliveries", [])
+    for name in deliveries:
+        crashsite_df = pd.concat([crashsite_df, pd.read_parquet(deliveryPath(name, store_path))], ignore_index=True)
+    if deliveries:
+        crashsite_df = typedCrashFrame(crashsite_df.drop_duplicates("ACCIDENT_NO", keep="last"))
+
+    manifest = {"source": {"path": csv_path, "mtime": os.path.getmtime(csv_path)},
+                "schema": encodeSchema(storeSchema(crashsite_df)), "deliveries": deliveries, "partitions": {}}
+    for name, partition in crashsite_df.groupby(partitionNames(crashsite_df), sort=True):
+        writePartition(name, partition, manifest, store_path)
+    writeManifest(manifest, manifest_path)
+    # months that are gone are removed only once the new manifest is in place
+    for name in set(previous["partitions"]) - set(manifest["partitions"]):
+        if os.path.exists(partitionPath(name, store_path)):
+            os.remove(partitionPath(name, store_path))
+    return crashsite_df
+
+
+def ingestCrashCSV(csv_path=CSV_PATH, store_path=STORE_PATH, manifest_path=MANIFEST_PATH) -> pd.DataFrame:
+    # full rebuild of the store from the base extract, appended deliveries are kept
+    with storeLock(store_path):
+        return rebuildStore(csv_path, store_path, manifest_path)
+
+
+def refreshStore(csv_path=CSV_PATH, store_path=STORE_PATH, manifest_path=MANIFEST_PATH) -> bool:
+    # rebuilds a stale store once, sessions that see the change at the same time wait for that rebuild
+    if not storeIsStale(csv_path, manifest_path):
+        return False
+    with storeLock(store_path):
+        if not storeIsStale(csv_path, manifest_path):
+            return False
+        rebuildStore(csv_path, store_path, manifest_path)
+    return True
+
+
+def appendCrashCSV(csv_path, store_path=STORE_PATH, manifest_path=MANIFEST_PATH) -> list:
+    # a monthly delivery only rewrites the months it contains, re-delivered crashes replace their old rows
+    with storeLock(store_path):
+        return appendDelivery(readCrashCSV(csv_path), fileDigest(csv_path), store_path, manifest_path)
+
+
+def appendDelivery(new_df, delivery, store_path=STORE_PATH, manifest_path=MANIFEST_PATH) -> list:
+    manifest = readManifest(manifest_path)
+    # kept so a rebuild from a new base extract applies it again
+    path = deliveryPath(delivery, store_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    new_df.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    manifest["deliveries"] = [name for name in manifest.get("deliveries", []) if name != delivery] + [delivery]
+
+    if "schema" not in manifest:
+        # a store written before the schema was recorded
+        manifest["schema"] = encodeSchema(storeSchema(loadPartition(next(iter(manifest["partitions"])), store_path=store_path)))
+    schema = decodeSchema(manifest["schema"])
+    widened = widenSchema(schema, new_df)
+    if not widened.equals(schema):
+        # the stored partitions are rewritten once with the wider types so the store stays one schema
+        manifest["schema"] = encodeSchema(widened)
+        for name in list(manifest["partitions"]):
+            writePartition(name, loadPartition(name, store_path=store_path), manifest, store_path)
+    new_names = partitionNames(new_df)
+    touched, emptied = [], []
+    # a re-delivered crash whose date moved leaves the month it was stored in, as in a rebuild
+    moved_from = {}
+    for name in manifest["partitions"]:
+        stored_ids = pq.read_table(partitionPath(name, store_path), columns=["ACCIDENT_NO"]).column(0).to_pandas()
+        moved = stored_ids.isin(new_df["ACCIDENT_NO"][new_names != name])
+        if moved.any():
+            moved_from[name] = moved.to_numpy()
+    for name, moved in moved_from.items():
+        partition = loadPartition(name, store_path=store_path)[~moved]
+        if len(partition) or name in set(new_names):
+            writePartition(name, partition, manifest, store_path)
+        else:
+            del manifest["partitions"][name]
+            emptied.append(name)
+        touched.append(name)
+    for name, partition in new_df.groupby(new_names, sort=True):
+        if name in manifest["partitions"]:
+            partition = pd.concat([pd.read_parquet(partitionPath(name, store_path)), partition], ignore_index=True)
+            partition = typedCrashFrame(partition.drop_duplicates("ACCIDENT_NO", keep="last"))
+        writePartition(name, partition, manifest, store_path)
+        touched.append(name)
+    writeManifest(manifest, manifest_path)
+    # as in a rebuild, months left without crashes are removed once the manifest no longer lists them
+    for name in emptied:
+        os.remove(partitionPath(name, store_path))
+    return sorted(set(touched))
+
+
+def storeIsStale(csv_path=CSV_PATH, manifest_path=MANIFEST_PATH) -> bool:
+    # appended months do not make the store stale, only a new base extract does
+    if not os.path.exists(manifest_path):
+        return True
+    source = readManifest(manifest_path)["source"]
+    return os.path.exists(csv_path) and (
+        source is None or source["path"] != csv_path or os.path.getmtime(csv_path) != source["mtime"]
+    )
+
+
+def datasetFingerprint(partitions=None) -> str:
+    # identifies this version of the data (or of some of its months), derived caches are keyed by it
+    refreshStore()
+    digests = readManifest()["partitions"]
+    if partitions is not None:
+        digests = {name: digests[name] for name in partitions if name in digests}
+    return hashlib.sha256(json.dumps(digests, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def windowPartitions(num_years_offset) -> list:
+    # months of the last `num_years_offset` years up to the latest accident month
+    months = sorted(name for name in readManifest()["partitions"] if name != UNDATED_PARTITION)
+    if not months:
+        return []
+    first = (pd.Period(months[-1], "M") - 12 * num_years_offset).strftime("%Y-%m")
+    return [name for name in months if name >= first]
+
+
+def loadPartition(name, columns=None, store_path=STORE_PATH) -> pd.DataFrame:
+    return pd.read_parquet(partitionPath(name, store_path), columns=columns)
+
+
+def loadCrashData(columns=None) -> pd.DataFrame:
+    # single entry point for the crash table, every page and session gets a view of the same mapped copy,
+    # keyed by the fingerprint so an appended month is picked up by running servers
+    crashsite_df = shareddata.mappedFrame(STORE_PATH, datasetFingerprint())
+    return crashsite_df if columns is None else crashsite_df[columns]
+
+
+if __name__ == "__main__":
+    # python -m src.datastore                  rebuild the store from the base CSV
+    # python -m src.datastore append new.csv   add a delivery and merge it into every stored aggregate
+    if len(sys.argv) > 2 and sys.argv[1] == "append":
+        from src import aggregates, timeseries, factorcube, autocorrelation
+
+        touched = appendCrashCSV(sys.argv[2])
+        print(f"appended {', '.join(touched)}")
+        for name in aggregates.updateAll():
+            print(f"updated {name}")
+    else:
+        ingestCrashCSV()
@@ -0,0 +1,96 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import NearestNeighbors
+from src.regression import ENVIRONMENTAL_COLUMNS
+
+EMBEDDING_DIR = "out/cache/embedding"
+N_NEIGHBORS = 5
+# markers in the 3D plot, the rest of the crashes are represented by a stratified sample
+MAX_POINTS = 10_000
+
+
+class ReferenceEmbedding:
+    # t-SNE coordinates of the factor combinations it was fitted on, other combinations are
+    # placed by inverse distance interpolation over their nearest reference combinations
+
+    def __init__(self, reference_df, columns=ENVIRONMENTAL_COLUMNS, n_neighbors=N_NEIGHBORS):
+        missing = [column for column in columns if column not in reference_df.columns]
+        if missing:
+            raise ValueError(f"reference embedding has no {missing} columns, rebuild it with `python -m src.envclustering`")
+        self.columns = list(columns)
+        self.reference = reference_df.reset_index(drop=True)
+        keys = self.reference[self.columns].astype(str)
+        self.categories = {column: np.unique(keys[column].to_numpy()) for column in self.columns}
+        self.positions = pd.Series(np.arange(len(keys)), index=pd.MultiIndex.from_frame(keys))
+        self.coordinates = self.reference[["x", "y", "z"]].to_numpy(dtype=float)
+        self.index = NearestNeighbors(n_neighbors=min(n_neighbors, len(keys))).fit(self.encode(keys))
+
+    def encode(self, keys) -> np.ndarray:
+        # one-hot over the reference categories, an unseen category is all zeros for its factor
+        return np.hstack([
+            keys[column].to_numpy()[:, None] == self.categories[column][None, :] for column in self.columns
+        ]).astype(float)
+
+    def placeCombinations(self, keys):
+        # exact reference combinations keep their coordinates, the rest are interpolated in batch
+        position = self.positions.reindex(pd.MultiIndex.from_frame(keys)).to_numpy()
+        known = ~np.isnan(position)
+        coordinates = np.empty((len(keys), 3))
+        labels = np.empty(len(keys), dtype=object)
+        coordinates[known] = self.coordinates[position[known].astype(np.int64)]
+        labels[known] = self.reference["labels"].to_numpy()[position[known].astype(np.int64)]
+        if (~known).any():
+            distances, neighbours = self.index.kneighbors(self.encode(keys[~known]))
+            weights = 1 / distances
+            coordinates[~known] = (self.coordinates[neighbours] * weights[..., None]).sum(axis=1) / weights.sum(axis=1)[:, None]
+            labels[~known] = self.reference["labels"].to_numpy()[neighbours[:, 0]]
+        return coordinates, labels, known
+
+    def place(self, crashsite_df) -> pd.DataFrame:
+        # coordinates of every crash from its distinct combination, the work scales with combinations not rows
+        keys = crashsite_df[self.columns].astype(str)
+        grouped = keys.groupby(self.columns, sort=False)
+        codes = grouped.ngroup().to_numpy()
+        combinations = grouped.size().index.to_frame(index=False)
+        coordinates, labels, known = self.placeCombinations(combinations)
+        placed = pd.DataFrame(coordinates[codes].astype(np.float32), columns=["x", "y", "z"], index=crashsite_df.index)
+        placed["labels"] = labels[codes]
+        placed["interpolated"] = ~known[codes]
+        return placed
+
+
+def crashEmbedding(crashsite_df, reference_df, fingerprint) -> pd.DataFrame:
+    # persisted per dataset, a new month of crashes is placed without re-running t-SNE
+    path = os.path.join(EMBEDDING_DIR, f"{fingerprint}.parquet")
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    placed = ReferenceEmbedding(reference_df).place(crashsite_df)
+    os.makedirs(EMBEDDING_DIR, exist_ok=True)
+    placed.to_parquet(path)
+    return placed
+
+
+def sampleForPlot(points_df, max_points=MAX_POINTS, by="labels", seed=0) -> pd.DataFrame:
+    # level of detail for the 3D plot: every label keeps at least one point and the rest of the budget
+    # is shared in proportion to label size, the same rows are drawn on every rerun
+    if len(points_df) <= max_points:
+        return points_df
+    order = np.random.default_rng(seed).permutation(len(points_df))
+    shuffled = points_df.iloc[order]
+    sizes = shuffled[by].value_counts()
+    quota = np.maximum(1, np.floor(sizes * max_points / len(points_df))).astype(int)
+    rank = shuffled.groupby(by, sort=False).cumcount().to_numpy()
+    keep = rank < quota.reindex(shuffled[by]).to_numpy()
+    return shuffled[keep].sort_index()
+
+
+if __name__ == "__main__":
+    # monthly refresh: python -m src.embedding new_crashes.parquet placed.parquet
+    from src.envclustering import COMBINATIONS_PATH
+
+    placed = ReferenceEmbedding(pd.read_parquet(COMBINATIONS_PATH)).place(pd.read_parquet(sys.argv[1]))
+    placed.to_parquet(sys.argv[2])
+    print(f"{len(placed)} crashes placed, {placed['interpolated'].sum()} by interpolation")
@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import DBSCAN
+from sklearn.manifold import TSNE
+from sklearn.neighbors import NearestNeighbors
+from src import datastore
+from src.regression import ENVIRONMENTAL_COLUMNS, CLUSTER_COLUMN
+
+ENVCLUSTER_PATH = "out/crashsite_df_envcluster.parquet"
+# every distinct factor combination with its t-SNE coordinates, cluster and crash count
+COMBINATIONS_PATH = "out/factor_combinations.parquet"
+# DBSCAN in the 3 component t-SNE space. The old 10,000 row sample used eps = 2.5, half the median
+# distance from a distinct combination to its nearest other one (5.1), so a cluster was a combination
+# frequent enough on its own plus the ones lying unusually close to it; the t-SNE scale changes with the
+# number of combinations, so eps is derived from that distance instead of fixed
+EPS_FRACTION = 0.5
+EPS_QUANTILE = 0.5
+# combinations are weighted by their crashes, so a core needs this share of all crashes
+# (about 5 rows of the old 10,000 row sample)
+MIN_SHARE = 0.0005
+
+
+def uniqueCombinations(crashsite_df, columns=ENVIRONMENTAL_COLUMNS):
+    # at most a few thousand distinct factor combinations stand in for every crash,
+    # codes are each crash's combination (-1 where a factor is missing)
+    grouped = crashsite_df.groupby(columns, observed=True, dropna=True, sort=True)
+    combinations = grouped.size().rename("count").reset_index()
+    codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    return combinations, codes
+
+
+def embedCombinations(combinations, columns=ENVIRONMENTAL_COLUMNS, seed=0) -> np.ndarray:
+    one_hot = pd.get_dummies(combinations[columns].astype(str), dtype=float).to_numpy()
+    perplexity = min(30, max(len(one_hot) - 1, 1) / 3)
+    return TSNE(n_components=3, perplexity=perplexity, init="pca", random_state=seed).fit_transform(one_hot)
+
+
+def spacingEps(embedding, fraction=EPS_FRACTION, quantile=EPS_QUANTILE) -> float:
+    if len(embedding) < 2:
+        return 1.0
+    distances = NearestNeighbors(n_neighbors=2).fit(embedding).kneighbors(embedding)[0][:, 1]
+    return fraction * float(np.quantile(distances, quantile))
+
+
+def clusterCombinations(embedding, counts, eps=None, min_share=MIN_SHARE) -> np.ndarray:
+    eps = spacingEps(embedding) if eps is None else eps
+    min_samples = max(1, int(np.ceil(min_share * counts.sum())))
+    return DBSCAN(eps=eps, min_samples=min_samples).fit(embedding, sample_weight=counts).labels_
+
+
+def environmentalClusters(crashsite_df, eps=None, min_share=MIN_SHARE, seed=0):
+    combinations, codes = uniqueCombinations(crashsite_df)
+    embedding = embedCombinations(combinations, seed=seed)
+    combinations[CLUSTER_COLUMN] = clusterCombinations(embedding, combinations["count"].to_numpy(), eps, min_share)
+
+    # every crash looks its combination's cluster up by code, crashes with a missing factor are noise
+    labels = np.append(combinations[CLUSTER_COLUMN].to_numpy(), -1)
+    envcluster_df = crashsite_df.assign(**{CLUSTER_COLUMN: labels[codes]})
+    # the combinations stay with their coordinates as the reference set for placing new crashes
+    tsne_df = pd.DataFrame(embedding.astype(np.float32), columns=["x", "y", "z"])
+    tsne_df["labels"] = combinations[CLUSTER_COLUMN].astype(str)
+    tsne_df["count"] = combinations["count"].to_numpy()
+    tsne_df[ENVIRONMENTAL_COLUMNS] = combinations[ENVIRONMENTAL_COLUMNS]
+    return envcluster_df, tsne_df
+
+
+def buildEnvironmentalClusters(envcluster_path=ENVCLUSTER_PATH, combinations_path=COMBINATIONS_PATH, **params):
+    datastore.refreshStore()
+    envcluster_df, tsne_df = environmentalClusters(pd.read_parquet(datastore.STORE_PATH), **params)
+    envcluster_df.to_parquet(envcluster_path)
+    tsne_df.to_parquet(combinations_path)
+    writeFingerprint(envcluster_path, combinations_path)
+    return envcluster_df, tsne_df
+
+
+def fingerprintPath(envcluster_path=ENVCLUSTER_PATH) -> str:
+    return envcluster_path + ".digest.json"
+
+
+def artifactFiles(envcluster_path, combinations_path) -> list:
+    # both files of a build, an older build may lack the combinations
+    return [path for path in [envcluster_path, combinations_path] if os.path.exists(path)]
+
+
+def writeFingerprint(envcluster_path=ENVCLUSTER_PATH, combinations_path=COMBINATIONS_PATH) -> str:
+    # the digest is computed once when the artifacts are built, readers only compare their modification times
+    files = artifactFiles(envcluster_path, combinations_path)
+    digest = hashlib.sha256("|".join(datastore.fileDigest(path) for path in files).encode()).hexdigest()[:16]
+    fingerprint = {"mtime": [os.path.getmtime(path) for path in files], "digest": digest}
+    path = fingerprintPath(envcluster_path)
+    with open(path + ".tmp", "w") as f:
+        json.dump(fingerprint, f)
+    os.replace(path + ".tmp", path)
+    return fingerprint["digest"]
+
+
+def artifactFingerprint(envcluster_path=ENVCLUSTER_PATH, combinations_path=COMBINATIONS_PATH) -> str:
+    # identifies this build of the clusters and their combinations, results derived from either are keyed by it
+    path = fingerprintPath(envcluster_path)
+    if os.path.exists(path):
+        with open(path) as f:
+            fingerprint = json.load(f)
+        if fingerprint["mtime"] == [os.path.getmtime(path) for path in artifactFiles(envcluster_path, combinations_path)]:
+            return fingerprint["digest"]
+    # an artifact copied in or built before digests were recorded
+    return writeFingerprint(envcluster_path, combinations_path)
+
+
+if __name__ == "__main__":
+    # offline: python -m src.envclustering
+    envcluster_df, tsne_df = buildEnvironmentalClusters()
+    print(f"{len(tsne_df)} combinations, {tsne_df['labels'].nunique()} labels, {len(envcluster_df)} crashes")
@@ -0,0 +1,64 @@
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+import streamlit as st
+from src.datastore import datasetFingerprint
+from src.regression import ENVIRONMENTAL_COLUMNS
+from src import aggregates, instrumentation
+
+FACTOR_COLUMNS = [*ENVIRONMENTAL_COLUMNS, "SEVERITY"]
+
+
+def buildFactorCube(crashsite_df) -> pd.DataFrame:
+    # crash counts per combination of the environmental factors and severity, categorical columns so
+    # each key is stored as an integer code, missing values are kept as their own key
+    grouped = crashsite_df[FACTOR_COLUMNS].astype("category").groupby(FACTOR_COLUMNS, observed=True, dropna=False)
+    return grouped.size().rename("count").reset_index()
+
+
+def factorCubePiece(crashsite_df) -> pd.DataFrame:
+    return buildFactorCube(crashsite_df).set_index(FACTOR_COLUMNS)
+
+
+aggregates.register("factors", factorCubePiece, columns=FACTOR_COLUMNS)
+
+
+@st.cache_data
+def loadFactorCube(fingerprint) -> pd.DataFrame:
+    # sum of the per month pieces, an appended month only adds its own
+    return aggregates.updateAggregate("factors").reset_index()
+
+
+def parcatsFigure(cube):
+    # one path per combination weighted by its count instead of one per crash
+    complete = cube.dropna(subset=FACTOR_COLUMNS)
+    return go.Figure(go.Parcats(
+        dimensions=[{"label": column, "values": complete[column].astype(str)} for column in FACTOR_COLUMNS],
+        counts=complete["count"],
+    ))
+
+
+def sunburstFigure(cube):
+    complete = cube.dropna(subset=FACTOR_COLUMNS)
+    return px.sunburst(complete.astype({column: str for column in FACTOR_COLUMNS}), path=FACTOR_COLUMNS, values="count")
+
+
+def polarFigure(cube, column):
+    # same order as value_counts of the column
+    counts = cube.groupby(column, observed=True)["count"].sum().sort_values(ascending=False)
+    return px.line_polar(r=counts.values, theta=counts.index.astype(str), line_close=True, title=f"{column} Distribution")
+
+
+@st.cache_data(persist="disk")
+def factorFigures(fingerprint) -> dict:
+    cube = loadFactorCube(fingerprint)
+    figures = {"parcats": parcatsFigure(cube).to_json(), "sunburst": sunburstFigure(cube).to_json()}
+    for column in ENVIRONMENTAL_COLUMNS:
+        figures[column] = polarFigure(cube, column).to_json()
+    return figures
+
+
+@instrumentation.stage()
+def getFactorFigures() -> dict:
+    return {name: pio.from_json(fig_json) for name, fig_json in factorFigures(datasetFingerprint()).items()}
@@ -0,0 +1,59 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+
+# VicGrid94, metres with low distortion across Victoria
+PROJECTED_CRS = 3111
+SQRT3 = np.sqrt(3)
+# cell ids pack the axial (q, r) coordinates into one int64
+ID_OFFSET = 1 << 20
+ID_BITS = 21
+
+
+def encodeCells(q, r) -> np.ndarray:
+    return ((np.asarray(q, dtype=np.int64) + ID_OFFSET) << ID_BITS) | (np.asarray(r, dtype=np.int64) + ID_OFFSET)
+
+
+def decodeCells(cell_ids):
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+    return (cell_ids >> ID_BITS) - ID_OFFSET, (cell_ids & ((1 << ID_BITS) - 1)) - ID_OFFSET
+
+
+def hexCellIds(x, y, size) -> np.ndarray:
+    # pointy top hexagons of circumradius `size`, point -> fractional axial coordinates -> cube rounding
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    q = (SQRT3 / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    s = -q - r
+
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return encodeCells(rq, rr)
+
+
+def hexCentres(cell_ids, size):
+    q, r = decodeCells(cell_ids)
+    return size * SQRT3 * (q + r / 2), size * 1.5 * r
+
+
+def hexPolygons(cell_ids, size, crs=PROJECTED_CRS) -> gpd.GeoSeries:
+    # geometry is only ever built for the cells that are passed in, i.e. the occupied ones
+    x, y = hexCentres(cell_ids, size)
+    angles = np.deg2rad(np.arange(6) * 60 + 30)
+    rings = np.stack([
+        x[:, None] + size * np.cos(angles),
+        y[:, None] + size * np.sin(angles),
+    ], axis=-1)
+    rings = np.concatenate([rings, rings[:, :1]], axis=1)
+    return gpd.GeoSeries(shapely.polygons(rings), index=cell_ids, crs=crs)
+
+
+def binPoints(points_gdf, size) -> np.ndarray:
+    if points_gdf.crs is not None and points_gdf.crs.to_epsg() != PROJECTED_CRS:
+        points_gdf = points_gdf.to_crs(PROJECTED_CRS)
+    return hexCellIds(points_gdf.geometry.x, points_gdf.geometry.y, size)
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from src import hexbin
+
+# hexagon circumradius in metres for each level, finest first
+LEVELS = {
+    "150 m": 150,
+    "1 km": 1000,
+    "5 km": 5000,
+    "25 km": 25000,
+}
+METRIC_COLUMNS = ["TOTAL_PERSONS", "INJ_OR_FATAL", "FATALITY", "SERIOUSINJURY"]
+
+
+def cellSums(joined_df, metric_columns=METRIC_COLUMNS, by=()) -> pd.DataFrame:
+    # additive per cell (and per `by` key, e.g. period) aggregates, means are derived later as sum / count
+    grouped = joined_df.groupby(["grid_id", *by])
+    sums = grouped[metric_columns].sum()
+    sums["count"] = grouped.size()
+    return sums
+
+
+def rollUp(fine_sums, fine_size, coarse_size) -> pd.DataFrame:
+    # each fine cell goes to the coarse cell containing its centre, boundary error is at most one fine cell
+    x, y = hexbin.hexCentres(fine_sums.index.get_level_values("grid_id").to_numpy(), fine_size)
+    coarse_ids = pd.Index(hexbin.hexCellIds(x, y, coarse_size), name="grid_id")
+    other_keys = [fine_sums.index.get_level_values(key) for key in fine_sums.index.names[1:]]
+    return fine_sums.groupby([coarse_ids, *other_keys]).sum()
+
+
+def buildPyramid(crashsite_gdf, levels=LEVELS, metric_columns=METRIC_COLUMNS, by=()) -> pd.DataFrame:
+    sizes = sorted(levels.values())
+    x = crashsite_gdf.geometry.x.to_numpy()
+    y = crashsite_gdf.geometry.y.to_numpy()
+    located = np.isfinite(x) & np.isfinite(y)
+
+    # raw points are binned once at the finest level, every coarser level is rolled up from it
+    finest = pd.DataFrame(crashsite_gdf.loc[located, [*metric_columns, *by]])
+    finest["grid_id"] = hexbin.hexCellIds(x[located], y[located], sizes[0])
+    finest_sums = cellSums(finest, metric_columns, by)
+
+    pyramid = [finest_sums.assign(hex_size=sizes[0])]
+    for size in sizes[1:]:
+        pyramid.append(rollUp(finest_sums, sizes[0], size).assign(hex_size=size))
+    return pd.concat(pyramid).reset_index()
+
+
+def pyramidLevel(pyramid, hex_size) -> pd.DataFrame:
+    return pyramid[pyramid["hex_size"] == hex_size].drop(columns="hex_size").set_index("grid_id")
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import norm
+
+# share of time steps a cell must be significant in to count as persistent / historical
+PERSISTENCE = 0.9
+ALPHA = 0.05
+CATEGORIES = ["New", "Consecutive", "Intensifying", "Persistent", "Diminishing", "Sporadic", "Oscillating", "Historical"]
+
+
+def getisOrdGiStar(W, X) -> np.ndarray:
+    # Gi* z-score of every cell (rows) in every time step (columns), binary weights with the cell itself included
+    W = sparse.csr_matrix(W, dtype=float)
+    W.data[:] = 1
+    W = (W + sparse.identity(W.shape[0], format="csr")).tocsr()
+    W.data[:] = 1
+    X = X.toarray() if sparse.issparse(X) else np.asarray(X, dtype=float)
+    n = X.shape[0]
+
+    w_sum = np.asarray(W.sum(axis=1)).ravel()[:, None]
+    w_sq_sum = np.asarray(W.multiply(W).sum(axis=1)).ravel()[:, None]
+    mean = X.mean(axis=0)
+    std = np.sqrt((X ** 2).mean(axis=0) - mean ** 2)
+    denominator = std * np.sqrt((n * w_sq_sum - w_sum ** 2) / (n - 1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = ((W @ X) - mean * w_sum) / denominator
+    # a time step without any variation has no hot or cold spots
+    return np.nan_to_num(z, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def mannKendall(Z):
+    # trend test of every row of Z over its columns (time), returns (S, z, p) per row
+    Z = np.asarray(Z, dtype=float)
+    n_cells, t = Z.shape
+    S = np.zeros(n_cells)
+    for lag in range(1, t):
+        S += np.sign(Z[:, lag:] - Z[:, :-lag]).sum(axis=1)
+
+    # tie correction from the run lengths of equal values in every sorted row
+    ordered = np.sort(Z, axis=1)
+    starts = np.ones_like(ordered, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    run_rows = np.nonzero(starts)[0]
+    run_starts = np.flatnonzero(starts.ravel())
+    run_lengths = np.diff(np.append(run_starts, starts.size))
+    ties = np.bincount(run_rows, weights=run_lengths * (run_lengths - 1) * (2 * run_lengths + 5), minlength=n_cells)
+    variance = (t * (t - 1) * (2 * t + 5) - ties) / 18
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = np.where(variance > 0, (S - np.sign(S)) / np.sqrt(variance), 0.0)
+    return S, z, 2 * norm.sf(np.abs(z))
+
+
+def classify(significant, opposite, trend, persistence=PERSISTENCE) -> np.ndarray:
+    # emerging hot spot rules for one side (hot or cold), significant/opposite are cells x time masks,
+    # trend is +1 intensifying, -1 diminishing, 0 without a significant trend
+    n_cells, t = significant.shape
+    final = significant[:, -1]
+    persistent = significant.mean(axis=1) >= persistence
+    ever_before = significant[:, :-1].any(axis=1)
+    ever_opposite = opposite.any(axis=1)
+
+    # last step that was not significant, the final run starts after it
+    not_significant = ~significant
+    last_gap = np.where(not_significant.any(axis=1), t - 1 - np.argmax(not_significant[:, ::-1], axis=1), -1)
+    significant_so_far = np.cumsum(significant, axis=1)[np.arange(n_cells), np.maximum(last_gap - 1, 0)]
+    significant_before_run = (last_gap >= 1) & (significant_so_far > 0)
+
+    return np.select(
+        [
+            final & ~ever_before,
+            final & ~persistent & ~significant_before_run,
+            final & persistent & (trend > 0),
+            final & persistent & (trend == 0),
+            final & persistent & (trend < 0),
+            final & ~persistent & ~ever_opposite,
+            final & ~persistent & ever_opposite,
+            ~final & persistent,
+        ],
+        CATEGORIES,
+        default="",
+    )
+
+
+def emergingHotSpots(cube, w, column="count", alpha=ALPHA) -> pd.DataFrame:
+    # category of every cell from the Gi* z-scores of each period and their Mann-Kendall trend
+    Z = getisOrdGiStar(w, cube["values"][column])
+    _, trend_z, trend_p = mannKendall(Z)
+    critical = norm.isf(alpha / 2)
+    hot, cold = Z > critical, Z < -critical
+    trend = np.where(trend_p < alpha, np.sign(trend_z), 0)
+
+    hot_category = classify(hot, cold, trend)
+    cold_category = classify(cold, hot, -trend)
+    category = np.where(hot_category != "", np.char.add(hot_category.astype(str), " Hot Spot"),
+                        np.where(cold_category != "", np.char.add(cold_category.astype(str), " Cold Spot"), "No Pattern Detected"))
+    return pd.DataFrame({
+        "category": category,
+        "trend_z": trend_z,
+        "trend_p": trend_p,
+        "hot_share": hot.mean(axis=1),
+        "cold_share": cold.mean(axis=1),
+        "final_gi_z": Z[:, -1],
+    }, index=cube["cells"])
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import resource
+import functools
+import threading
+import contextlib
+import pandas as pd
+import streamlit as st
+
+# wall time, peak memory, rows and cache hit/miss of every instrumented stage, one line per stage
+# in the log and the stages of the current rerun in the sidebar; peak_mb is the high water mark of the
+# whole process while the stage ran, concurrent sessions and pool jobs included
+LOG_PATH = "out/logs/stages.jsonl"
+# a thread that never draws the panel keeps at most this many stages
+MAX_RECORDS = 1000
+
+# streamlit runs every rerun of a session in its own script thread
+_local = threading.local()
+# stages running in any thread, the high water mark is only reset when the first one starts
+_running = 0
+_runningLock = threading.Lock()
+_logPath = LOG_PATH
+
+
+def resetPeakRSS() -> bool:
+    # linux resets the process high water mark on request, tracemalloc would slow every stage down
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peakRSS() -> float:
+    # high water mark of the process in MB since the last reset, native allocations included
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    # ru_maxrss is in KB on linux and never reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rowCount(result):
+    # rows of a frame or array, of the first one in a tuple
+    if isinstance(result, tuple):
+        result = next((item for item in result if hasattr(item, "shape")), None)
+    shape = getattr(result, "shape", None)
+    return int(shape[0]) if shape else None
+
+
+def sessionId():
+    # a scheduled job logs under the session that submitted it
+    if getattr(_local, "session", None) is not None:
+        return _local.session
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except (ImportError, TypeError):
+        return None
+    return ctx.session_id if ctx is not None else None
+
+
+def _state():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+        _local.records = []
+    return _local
+
+
+@contextlib.contextmanager
+def collect(session=None):
+    # the stages of work done for another thread, e.g. a scheduler job, kept apart from this thread's own
+    state = _state()
+    saved = state.stack, state.records, getattr(state, "session", None)
+    state.stack, state.records, state.session = [], [], session
+    try:
+        yield state.records
+    finally:
+        state.stack, state.records, state.session = saved
+
+
+def merge(records):
+    # stages collected in another thread, nested under the stage this thread is running
+    state = _state()
+    depth = len(state.stack)
+    state.records.extend({**entry, "depth": entry["depth"] + depth} for entry in records)
+    del state.records[:-MAX_RECORDS]
+
+
+def setLogPath(path):
+    # e.g. the benchmark, so its stages stay out of the app's log
+    global _logPath
+    _logPath = path
+
+
+def writeLog(entry, log_path=None):
+    # short appended lines do not interleave between sessions or processes
+    log_path = log_path or _logPath
+    try:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with open(log_path, "a") as f:
+            f.write(json.dumps({"time": round(time.time(), 3), "session": sessionId(), "pid": os.getpid(), **entry}) + "\n")
+    except OSError:
+        pass
+
+
+def record(stage, seconds, peak_mb=None, rows=None, cache=None):
+    # a stage measured elsewhere, e.g. a pipeline node in a worker, nested under the running stage
+    state = _state()
+    entry = {"stage": stage, "seconds": round(seconds, 4), "peak_mb": None if peak_mb is None else round(peak_mb, 1),
+             "rows": rows, "cache": cache, "depth": len(state.stack)}
+    state.records.append(entry)
+    del state.records[:-MAX_RECORDS]
+    writeLog(entry)
+    return entry
+
+
+@contextlib.contextmanager
+def measure(stage):
+    # resetting the process wide mark inside a running stage would lose what that stage (in this or
+    # another thread) reached, so only a stage starting while none runs resets it and a stage's peak
+    # can include memory of stages running alongside it
+    global _running
+    state = _state()
+    entry = {"stage": stage, "seconds": None, "peak_mb": None, "rows": None, "cache": None, "depth": len(state.stack)}
+    state.records.append(entry)
+    del state.records[:-MAX_RECORDS]
+    state.stack.append(entry)
+    with _runningLock:
+        if _running == 0:
+            resetPeakRSS()
+        _running += 1
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry["seconds"] = round(time.perf_counter() - start, 4)
+        entry["peak_mb"] = round(max(entry["peak_mb"] or 0, peakRSS()), 1)
+        with _runningLock:
+            _running -= 1
+        state.stack.pop()
+        writeLog(entry)
+
+
+def stage(name=None, cache=None):
+    # times every call of the function; with `cache` (st.cache_data, st.cache_resource or either with
+    # arguments) the function is cached inside the measurement and a call that skips the body is a hit
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def body(*args, **kwargs):
+            _state().stack[-1]["cache"] = "miss"
+            return func(*args, **kwargs)
+
+        cached = cache(body) if cache is not None else func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(label) as entry:
+                if cache is not None:
+                    entry["cache"] = "hit"
+                result = cached(*args, **kwargs)
+                entry["rows"] = rowCount(result)
+            return result
+
+        if cache is not None:
+            wrapper.clear = cached.clear
+        return wrapper
+
+    return decorate
+
+
+def plotlyChart(fig, **kwargs):
+    # figure serialisation happens inside st.plotly_chart
+    title = fig.layout.title.text or (fig.data[0].type if fig.data else "figure")
+    with measure(f"plotly_chart {title}"):
+        return st.plotly_chart(fig, **kwargs)
+
+
+def sidebarPanel():
+    # stages since the panel was last drawn, i.e. of this rerun; called at the end of every page
+    state = _state()
+    records, state.records = state.records, []
+    if not st.sidebar.toggle("Stage timings", key="show_stage_timings"):
+        return
+    if not records:
+        st.sidebar.caption("No instrumented stage ran in this rerun.")
+        return
+    stages_df = pd.DataFrame(records)
+    top = stages_df[stages_df["depth"] == 0]
+    st.sidebar.caption(f"{top['seconds'].sum():.2f} s in {len(top)} stages, "
+                       f"{(stages_df['cache'] == 'hit').sum()} cache hits, {(stages_df['cache'] == 'miss').sum()} misses")
+    stages_df["stage"] = ["· " * depth + stage for depth, stage in zip(stages_df["depth"], stages_df["stage"])]
+    st.sidebar.dataframe(stages_df.drop(columns="depth"), hide_index=True)
@@ -0,0 +1,47 @@
+import os
+import json
+import tempfile
+import numpy as np
+import shapely
+
+# served by streamlit static file serving (.streamlit/config.toml), the browser fetches and caches each grid once
+STATIC_DIR = "static/grids"
+STATIC_URL = "app/static/grids"
+# ~1 m at Victoria's latitude
+COORDINATE_PRECISION = 1e-5
+
+
+def encodeCellGeometry(geometry) -> str:
+    # compact geojson with only ids and quantized coordinates, no properties; a hexagon has nothing to simplify
+    geoms = shapely.set_precision(geometry.to_numpy(), COORDINATE_PRECISION)
+    features = [
+        {"type": "Feature", "id": str(cell_id), "geometry": shapely.geometry.mapping(geom)}
+        for cell_id, geom in zip(geometry.index, geoms)
+    ]
+    return json.dumps({"type": "FeatureCollection", "features": features}, separators=(",", ":"))
+
+
+def cellGeometryURL(geometry, key) -> str:
+    # geometry is encoded once per grid key, figures only reference it by url
+    path = os.path.join(STATIC_DIR, f"{key}.geojson")
+    if not os.path.exists(path):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        # a unique temporary file, sessions of every server process may encode the same grid at once
+        fd, tmp_path = tempfile.mkstemp(dir=STATIC_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(encodeCellGeometry(geometry.to_crs(4326)))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return f"{STATIC_URL}/{key}.geojson"
+
+
+def cellLocations(index) -> list:
+    return [str(cell_id) for cell_id in index]
+
+
+def rankPct(values, decimals=4) -> np.ndarray:
+    # only these values change between figures of the same grid
+    return np.round(values.rank(pct=True).to_numpy(dtype=float), decimals)
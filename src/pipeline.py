@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import hashlib
+import inspect
+import pickle
+import functools
+from concurrent.futures import wait, FIRST_COMPLETED
+from joblib.externals.loky import get_reusable_executor
+from src import instrumentation, scheduler
+
+# graphs use the dask spec, {name: (func, *args)} where a string arg naming another node is a dependency
+CACHE_DIR = "out/cache/pipeline"
+# modules of this package are part of a function's version, library code is not
+PACKAGE = __name__.split(".")[0]
+
+
+def getExecutor(max_workers=None):
+    # reusable pool of clean worker interpreters (loky does not re-run the page script as __main__),
+    # geopandas work there does not hold the server's GIL
+    return get_reusable_executor(max_workers=max_workers or os.cpu_count())
+
+
+def dependencies(dsk, name) -> list:
+    return [arg for arg in dsk[name][1:] if isinstance(arg, str) and arg in dsk]
+
+
+def sourceOf(obj) -> str:
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        return ""
+
+
+@functools.lru_cache(maxsize=None)
+def fileToken(path, mtime) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def moduleToken(module) -> str:
+    # hashed once per version of the file
+    path = getattr(module, "__file__", None)
+    if path is None or not os.path.exists(path):
+        return f"{module.__name__}:{hashlib.sha256(sourceOf(module).encode()).hexdigest()[:16]}"
+    return f"{module.__name__}:{fileToken(path, os.path.getmtime(path))}"
+
+
+def packageModules(namespace) -> list:
+    # the modules of this package a namespace refers to (imported or through an imported name), and theirs in turn
+    found, stack = {}, [namespace]
+    while stack:
+        for value in list(stack.pop().values()):
+            try:
+                name = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+            except Exception:
+                continue
+            if isinstance(name, str) and name.split(".")[0] == PACKAGE and name not in found and name in sys.modules:
+                found[name] = sys.modules[name]
+                stack.append(vars(found[name]))
+    return [found[name] for name in sorted(found)]
+
+
+def functionToken(func) -> str:
+    # the function's source and the source of every package module it can reach, so editing a step or
+    # a helper it calls (spatialstats, hexbin, ...) invalidates the artifacts built with it
+    func = inspect.unwrap(func)
+    digest = hashlib.sha256(sourceOf(func).encode())
+    for module in packageModules(getattr(func, "__globals__", {})):
+        digest.update(moduleToken(module).encode())
+    return f"{func.__module__}.{func.__qualname__}:{digest.hexdigest()[:16]}"
+
+
+def nodeKeys(dsk) -> dict:
+    # content address of every node from its function, literal parameters and the keys of its inputs
+    keys = {}
+
+    def key(name):
+        if name not in keys:
+            func, *args = dsk[name]
+            digest = hashlib.sha256(functionToken(func).encode())
+            for arg in args:
+                if isinstance(arg, str) and arg in dsk:
+                    digest.update(b"ref:" + key(arg).encode())
+                else:
+                    digest.update(b"value:" + pickle.dumps(arg, protocol=4))
+            keys[name] = f"{name}-{digest.hexdigest()[:24]}"
+        return keys[name]
+
+    for name in dsk:
+        key(name)
+    return keys
+
+
+def artifactPath(key, cache_dir=CACHE_DIR) -> str:
+    return os.path.join(cache_dir, f"{key}.pkl")
+
+
+def loadArtifact(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _computeNode(func, args, path):
+    # runs in a worker, inputs are read from and the result written to the artifact cache,
+    # returns the worker's wall time, peak memory and rows of the node
+    instrumentation.resetPeakRSS()
+    start = time.perf_counter()
+    values = [loadArtifact(value) if kind == "ref" else value for kind, value in args]
+    result = func(*values)
+    seconds = time.perf_counter() - start
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + f".{os.getpid()}.tmp", "wb") as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + f".{os.getpid()}.tmp", path)
+    return seconds, instrumentation.peakRSS(), instrumentation.rowCount(result)
+
+
+def run(dsk, outputs, cache_dir=CACHE_DIR, executor=None):
+    keys = nodeKeys(dsk)
+    paths = {name: artifactPath(keys[name], cache_dir) for name in dsk}
+    targets = [outputs] if isinstance(outputs, str) else list(outputs)
+
+    # only nodes without a persisted artifact, and the missing inputs they need, are computed
+    missing, persisted = set(), set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name in missing or name in persisted:
+            continue
+        if os.path.exists(paths[name]):
+            persisted.add(name)
+            instrumentation.record(f"pipeline {name}", 0.0, cache="hit")
+            continue
+        missing.add(name)
+        stack.extend(dependencies(dsk, name))
+
+    executor = executor or getExecutor()
+    running = {}
+    computed, total = 0, len(missing)
+    while missing or running:
+        busy = missing | set(running.values())
+        for name in [name for name in missing if not set(dependencies(dsk, name)) & busy]:
+            func, *args = dsk[name]
+            args = [("ref", paths[arg]) if isinstance(arg, str) and arg in dsk else ("value", arg) for arg in args]
+            running[executor.submit(_computeNode, func, args, paths[name])] = name
+            missing.discard(name)
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            seconds, peak_mb, rows = future.result()
+            instrumentation.record(f"pipeline {name}", seconds, peak_mb, rows, cache="miss")
+            computed += 1
+            scheduler.reportProgress(computed / total, f"{name} computed")
+        # nodes already running still persist their artifacts for the next run
+        scheduler.checkCancelled()
+
+    results = [loadArtifact(paths[name]) for name in targets]
+    return results[0] if isinstance(outputs, str) else results
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# below DETAIL_ZOOM points are drawn as density cells, at or above it only the points in view are sent
+ZOOM_LEVELS = range(4, 13)
+DETAIL_ZOOM = 13
+# density cell edge in screen pixels at its zoom
+BIN_PIXELS = 8
+TILE_PIXELS = 256
+# upper bound on raw markers in one layer, the rest is decimated
+MAX_POINTS = 20_000
+
+
+def mercator(lat, lon):
+    # web mercator world coordinates in [0, 1), the projection mapbox tiles are laid out in
+    lat = np.clip(np.asarray(lat, dtype=float), -85.05, 85.05)
+    x = (np.asarray(lon, dtype=float) + 180) / 360
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) / (2 * np.pi)
+    return x, y
+
+
+def densityCells(lat, lon, zoom, bin_pixels=BIN_PIXELS) -> pd.DataFrame:
+    # one marker per occupied screen cell at this zoom, placed at the mean of its points
+    bins = 2 ** zoom * TILE_PIXELS / bin_pixels
+    x, y = mercator(lat, lon)
+    cells = pd.DataFrame({
+        "cell": np.floor(x * bins).astype(np.int64) * int(bins) + np.floor(y * bins).astype(np.int64),
+        "LATITUDE": lat,
+        "LONGITUDE": lon,
+    })
+    return cells.groupby("cell").agg(
+        LATITUDE=("LATITUDE", "mean"),
+        LONGITUDE=("LONGITUDE", "mean"),
+        count=("LATITUDE", "size"),
+    ).reset_index(drop=True)
+
+
+def densityPyramid(lat_long_df, zooms=ZOOM_LEVELS) -> dict:
+    lat = lat_long_df["LATITUDE"].to_numpy(dtype=float)
+    lon = lat_long_df["LONGITUDE"].to_numpy(dtype=float)
+    located = np.isfinite(lat) & np.isfinite(lon)
+    return {zoom: densityCells(lat[located], lon[located], zoom) for zoom in zooms}
+
+
+def decimate(points_df, max_points=MAX_POINTS, seed=0) -> pd.DataFrame:
+    # a fixed random order so the same rows are kept on every rerun, and a smaller sample is a prefix of a larger one
+    if len(points_df) <= max_points:
+        return points_df
+    order = np.random.default_rng(seed).permutation(len(points_df))
+    return points_df.iloc[np.sort(order[:max_points])]
+
+
+def viewport(center_lat, center_lon, zoom, width_px=1200, height_px=600):
+    # (lat_min, lat_max, lon_min, lon_max) visible in a map of this size
+    scale = 2 ** zoom * TILE_PIXELS
+    x, y = mercator(center_lat, center_lon)
+    x0, x1 = x - width_px / 2 / scale, x + width_px / 2 / scale
+    y0, y1 = y - height_px / 2 / scale, y + height_px / 2 / scale
+    lat_of = lambda y: np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y))))
+    return lat_of(y1), lat_of(y0), x0 * 360 - 180, x1 * 360 - 180
+
+
+def inViewport(points_df, bounds) -> pd.DataFrame:
+    lat_min, lat_max, lon_min, lon_max = bounds
+    return points_df[
+        points_df["LATITUDE"].between(lat_min, lat_max) & points_df["LONGITUDE"].between(lon_min, lon_max)
+    ]
+
+
+def levelOfDetail(points_df, pyramid, zoom, center, max_points=MAX_POINTS):
+    # ("density", cells) when zoomed out, ("points", rows in view) when zoomed in
+    if zoom < DETAIL_ZOOM:
+        level = min(max(zoom, min(pyramid)), max(pyramid))
+        return "density", pyramid[level]
+    return "points", decimate(inViewport(points_df, viewport(*center, zoom)), max_points)
@@ -0,0 +1,146 @@
+import os
+import sys
+import pickle
+import threading
+import pandas as pd
+from src import datastore, pipeline
+
+PROFILE_DIR = "out/cache/profiles"
+PARTITION_DIR = "out/cache/profiles/partitions"
+# rows profiled by the interactive report, the full report is built offline
+SAMPLE_ROWS = 50_000
+TOP_VALUES = 5
+# reports a page request may build in the background, the others are only served once built offline
+BACKGROUND_MODES = ("minimal",)
+
+# reports being built by this server process, so each is submitted once; a failed build stays here
+# until a visitor asks for a retry, so reruns show its error instead of starting it again
+_pending = {}
+_pendingLock = threading.Lock()
+
+
+def reportPath(fingerprint, mode, extension="html") -> str:
+    return os.path.join(PROFILE_DIR, f"{fingerprint}-{mode}.{extension}")
+
+
+def buildReport(fingerprint, mode="minimal", store_path=datastore.STORE_PATH) -> str:
+    # runs in a worker, writes the html and json report of the stored dataset
+    from pandas_profiling import ProfileReport
+
+    df = pd.read_parquet(store_path)
+    if mode == "minimal":
+        df = df.sample(min(SAMPLE_ROWS, len(df)), random_state=0).sort_index()
+        report = ProfileReport(df, minimal=True, title=f"Road crashes ({len(df)} row sample)")
+    else:
+        report = ProfileReport(df, title="Road crashes")
+
+    path = reportPath(fingerprint, mode)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    for extension, content in [("json", report.to_json()), ("html", report.to_html())]:
+        target = reportPath(fingerprint, mode, extension)
+        with open(target + f".{os.getpid()}.tmp", "w") as f:
+            f.write(content)
+        os.replace(target + f".{os.getpid()}.tmp", target)
+    return path
+
+
+def existingReport(fingerprint, mode) -> str:
+    path = reportPath(fingerprint, mode)
+    return path if os.path.exists(path) else None
+
+
+def requestReport(fingerprint, mode="minimal", executor=None):
+    # path of the persisted report, or None while it is built in the background
+    path = existingReport(fingerprint, mode)
+    if path is not None:
+        return path
+    if mode not in BACKGROUND_MODES:
+        raise ValueError(f"the {mode} report is built offline with `python -m src.profiling {mode}`")
+    key = (fingerprint, mode)
+    with _pendingLock:
+        if key not in _pending:
+            _pending[key] = (executor or pipeline.getExecutor()).submit(buildReport, fingerprint, mode)
+        future = _pending[key]
+    if future.done() and future.exception() is None:
+        return future.result()
+    return None
+
+
+def reportError(fingerprint, mode="minimal"):
+    future = _pending.get((fingerprint, mode))
+    return future.exception() if future is not None and future.done() else None
+
+
+def retryReport(fingerprint, mode="minimal"):
+    # forgets a failed build, the next request submits it again
+    with _pendingLock:
+        future = _pending.get((fingerprint, mode))
+        if future is not None and future.done() and future.exception() is not None:
+            del _pending[(fingerprint, mode)]
+
+
+def partitionStatistics(df) -> dict:
+    # mergeable per column aggregates of one partition, sums and counts rather than means
+    statistics = {}
+    for column in df.columns:
+        values = df[column]
+        stats = {"count": int(values.count()), "missing": int(values.isna().sum())}
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            numbers = values.dropna().astype(float)
+            stats.update(sum=numbers.sum(), sum_sq=(numbers ** 2).sum(), min=numbers.min(), max=numbers.max())
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            stats.update(min=values.min(), max=values.max())
+        else:
+            stats["value_counts"] = values.value_counts(dropna=True)
+        statistics[column] = stats
+    return statistics
+
+
+def cachedPartitionStatistics(name, digest, store_path=datastore.STORE_PATH, partition_dir=PARTITION_DIR) -> dict:
+    # keyed by the digest the store manifest records for the partition file, an appended month is the
+    # only partition without an entry and nothing is hashed again
+    path = os.path.join(partition_dir, f"{name}-{digest}.pkl")
+    if os.path.exists(path):
+        return pipeline.loadArtifact(path)
+    statistics = partitionStatistics(datastore.loadPartition(name, store_path=store_path))
+    os.makedirs(partition_dir, exist_ok=True)
+    with open(path + f".{os.getpid()}.tmp", "wb") as f:
+        pickle.dump(statistics, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + f".{os.getpid()}.tmp", path)
+    return statistics
+
+
+def mergeStatistics(partitions) -> pd.DataFrame:
+    rows = {}
+    for column in partitions[0]:
+        parts = [partition[column] for partition in partitions]
+        count = sum(part["count"] for part in parts)
+        row = {"count": count, "missing": sum(part["missing"] for part in parts)}
+        row["missing_pct"] = row["missing"] / max(count + row["missing"], 1) * 100
+        if "sum" in parts[0]:
+            total = sum(part["sum"] for part in parts)
+            mean = total / count if count else float("nan")
+            variance = (sum(part["sum_sq"] for part in parts) - count * mean ** 2) / (count - 1) if count > 1 else float("nan")
+            row.update(mean=mean, std=max(variance, 0) ** 0.5, min=pd.Series([part["min"] for part in parts]).min(),
+                       max=pd.Series([part["max"] for part in parts]).max())
+        elif "value_counts" in parts[0]:
+            counts = pd.concat([part["value_counts"] for part in parts]).groupby(level=0, observed=True).sum()
+            counts = counts[counts > 0].sort_values(ascending=False)
+            row.update(distinct=len(counts), top=", ".join(f"{value} ({n})" for value, n in counts.head(TOP_VALUES).items()))
+        else:
+            row.update(min=pd.Series([part["min"] for part in parts]).min(),
+                       max=pd.Series([part["max"] for part in parts]).max())
+        rows[column] = row
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def columnSummary(store_path=datastore.STORE_PATH, manifest_path=datastore.MANIFEST_PATH) -> pd.DataFrame:
+    # one partition per accident month of the store
+    digests = datastore.readManifest(manifest_path)["partitions"]
+    return mergeStatistics([cachedPartitionStatistics(name, digests[name], store_path) for name in sorted(digests)])
+
+
+if __name__ == "__main__":
+    # offline: python -m src.profiling [minimal|full]
+    mode = sys.argv[1] if len(sys.argv) > 1 else "full"
+    print(buildReport(datastore.datasetFingerprint(), mode))
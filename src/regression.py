@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.linear_model import LinearRegression
+
+REGRESSION_DIR = "out/cache/regression"
+ENVIRONMENTAL_COLUMNS = ["ALCOHOLTIME", "LIGHT_CONDITION", "ROAD_GEOMETRY", "SPEED_ZONE", "RMA"]
+SEVERITY_METRICS = ["INJ_OR_FATAL", "FATALITY", "SERIOUSINJURY", "OTHERINJURY", "NONINJURED"]
+NORM_COLUMN = "TOTAL_PERSONS"
+CLUSTER_COLUMN = "predicted_environmental_cluster"
+
+
+def oneHotIndicators(df, columns=ENVIRONMENTAL_COLUMNS):
+    # sparse equivalent of pd.get_dummies(df[columns]), one stored entry per crash and column
+    blocks, names = [], []
+    for column in columns:
+        categorical = pd.Categorical(df[column])
+        codes = categorical.codes
+        located = codes >= 0
+        blocks.append(sparse.csr_matrix(
+            (np.ones(located.sum()), (np.flatnonzero(located), codes[located])),
+            shape=(len(df), len(categorical.categories)),
+        ))
+        names += [f"{column}_{category}" for category in categorical.categories]
+    return sparse.hstack(blocks, format="csr"), names
+
+
+def clusterDesign(df, columns=ENVIRONMENTAL_COLUMNS, cluster_column=CLUSTER_COLUMN):
+    # share of each cluster's crashes in every category, i.e. get_dummies(...).groupby(cluster).mean()
+    indicators, names = oneHotIndicators(df, columns)
+    clusters, membership = np.unique(df[cluster_column].to_numpy(), return_inverse=True)
+    counts = np.bincount(membership, minlength=len(clusters))
+    G = sparse.csr_matrix(
+        (1 / counts[membership], (membership, np.arange(len(df)))), shape=(len(clusters), len(df))
+    )
+    return (G @ indicators).tocsr(), clusters, names
+
+
+def clusterTargets(df, clusters, metrics=SEVERITY_METRICS, norm=NORM_COLUMN, cluster_column=CLUSTER_COLUMN) -> pd.DataFrame:
+    # per person rates of every metric averaged per cluster, rows in the order of the design matrix
+    rates = df[metrics].div(df[norm], axis=0)
+    return rates.groupby(df[cluster_column]).mean().loc[clusters]
+
+
+def designPath(fingerprint) -> str:
+    return os.path.join(REGRESSION_DIR, f"{fingerprint}-design.npz")
+
+
+def loadDesign(df, fingerprint):
+    path = designPath(fingerprint)
+    if os.path.exists(path):
+        stored = np.load(path)
+        X = sparse.csr_matrix((stored["data"], stored["indices"], stored["indptr"]), shape=tuple(stored["shape"]))
+        return X, stored["clusters"], stored["columns"].tolist()
+
+    X, clusters, names = clusterDesign(df)
+    os.makedirs(REGRESSION_DIR, exist_ok=True)
+    np.savez(path, data=X.data, indices=X.indices, indptr=X.indptr, shape=X.shape,
+             clusters=clusters, columns=np.array(names))
+    return X, clusters, names
+
+
+def fitCoefficients(df, fingerprint) -> pd.DataFrame:
+    # one multi-output least squares solve for every metric, the page keeps the coefficients in the result cache
+    X, clusters, names = loadDesign(df, fingerprint)
+    y = clusterTargets(df, clusters)
+    # a few hundred clusters by a few dozen categories, dense is cheaper to solve than lsqr on sparse
+    reg = LinearRegression().fit(X.toarray(), y.to_numpy())
+    coefficients = pd.DataFrame(reg.coef_.T, index=names, columns=y.columns)
+    coefficients.loc["intercept"] = reg.intercept_
+    return coefficients
@@ -0,0 +1,102 @@
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import inspect
+import functools
+from src import instrumentation, pipeline
+
+# results of page computations on disk, keyed by the dataset fingerprint, the version of the code and the
+# explicit parameters, so a lookup never hashes a frame and a data refresh never hits a stale result;
+# every server process reads and writes the same files, the least recently used go first above MAX_BYTES
+RESULT_DIR = "out/cache/results"
+MAX_BYTES = 1 << 30
+
+
+def codeToken(obj) -> str:
+    # a function with the package modules it reaches, or a module when it is not reachable from the function
+    if inspect.ismodule(obj):
+        return pipeline.moduleToken(obj)
+    return pipeline.functionToken(obj)
+
+
+def resultKey(func, depends, args, kwargs) -> str:
+    for value in [*args, *kwargs.values()]:
+        if hasattr(value, "shape"):
+            raise TypeError(f"{func.__qualname__} is keyed by fingerprints and parameters, not by {type(value).__name__}")
+    digest = hashlib.sha256("|".join(codeToken(obj) for obj in [func, *depends]).encode())
+    digest.update(pickle.dumps((args, sorted(kwargs.items())), protocol=4))
+    return digest.hexdigest()[:32]
+
+
+def resultPath(key, result_dir=RESULT_DIR) -> str:
+    return os.path.join(result_dir, f"{key}.pkl")
+
+
+def evict(result_dir=RESULT_DIR, max_bytes=MAX_BYTES):
+    # a hit touches its file, so the oldest modification times are the least recently used
+    entries = []
+    for entry in os.scandir(result_dir):
+        if entry.name.endswith(".pkl"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load(path):
+    # another process may evict the file between the lookup and the read, that is a miss
+    try:
+        with open(path, "rb") as f:
+            result = pickle.load(f)
+        os.utime(path)
+    except (FileNotFoundError, EOFError):
+        return None, False
+    return result, True
+
+
+def store(result, path, result_dir=RESULT_DIR, max_bytes=MAX_BYTES):
+    # a unique temporary file, the writers are the threads of every server process
+    os.makedirs(result_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=result_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict(result_dir, max_bytes)
+
+
+def cached(depends=(), result_dir=RESULT_DIR, max_bytes=MAX_BYTES):
+    # every argument is part of the key, so the function takes a fingerprint of its data instead of the data;
+    # `depends` are the functions or modules whose code the result also depends on
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            path = resultPath(resultKey(func, depends, args, kwargs), result_dir)
+            start = time.perf_counter()
+            result, hit = load(path)
+            if hit:
+                instrumentation.record(f"resultcache {func.__name__}", time.perf_counter() - start,
+                                       rows=instrumentation.rowCount(result), cache="hit")
+                return result
+            result = func(*args, **kwargs)
+            store(result, path, result_dir, max_bytes)
+            return result
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,200 @@
+import os
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, CancelledError, TimeoutError
+import streamlit as st
+from src import instrumentation
+
+# page computations run in a shared pool instead of every session's script thread, concurrent requests
+# for the same function and arguments share one job; a job whose heavy body misses its cache moves to a
+# pool of MAX_JOBS threads and queues there, so cache hits never wait behind heavy work
+MAX_JOBS = max(1, min(4, (os.cpu_count() or 2) // 2))
+MAX_THREADS = 16
+# a job that finishes this quickly (a cache hit) is returned without drawing a status box
+QUIET_SECONDS = 0.2
+POLL_SECONDS = 0.5
+
+# reentrant, cancelling a queued job under the lock runs its done callbacks, which take it again
+_lock = threading.RLock()
+_jobs = {}
+_pool = None
+_heavyPool = None
+# the job a pool thread is running, for progress reports and cancellation checks inside it
+_current = threading.local()
+# the stages a job runs are collected in its pool thread and shown in the sidebar of every session waiting on it
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class _NeedsHeavyWorker(Exception):
+    # raised through the cache decorators by a heavy body in the shared pool, nothing is cached
+    pass
+
+
+class Job:
+    def __init__(self, key, session=None):
+        self.key = key
+        self.session = session
+        self.records = []
+        # resolved by whichever pool finishes the job, `task` is the pool's future of the current attempt
+        self.future = Future()
+        self.task = None
+        self.waiters = 0
+        self.progress = (None, "queued")
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        # a queued job never starts, a running one stops at its next checkCancelled
+        self.cancelled.set()
+        self.future.cancel()
+        if self.task is not None:
+            self.task.cancel()
+
+
+def getPool() -> ThreadPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="scheduler")
+        return _pool
+
+
+def getHeavyPool() -> ThreadPoolExecutor:
+    global _heavyPool
+    with _lock:
+        if _heavyPool is None:
+            _heavyPool = ThreadPoolExecutor(max_workers=MAX_JOBS, thread_name_prefix="scheduler-heavy")
+        return _heavyPool
+
+
+def jobKey(func, args, kwargs) -> str:
+    return f"{func.__module__}.{func.__qualname__}{args!r}{sorted(kwargs.items())!r}"
+
+
+def reportProgress(fraction=None, text=""):
+    # no-op outside a scheduled job, so the same code can run inline
+    job = getattr(_current, "job", None)
+    if job is not None:
+        job.progress = (fraction, text)
+
+
+def checkCancelled():
+    job = getattr(_current, "job", None)
+    if job is not None and job.cancelled.is_set():
+        raise JobCancelled(job.key)
+
+
+def heavy(func):
+    # placed under the cache decorator, so only a miss leaves the shared pool; the job is then run again
+    # from the top in the heavy pool, where the cache is looked up once more and the body runs.
+    # outside a scheduled job (a benchmark, a pipeline worker) the body runs inline
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_current, "job", None) is not None and not getattr(_current, "heavy", False):
+            raise _NeedsHeavyWorker(func.__qualname__)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _runJob(job, func, args, kwargs, heavy_worker=False):
+    # a job that is cancelled while it queues never starts
+    if not heavy_worker and not job.future.set_running_or_notify_cancel():
+        return
+    _current.job, _current.heavy = job, heavy_worker
+    try:
+        with instrumentation.collect(job.session) as records:
+            checkCancelled()
+            job.progress = (None, "running")
+            result = func(*args, **kwargs)
+        job.records = records
+        job.future.set_result(result)
+    except _NeedsHeavyWorker:
+        # the stages of the attempt are dropped, the heavy pool measures the job again
+        job.progress = (None, "waiting for a free worker")
+        _schedule(job, getHeavyPool(), func, args, kwargs, heavy_worker=True)
+    except BaseException as error:
+        job.future.set_exception(error)
+    finally:
+        _current.job, _current.heavy = None, False
+
+
+def _schedule(job, pool, func, args, kwargs, heavy_worker=False):
+    job.task = pool.submit(_runJob, job, func, args, kwargs, heavy_worker)
+    job.task.add_done_callback(lambda task, job=job: _abandoned(job, task))
+    # cancelled between the check in the previous attempt and the submit
+    if job.cancelled.is_set():
+        job.task.cancel()
+
+
+def _abandoned(job, task):
+    # a heavy attempt cancelled in the queue never resolves the running job itself
+    if task.cancelled() and job.future.running():
+        job.future.set_exception(JobCancelled(job.key))
+
+
+def _forget(job):
+    with _lock:
+        if _jobs.get(job.key) is job:
+            del _jobs[job.key]
+
+
+def submit(slot, func, *args, **kwargs) -> Job:
+    # joins the running job with the same key or starts one, the session's previous job in the same
+    # slot is cancelled when it was superseded and nobody waits on it any more
+    key = jobKey(func, args, kwargs)
+    session_jobs = st.session_state.setdefault("scheduled_jobs", {})
+    previous = session_jobs.get(slot)
+    pool = getPool()
+    with _lock:
+        job = _jobs.get(key)
+        if job is None or job.cancelled.is_set():
+            job = Job(key, instrumentation.sessionId())
+            _jobs[key] = job
+            job.future.add_done_callback(lambda future, job=job: _forget(job))
+            _schedule(job, pool, func, args, kwargs)
+        job.waiters += 1
+        superseded = _jobs.get(previous) if previous not in (None, key) else None
+        if superseded is not None and superseded.waiters == 0:
+            superseded.cancel()
+    session_jobs[slot] = key
+    return job
+
+
+def detach(job):
+    with _lock:
+        job.waiters -= 1
+
+
+def wait(job, label):
+    try:
+        result = job.future.result(timeout=QUIET_SECONDS)
+        instrumentation.merge(job.records)
+        return result
+    except TimeoutError:
+        pass
+    # a rerun (e.g. a new form submit) interrupts the script at the next status update
+    with st.status(label) as status:
+        while True:
+            try:
+                result = job.future.result(timeout=POLL_SECONDS)
+            except TimeoutError:
+                fraction, text = job.progress
+                status.update(label=f"{label} ({text}{f', {fraction:.0%}' if fraction is not None else ''})")
+                continue
+            status.update(label=label, state="complete", expanded=False)
+            instrumentation.merge(job.records)
+            return result
+
+
+def run(slot, func, *args, label="Computing", **kwargs):
+    # func(*args, **kwargs) in the pool, the script waits for it with a status box showing its progress
+    job = submit(slot, func, *args, **kwargs)
+    try:
+        return wait(job, label)
+    except CancelledError:
+        raise JobCancelled(job.key)
+    finally:
+        detach(job)
@@ -0,0 +1,87 @@
+import os
+import glob
+import functools
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+from src import instrumentation
+
+# one resident copy of the large frames per server process: parquet sources are converted once to
+# uncompressed Arrow IPC files that are memory mapped, every session gets copy-on-write views of them
+SHARED_DIR = "out/cache/shared"
+
+# the key of every source's resident frame, an older version is dropped when a new one is mapped
+_residentKeys = {}
+_residentLock = threading.Lock()
+
+
+def arrowPath(source, key, shared_dir=SHARED_DIR) -> str:
+    name = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+    return os.path.join(shared_dir, f"{name}-{key}.arrow")
+
+
+def writeArrow(source, path):
+    # one chunk with one dictionary per column, so reading it back needs no unification copy
+    table = pq.read_table(source).unify_dictionaries().combine_chunks()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + f".{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+    # earlier versions of the same source, processes that still map one keep their pages
+    for stale_path in glob.glob(path.rsplit("-", 1)[0] + "-*.arrow"):
+        if stale_path != path:
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+
+
+def mappedTable(source, key) -> pa.Table:
+    path = arrowPath(source, key)
+    if not os.path.exists(path):
+        writeArrow(source, path)
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def sharedView(value):
+    # a shallow copy shares every column, with copy-on-write a write to it copies only what it touches
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=False)
+    if isinstance(value, tuple):
+        return tuple(sharedView(item) for item in value)
+    return value
+
+
+def shared(func=None, **options):
+    # like st.cache_data but the value is computed once per process for every session and never pickled,
+    # callers only ever see views of it so nobody can change the shared copy in place;
+    # `options` go to st.cache_resource, e.g. max_entries=1 for a value keyed by a dataset fingerprint
+    if func is None:
+        return functools.partial(shared, **options)
+    cached = st.cache_resource(func, **options)
+
+    @functools.wraps(func)
+    def view(*args, **kwargs):
+        return sharedView(cached(*args, **kwargs))
+
+    view.clear = cached.clear
+    return view
+
+
+@instrumentation.stage("mappedFrame", cache=shared)
+def residentFrame(source, key) -> pd.DataFrame:
+    # numeric, date and categorical columns point into the mapped file and their arrays are read-only,
+    # an in place write to the shared frame raises instead of changing it for every session
+    return mappedTable(source, key).to_pandas(split_blocks=True)
+
+
+def mappedFrame(source, key) -> pd.DataFrame:
+    # one version per source stays cached, sessions still holding views of the older one keep it alive
+    with _residentLock:
+        previous, _residentKeys[source] = _residentKeys.get(source), key
+    if previous not in (None, key):
+        residentFrame.clear(source, previous)
+    return residentFrame(source, key)
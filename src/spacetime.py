@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src import spatialstats
+
+PERIOD_COLUMN = "ACCIDENT_PERIOD"
+# accident month as "YYYY-MM", years are roll ups of it
+PERIOD_FORMAT = "%Y-%m"
+CUBE_COLUMNS = ["count", "INJ_OR_FATAL", "FATALITY", "SERIOUSINJURY", "TOTAL_PERSONS"]
+
+
+def accidentPeriods(crashsite_df) -> pd.Series:
+    return crashsite_df["ACCIDENT_DATE"].dt.strftime(PERIOD_FORMAT).rename(PERIOD_COLUMN)
+
+
+def spaceTimeCube(spacetime_sums, cells_gdf, w, columns=CUBE_COLUMNS) -> dict:
+    # sparse (cell x period) matrix of every column over the cells of the all-time grid, most cells have
+    # no crash in a given month; the spatial lag of every period and column comes from one sparse product
+    # with the cached weights and stays sparse, only the periods being drawn are densified
+    cells = cells_gdf.index
+    periods = np.sort(spacetime_sums[PERIOD_COLUMN].unique())
+    rows = cells.get_indexer(spacetime_sums["grid_id"])
+    located = rows >= 0
+    cols = np.searchsorted(periods, spacetime_sums[PERIOD_COLUMN].to_numpy()[located])
+
+    n, t = len(cells), len(periods)
+    M = sparse.csr_matrix((
+        np.concatenate([spacetime_sums[column].to_numpy(dtype=float)[located] for column in columns]),
+        (np.tile(rows[located], len(columns)), np.concatenate([i * t + cols for i in range(len(columns))])),
+    ), shape=(n, t * len(columns)))
+    lags = sparse.csc_matrix(spatialstats.asRowStandardised(w) @ M)
+    M = sparse.csc_matrix(M)
+    return {
+        "cells": cells,
+        "periods": list(periods),
+        "values": {column: M[:, i * t:(i + 1) * t] for i, column in enumerate(columns)},
+        "lags": {column: lags[:, i * t:(i + 1) * t] for i, column in enumerate(columns)},
+    }
+
+
+def rollUpPeriods(cube, period_length=4) -> dict:
+    # e.g. months to years by their "YYYY" prefix, lags are linear so they are summed the same way
+    labels = pd.Index([period[:period_length] for period in cube["periods"]])
+    periods = labels.unique()
+    # (period x rolled up period) indicator, summing the groups of columns is one sparse product
+    G = sparse.csr_matrix((np.ones(len(labels)), (np.arange(len(labels)), periods.get_indexer(labels))),
+                          shape=(len(labels), len(periods)))
+
+    def rollUp(matrices):
+        return {column: sparse.csc_matrix(M @ G) for column, M in matrices.items()}
+
+    return {**cube, "periods": list(periods), "values": rollUp(cube["values"]), "lags": rollUp(cube["lags"])}
+
+
+def denseValues(cube, column, lag=False) -> np.ndarray:
+    # the (cell x period) values or lags of one column as an array, for the periods left in the cube
+    values = cube["lags" if lag else "values"][column]
+    return values.toarray() if sparse.issparse(values) else np.asarray(values)
@@ -0,0 +1,173 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import streamlit as st
+from src import hexbin, hexpyramid, instrumentation
+from src.datastore import loadCrashData, datasetFingerprint
+
+# crashes of a map hex cell, a DBSCAN cluster, a radius or a bounding box without scanning the frame:
+# row positions sorted by their finest hex cell with the offset of every cell, persisted per dataset
+INDEX_DIR = "out/cache/spatialindex"
+# the finest pyramid level, a coarser cell holds the fine cells whose centres it contains, as in the pyramid
+CELL_SIZE = min(hexpyramid.LEVELS.values())
+EARTH_RADIUS_M = 6371000
+DRILLDOWN_COLUMNS = ["ACCIDENT_NO", "ACCIDENT_DATE", "SEVERITY", "TOTAL_PERSONS", "INJ_OR_FATAL", "FATALITY",
+                     "SERIOUSINJURY", "OTHERINJURY", "NONINJURED", "LATITUDE", "LONGITUDE"]
+
+
+def spans(starts, stops) -> np.ndarray:
+    # concatenated aranges, the positions of several runs of a sorted array
+    lengths = stops - starts
+    if not len(lengths):
+        return np.empty(0, dtype=np.int64)
+    run_starts = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    return run_starts + np.arange(lengths.sum())
+
+
+class SortedIndex:
+    # rows grouped by an integer key: positions sorted by key, every distinct key and where its run starts
+    def __init__(self, keys, positions=None, offsets=None):
+        if offsets is not None:
+            self.keys, self.positions, self.offsets = keys, positions, offsets
+            return
+        keys = np.asarray(keys)
+        order = np.argsort(keys, kind="stable")
+        self.positions = order if positions is None else np.asarray(positions)[order]
+        self.keys, starts = np.unique(keys[order], return_index=True)
+        self.offsets = np.r_[starts, len(keys)].astype(np.int64)
+
+    def runs(self, keys) -> np.ndarray:
+        # indices into `positions` of every row with one of the keys, unknown keys match nothing
+        keys = np.atleast_1d(np.asarray(keys, dtype=self.keys.dtype))
+        i = np.searchsorted(self.keys, keys)
+        i = i[(i < len(self.keys)) & (self.keys[np.minimum(i, len(self.keys) - 1)] == keys)]
+        return spans(self.offsets[i], self.offsets[i + 1])
+
+    def lookup(self, keys) -> np.ndarray:
+        return self.positions[self.runs(keys)]
+
+
+class SpatialIndex:
+    # coordinates are stored in index order, so refining the rows of a cell reads contiguous memory
+    def __init__(self, cells, latitude, longitude):
+        self.cells = cells
+        self.latitude = latitude
+        self.longitude = longitude
+        self.centres = hexbin.hexCentres(cells.keys, CELL_SIZE)
+        # the lat/lon extent of every cell's crashes, queries pick cells in degrees so no projected
+        # envelope of a curved box can miss one; cells are ordered by their west edge, a query reads
+        # only the slab of its longitude range widened by the widest cell
+        starts = cells.offsets[:-1]
+        self.latMin, self.latMax = np.minimum.reduceat(latitude, starts), np.maximum.reduceat(latitude, starts)
+        lon_min, lon_max = np.minimum.reduceat(longitude, starts), np.maximum.reduceat(longitude, starts)
+        self.byWest = np.argsort(lon_min, kind="stable")
+        self.west, self.east = lon_min[self.byWest], lon_max[self.byWest]
+        self.widest = float((lon_max - lon_min).max()) if len(starts) else 0.0
+        self.levels = {}
+
+    def level(self, hex_size) -> SortedIndex:
+        # fine cell numbers grouped by the coarse cell containing their centre
+        if hex_size not in self.levels:
+            self.levels[hex_size] = SortedIndex(hexbin.hexCellIds(*self.centres, hex_size))
+        return self.levels[hex_size]
+
+    def cell(self, cell_ids, hex_size=CELL_SIZE) -> np.ndarray:
+        # positions of the crashes in these hex cells of any pyramid level
+        if hex_size == CELL_SIZE:
+            return self.cells.lookup(cell_ids)
+        fine = self.level(hex_size).lookup(cell_ids)
+        return self.cells.positions[spans(self.cells.offsets[fine], self.cells.offsets[fine + 1])]
+
+    def candidates(self, lat_min, lat_max, lon_min, lon_max) -> np.ndarray:
+        # indices into the index order of the rows of every cell whose crashes' extent meets the box
+        start = np.searchsorted(self.west, lon_min - self.widest, side="left")
+        stop = np.searchsorted(self.west, lon_max, side="right")
+        slab = np.arange(start, stop)
+        slab = slab[self.east[slab] >= lon_min]
+        near = self.byWest[slab]
+        near = np.sort(near[(self.latMax[near] >= lat_min) & (self.latMin[near] <= lat_max)])
+        return spans(self.cells.offsets[near], self.cells.offsets[near + 1])
+
+    def bbox(self, lat_min, lat_max, lon_min, lon_max) -> np.ndarray:
+        rows = self.candidates(lat_min, lat_max, lon_min, lon_max)
+        lat, lon = self.latitude[rows], self.longitude[rows]
+        inside = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        return self.cells.positions[rows[inside]]
+
+    def radius(self, lat, lon, radius_m) -> np.ndarray:
+        # haversine distance as in the clustering, the candidate cells come from the circle's lat/lon box:
+        # the arc in radians north and south, the widest longitude offset of the circle east and west
+        arc = radius_m / EARTH_RADIUS_M
+        d_lat = np.degrees(arc)
+        ratio = np.sin(arc) / np.cos(np.radians(lat))
+        d_lon = np.degrees(np.arcsin(ratio)) if abs(lat) + d_lat < 90 and ratio < 1 else 180.0
+        pad = 1e-9
+        rows = self.candidates(lat - d_lat - pad, lat + d_lat + pad, lon - d_lon - pad, lon + d_lon + pad)
+        lat1, lon1 = np.radians(self.latitude[rows]), np.radians(self.longitude[rows])
+        lat0, lon0 = np.radians(lat), np.radians(lon)
+        a = np.sin((lat1 - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat1) * np.sin((lon1 - lon0) / 2) ** 2
+        inside = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a)) <= radius_m
+        return self.cells.positions[rows[inside]]
+
+
+def buildIndex(crashsite_df, rows=None) -> SpatialIndex:
+    # `rows` are the positions reported for the frame's rows, e.g. their rows in a larger frame
+    lat = crashsite_df["LATITUDE"].to_numpy(dtype=float)
+    lon = crashsite_df["LONGITUDE"].to_numpy(dtype=float)
+    located = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    # the same projection and binning as the hex pyramid, so a cell's crashes are the ones it counts
+    points = gpd.GeoSeries.from_xy(lon[located], lat[located], crs="EPSG:4326").to_crs(hexbin.PROJECTED_CRS)
+    cells = SortedIndex(hexbin.hexCellIds(points.x, points.y, CELL_SIZE), located)
+    order = cells.positions
+    if rows is not None:
+        cells.positions = np.asarray(rows)[order]
+    return SpatialIndex(cells, lat[order], lon[order])
+
+
+def indexPath(fingerprint, index_dir=INDEX_DIR) -> str:
+    return os.path.join(index_dir, f"{fingerprint}.npz")
+
+
+def saveIndex(index, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + f".{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, keys=index.cells.keys, positions=index.cells.positions, offsets=index.cells.offsets,
+             latitude=index.latitude, longitude=index.longitude)
+    os.replace(tmp_path, path)
+
+
+def loadIndex(path) -> SpatialIndex:
+    stored = np.load(path)
+    cells = SortedIndex(stored["keys"], stored["positions"], stored["offsets"])
+    return SpatialIndex(cells, stored["latitude"], stored["longitude"])
+
+
+@instrumentation.stage(cache=st.cache_resource(max_entries=1))
+def crashIndex(fingerprint) -> SpatialIndex:
+    # positions are rows of loadCrashData() of the same fingerprint, only the current dataset's stays resident
+    path = indexPath(fingerprint)
+    if os.path.exists(path):
+        return loadIndex(path)
+    index = buildIndex(loadCrashData(["LATITUDE", "LONGITUDE"]))
+    saveIndex(index, path)
+    return index
+
+
+def getIndex() -> SpatialIndex:
+    return crashIndex(datasetFingerprint())
+
+
+def select(crashsite_df, positions, columns=DRILLDOWN_COLUMNS) -> pd.DataFrame:
+    # only the requested rows and columns are copied out of the shared frame, in the frame's order
+    columns = [column for column in columns if column in crashsite_df.columns]
+    return crashsite_df.iloc[np.sort(positions)][columns]
+
+
+def summary(crashes_df) -> dict:
+    # headline numbers of a drill-down selection
+    stats = {"Crashes": len(crashes_df)}
+    for column, label in [("TOTAL_PERSONS", "People involved"), ("INJ_OR_FATAL", "Injured or killed"), ("FATALITY", "Fatalities")]:
+        if column in crashes_df.columns:
+            stats[label] = int(crashes_df[column].sum())
+    return stats
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from joblib import Parallel, delayed
+
+QUADRANT_LABELS = ["HotSpot", "DecliningHotSpot", "ColdSpot", "EmergingHotSpot"]
+
+
+def asRowStandardised(W) -> sparse.csr_matrix:
+    W = sparse.csr_matrix(W, dtype=float)
+    row_sums = np.asarray(W.sum(axis=1)).ravel()
+    row_sums[row_sums == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / row_sums) @ W)
+
+
+def quadrantLabels(x, lag, qx=None, qy=None) -> np.ndarray:
+    # quadrant of each cell in the moran scatter plot, vectorised replacement of the old row-wise apply
+    x = np.asarray(x)
+    lag = np.asarray(lag)
+    qx = x.mean(axis=0) if qx is None else qx
+    qy = lag.mean(axis=0) if qy is None else qy
+    high_x = x > qx
+    high_lag = lag > qy
+    return np.select(
+        [high_x & high_lag, ~high_x & high_lag, ~high_x & ~high_lag, high_x & ~high_lag],
+        QUADRANT_LABELS,
+        default="",
+    )
+
+
+def moranGlobal(W, X, columns=None, permutations=999, seed=12345) -> pd.DataFrame:
+    # global moran's I of every column of X at once, permutations are evaluated in batches of sparse products
+    W = asRowStandardised(W)
+    X = np.asarray(X, dtype=float).reshape(len(W.indptr) - 1, -1)
+    n, m = X.shape
+    z = X - X.mean(axis=0)
+    denominator = (z * z).sum(axis=0)
+    denominator[denominator == 0] = np.nan
+    s0 = W.sum()
+    I = n / s0 * (z * (W @ z)).sum(axis=0) / denominator
+
+    result = pd.DataFrame({"I": I, "EI": -1 / (n - 1)}, index=columns)
+    if permutations:
+        rng = np.random.default_rng(seed)
+        sims = np.empty((permutations, m))
+        batch_size = max(1, min(permutations, 2 ** 22 // max(n * m, 1)))
+        for start in range(0, permutations, batch_size):
+            batch = min(batch_size, permutations - start)
+            order = np.argsort(rng.random((batch, n)), axis=1)
+            # n x (batch*m) block of permuted columns, lagged with a single sparse product
+            z_perm = z[order.T].reshape(n, batch * m)
+            lag_perm = (W @ z_perm).reshape(n, batch, m)
+            sims[start:start + batch] = n / s0 * (z_perm.reshape(n, batch, m) * lag_perm).sum(axis=0) / denominator
+        larger = (sims >= I).sum(axis=0)
+        larger = np.minimum(larger, permutations - larger)
+        result["EI_sim"] = sims.mean(axis=0)
+        result["z_sim"] = (I - sims.mean(axis=0)) / sims.std(axis=0)
+        result["p_sim"] = (larger + 1) / (permutations + 1)
+    return result
+
+
+def _localPermutationChunk(rows, z, neighbour_weights, local_I, draws, z_drawn, z_step, m2):
+    # conditional randomisation for a block of cells, each cell keeps its own value and draws its
+    # neighbours from the other n-1 values, a draw at or above the cell's index shifts up by one
+    weights = neighbour_weights[rows]
+    lag = np.tensordot(weights, z_drawn, axes=([1], [1]))
+    shifted = (draws[None, :, :] >= rows[:, None, None]) * weights[:, None, :]
+    lag += np.matmul(shifted.transpose(1, 0, 2), z_step).transpose(1, 0, 2)
+    sims = z[rows][:, None, :] * lag / m2
+    larger = (sims >= local_I[rows][:, None, :]).sum(axis=1)
+    return rows, larger
+
+
+def moranLocal(W, X, permutations=999, seed=12345, n_jobs=-1, chunk_size=512) -> dict:
+    # local moran's I of every column of X at once with conditional permutation pseudo p-values
+    W = asRowStandardised(W)
+    X = np.asarray(X, dtype=float).reshape(len(W.indptr) - 1, -1)
+    n, m = X.shape
+    z = X - X.mean(axis=0)
+    m2 = (z * z).sum(axis=0) / (n - 1)
+    m2[m2 == 0] = np.nan
+    local_I = z * (W @ z) / m2
+    lag = W @ X
+
+    result = {
+        "Is": local_I,
+        "lag": lag,
+        "quadrant": quadrantLabels(X, lag),
+    }
+    if not permutations:
+        return result
+
+    # neighbour weights padded to the largest neighbour count so every cell shares one draw matrix
+    cardinalities = np.diff(W.indptr)
+    k_max = max(int(cardinalities.max()), 1)
+    neighbour_weights = np.zeros((n, k_max))
+    slots = np.arange(len(W.data)) - np.repeat(W.indptr[:-1], cardinalities)
+    neighbour_weights[np.repeat(np.arange(n), cardinalities), slots] = W.data
+
+    rng = np.random.default_rng(seed)
+    draws = np.stack([rng.choice(n - 1, k_max, replace=False) for _ in range(permutations)])
+    z_drawn = z[draws]
+    z_step = z[draws + 1] - z_drawn
+
+    chunks = [np.arange(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+    larger = np.empty((n, m), dtype=np.int64)
+    for rows, chunk_larger in Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(_localPermutationChunk)(rows, z, neighbour_weights, local_I, draws, z_drawn, z_step, m2) for rows in chunks
+    ):
+        larger[rows] = chunk_larger
+    larger = np.minimum(larger, permutations - larger)
+    result["p_sim"] = (larger + 1) / (permutations + 1)
+    return result
@@ -0,0 +1,103 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+from pysal.lib import weights
+
+WEIGHTS_DIR = "out/cache/weights"
+# knn neighbours are searched once at this depth, any smaller k is a slice of the stored lists
+K_MAX = 16
+
+
+def cellsKey(grid_key, cell_ids) -> str:
+    # weights only depend on the grid and on which of its cells are occupied
+    digest = hashlib.sha256(np.asarray(cell_ids).astype(np.int64).tobytes()).hexdigest()[:16]
+    return f"{grid_key}-{digest}"
+
+
+def cellCentroids(cells_gdf) -> np.ndarray:
+    centroids = cells_gdf.geometry.centroid
+    return np.column_stack([centroids.x, centroids.y])
+
+
+def knnNeighbours(centroids, k_max=K_MAX, path=None) -> np.ndarray:
+    if path and os.path.exists(path):
+        neighbours = np.load(path)["neighbours"]
+        if neighbours.shape[1] >= min(k_max, len(centroids) - 1):
+            return neighbours
+
+    # a single cell has no neighbours, and no tree to query
+    if len(centroids) <= 1:
+        return np.empty((len(centroids), 0), dtype=np.int32)
+
+    k_max = min(k_max, len(centroids) - 1)
+    # first hit of each query is the cell itself
+    _, neighbours = cKDTree(centroids).query(centroids, k=k_max + 1)
+    neighbours = neighbours[:, 1:].astype(np.int32)
+    if path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, neighbours=neighbours)
+    return neighbours
+
+
+def knnWeights(cells_gdf, k=6, grid_key="grid", cell_ids=None) -> sparse.csr_matrix:
+    cell_ids = cells_gdf.index if cell_ids is None else cell_ids
+    path = os.path.join(WEIGHTS_DIR, f"knn-{cellsKey(grid_key, cell_ids)}.npz")
+    neighbours = knnNeighbours(cellCentroids(cells_gdf), max(k, K_MAX), path)[:, :k]
+    n, k = neighbours.shape
+    return sparse.csr_matrix(
+        (np.ones(n * k), neighbours.ravel(), np.arange(n + 1) * k), shape=(n, n)
+    )
+
+
+def queenWeights(cells_gdf, grid_key="grid", cell_ids=None) -> sparse.csr_matrix:
+    cell_ids = cells_gdf.index if cell_ids is None else cell_ids
+    path = os.path.join(WEIGHTS_DIR, f"queen-{cellsKey(grid_key, cell_ids)}.npz")
+    if os.path.exists(path):
+        return sparse.load_npz(path).tocsr()
+
+    W = weights.Queen.from_dataframe(cells_gdf, use_index=False, silence_warnings=True).sparse.tocsr()
+    os.makedirs(WEIGHTS_DIR, exist_ok=True)
+    sparse.save_npz(path, W)
+    return W
+
+
+def distanceBandWeights(cells_gdf, threshold, grid_key="grid", cell_ids=None) -> sparse.csr_matrix:
+    cell_ids = cells_gdf.index if cell_ids is None else cell_ids
+    path = os.path.join(WEIGHTS_DIR, f"band{threshold:g}-{cellsKey(grid_key, cell_ids)}.npz")
+    if os.path.exists(path):
+        return sparse.load_npz(path).tocsr()
+
+    tree = cKDTree(cellCentroids(cells_gdf))
+    W = tree.sparse_distance_matrix(tree, threshold, output_type="coo_matrix").tocsr()
+    W.setdiag(0)
+    W.eliminate_zeros()
+    W.data[:] = 1
+    os.makedirs(WEIGHTS_DIR, exist_ok=True)
+    sparse.save_npz(path, W)
+    return W
+
+
+def getWeights(cells_gdf, kind="knn", k=6, threshold=None, grid_key="grid", transform="R") -> sparse.csr_matrix:
+    if kind == "knn":
+        W = knnWeights(cells_gdf, k=k, grid_key=grid_key)
+    elif kind == "queen":
+        W = queenWeights(cells_gdf, grid_key=grid_key)
+    elif kind == "distance":
+        W = distanceBandWeights(cells_gdf, threshold, grid_key=grid_key)
+    else:
+        raise ValueError(f"unknown weights kind {kind}")
+
+    if transform == "R":
+        row_sums = np.asarray(W.sum(axis=1)).ravel()
+        row_sums[row_sums == 0] = 1
+        W = sparse.csr_matrix(sparse.diags(1 / row_sums) @ W)
+    return W
+
+
+def spatialLag(W, frame, columns, suffix="_lag") -> pd.DataFrame:
+    # every lag column from one sparse x dense product
+    lagged = W @ frame[columns].to_numpy(dtype=float)
+    return pd.DataFrame(lagged, index=frame.index, columns=[column + suffix for column in columns])
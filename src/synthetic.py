@@ -0,0 +1,214 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from src import hexbin
+from src.datastore import CSV_PATH
+
+# synthetic crashes with the schema of the Victorian extract, for benchmarks on a checkout without the LFS data
+SIZES = {"100k": 100_000, "1M": 1_000_000, "10M": 10_000_000}
+# generated files never go to the tracked data directory, the app reads them through CRASH_CSV_PATH
+SYNTHETIC_DIR = "out/synthetic"
+TRACKED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+CHUNK_ROWS = 1_000_000
+# lon/lat bounds of Victoria
+BOUNDS = (140.96, -39.16, 149.98, -33.98)
+GRID_SIZES = {"grid1KM": 1000, "grid5KM": 5000}
+
+# (lat, lon, weight, spread in degrees, region) of the towns crashes concentrate around
+TOWNS = [
+    (-37.81, 144.96, 0.62, 0.18, "METROPOLITAN NORTH WEST REGION"),
+    (-37.90, 145.15, 0.10, 0.12, "METROPOLITAN SOUTH EAST REGION"),
+    (-38.15, 144.36, 0.05, 0.06, "SOUTH WESTERN REGION"),
+    (-37.56, 143.85, 0.04, 0.05, "WESTERN REGION"),
+    (-36.76, 144.28, 0.04, 0.05, "NORTHERN REGION"),
+    (-36.38, 145.40, 0.02, 0.04, "NORTHERN REGION"),
+    (-38.23, 146.40, 0.02, 0.06, "EASTERN REGION"),
+    (-38.38, 142.48, 0.01, 0.04, "SOUTH WESTERN REGION"),
+    (-34.19, 142.16, 0.01, 0.04, "NORTHERN REGION"),
+    (-36.12, 146.89, 0.01, 0.04, "NORTH EASTERN REGION"),
+]
+# share of crashes spread over the whole state instead of around a town
+RURAL_SHARE = 0.08
+# share of crashes at a recurring site (intersection), a few metres apart so DBSCAN finds clusters
+SITE_SHARE = 0.6
+SITE_JITTER_DEG = 0.00005
+
+SEVERITY_VALUES = ["Fatal accident", "Serious injury accident", "Other injury accident", "Non injury accident"]
+SEVERITY_WEIGHTS = [0.015, 0.32, 0.64, 0.025]
+CATEGORY_VALUES = {
+    "ACCIDENT_STATUS": (["Finished", "Unfinished"], [0.97, 0.03]),
+    "ACCIDENT_TYPE": (["Collision with vehicle", "Struck pedestrian", "Struck animal", "Collision with a fixed object",
+                       "Collision with some other object", "Vehicle overturned (no collision)", "Fall from or in moving vehicle",
+                       "No collision and no object struck", "Other accident"],
+                      [0.6, 0.08, 0.02, 0.17, 0.02, 0.02, 0.04, 0.04, 0.01]),
+    "ALCOHOLTIME": (["Yes", "No"], [0.3, 0.7]),
+    "DCA_CODE": ([f"{code} {kind}" for code, kind in [(110, "CROSS TRAFFIC"), (113, "RIGHT NEAR"), (121, "RIGHT THROUGH"),
+                                                       (130, "REAR END"), (132, "LANE CHANGE"), (171, "LEFT OFF CARRIAGEWAY"),
+                                                       (173, "RIGHT OFF CARRIAGEWAY"), (100, "PED NEAR SIDE")]], None),
+    "HIT_RUN_FLAG": (["No", "Yes"], [0.96, 0.04]),
+    "LIGHT_CONDITION": (["Day", "Dusk/Dawn", "Dark Street lights on", "Dark Street lights off", "Dark No street lights",
+                         "Dark Street lights unknown", "Unk."], [0.68, 0.09, 0.15, 0.005, 0.05, 0.005, 0.02]),
+    "POLICE_ATTEND": (["Yes", "No", "Not known"], [0.75, 0.24, 0.01]),
+    "ROAD_GEOMETRY": (["Not at intersection", "T intersection", "Cross intersection", "Multiple intersection",
+                       "Y intersection", "Dead end", "Road closure", "Private property", "Unknown"],
+                      [0.5, 0.26, 0.19, 0.02, 0.02, 0.003, 0.002, 0.002, 0.003]),
+    "SPEED_ZONE": (["40 km/hr", "50 km/hr", "60 km/hr", "70 km/hr", "80 km/hr", "90 km/hr", "100 km/hr", "110 km/hr",
+                    "Camping grounds or off road", "Other speed limit", "Not known"],
+                   [0.03, 0.14, 0.38, 0.09, 0.12, 0.01, 0.15, 0.04, 0.005, 0.005, 0.03]),
+    "RUN_OFFROAD": (["No", "Yes"], [0.82, 0.18]),
+    "NODE_TYPE": (["Non-Intersection", "Intersection", "Off Road", "Unknown"], [0.5, 0.47, 0.02, 0.01]),
+    "DEG_URBAN_NAME": (["MELB_URBAN", "LARGE_PROVINCIAL_CITIES", "SMALL_CITIES", "SMALL_TOWNS", "TOWNS", "RURAL_VICTORIA"],
+                       [0.65, 0.1, 0.06, 0.04, 0.05, 0.1]),
+    "SRNS": (["", "M", "A", "B", "C"], [0.7, 0.08, 0.12, 0.05, 0.05]),
+    "RMA": (["Local Road", "Arterial Other", "Arterial Highway", "Freeway", "Non Arterial"], [0.35, 0.4, 0.12, 0.08, 0.05]),
+    "DIVIDED": (["Undivided", "Divided"], [0.55, 0.45]),
+}
+# the *_ALL columns list every value along the crash's road, mostly just the crash's own
+ALL_COLUMNS = {"DEG_URBAN_ALL": "DEG_URBAN_NAME", "LGA_NAME_ALL": "LGA_NAME", "REGION_NAME_ALL": "REGION_NAME",
+               "SRNS_ALL": "SRNS", "RMA_ALL": "RMA", "DIVIDED_ALL": "DIVIDED"}
+METRO_TOWNS = 2
+LGA_NAMES = ["MELBOURNE", "MONASH", "GEELONG", "BALLARAT", "GREATER BENDIGO", "GREATER SHEPPARTON", "LATROBE",
+             "WARRNAMBOOL", "MILDURA", "WODONGA"]
+
+
+def parseSize(size) -> int:
+    # "100k", "1M", "10M" or a plain number of rows
+    if size in SIZES:
+        return SIZES[size]
+    return int(float(str(size).lower().replace("k", "e3").replace("m", "e6")))
+
+
+def choice(rng, column, n) -> np.ndarray:
+    values, weights = CATEGORY_VALUES[column]
+    if weights is not None:
+        weights = np.asarray(weights) / np.sum(weights)
+    return np.asarray(values, dtype=object)[rng.choice(len(values), size=n, p=weights)]
+
+
+def crashLocations(rng, n, sites=None):
+    # town of every crash, its position around the town or at one of the recurring sites
+    town_weights = np.array([town[2] for town in TOWNS])
+    town = rng.choice(len(TOWNS), size=n, p=town_weights / town_weights.sum())
+    centres = np.array([(town_lat, town_lon) for town_lat, town_lon, *_ in TOWNS])
+    spread = np.array([town[3] for town in TOWNS])
+    lat = centres[town, 0] + rng.normal(0, 1, n) * spread[town]
+    lon = centres[town, 1] + rng.normal(0, 1.3, n) * spread[town]
+
+    rural = rng.random(n) < RURAL_SHARE
+    lon[rural] = rng.uniform(BOUNDS[0], BOUNDS[2], rural.sum())
+    lat[rural] = rng.uniform(BOUNDS[1], BOUNDS[3], rural.sum())
+
+    if sites is not None:
+        at_site = ~rural & (rng.random(n) < SITE_SHARE)
+        picked = rng.integers(0, len(sites), at_site.sum())
+        lat[at_site] = sites[picked, 0] + rng.normal(0, SITE_JITTER_DEG, at_site.sum())
+        lon[at_site] = sites[picked, 1] + rng.normal(0, SITE_JITTER_DEG, at_site.sum())
+    return np.clip(lat, BOUNDS[1], BOUNDS[3]), np.clip(lon, BOUNDS[0], BOUNDS[2]), town
+
+
+def casualties(rng, severity) -> dict:
+    # counts consistent with the severity, the worst injury decides it
+    n = len(severity)
+    fatality = np.where(severity == "Fatal accident", 1 + rng.poisson(0.1, n), 0)
+    serious = np.where(severity == "Serious injury accident", 1, 0) + np.where(severity == "Fatal accident", rng.poisson(0.4, n), 0)
+    serious = serious + np.where(severity == "Serious injury accident", rng.poisson(0.2, n), 0)
+    other = np.where(severity == "Other injury accident", 1, 0) + np.where(severity != "Non injury accident", rng.poisson(0.4, n), 0)
+    noninjured = rng.poisson(1.1, n)
+    inj_or_fatal = fatality + serious + other
+    return {
+        "TOTAL_PERSONS": inj_or_fatal + noninjured,
+        "INJ_OR_FATAL": inj_or_fatal,
+        "FATALITY": fatality,
+        "SERIOUSINJURY": serious,
+        "OTHERINJURY": other,
+        "NONINJURED": noninjured,
+    }
+
+
+def syntheticCrashes(n, seed=0, start="2018-01-01", years=5, first_id=0, sites=None) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    lat, lon, town = crashLocations(rng, n, sites)
+    # dates and times are formatted once per distinct value and looked up
+    days = pd.date_range(start, periods=365 * years, freq="D")
+    day = rng.integers(0, len(days), n)
+    minute = rng.integers(0, 24 * 60, n)
+    times = np.array([f"{m // 60:02d}:{m % 60:02d}:00" for m in range(24 * 60)], dtype=object)
+    severity = np.asarray(SEVERITY_VALUES, dtype=object)[rng.choice(len(SEVERITY_VALUES), size=n, p=SEVERITY_WEIGHTS)]
+
+    crashsite_df = pd.DataFrame({
+        "ACCIDENT_NO": [f"T{i:09d}" for i in range(first_id, first_id + n)],
+        "ACCIDENT_DATE": days.strftime("%Y/%m/%d").to_numpy(dtype=object)[day],
+        "ACCIDENT_TIME": times[minute],
+        "SEVERITY": severity,
+        "LONGITUDE": lon,
+        "LATITUDE": lat,
+        "LGA_NAME": np.asarray(LGA_NAMES, dtype=object)[town],
+        "REGION_NAME": np.asarray([region for *_, region in TOWNS], dtype=object)[town],
+        "NO_OF_VEHICLES": 1 + rng.poisson(0.8, n),
+    })
+    for column in CATEGORY_VALUES:
+        crashsite_df[column] = choice(rng, column, n)
+    crashsite_df["DAY_OF_WEEK"] = days.day_name().to_numpy(dtype=object)[day]
+    crashsite_df["STAT_DIV_NAME"] = np.where(town < METRO_TOWNS, "Metro", "Country")
+    for all_column, column in ALL_COLUMNS.items():
+        values = crashsite_df[column]
+        crashsite_df[all_column] = values.where(rng.random(n) > 0.1, values + "," + values.sample(frac=1, random_state=seed).to_numpy())
+    return crashsite_df.assign(**casualties(rng, severity))
+
+
+def crashSites(n, seed=0) -> np.ndarray:
+    # recurring sites, roughly one for every eight crashes
+    lat, lon, _ = crashLocations(np.random.default_rng(seed + 1), max(n // 8, 1))
+    return np.column_stack([lat, lon])
+
+
+def checkUntracked(path):
+    # the LFS extract and grids in data/ would be silently replaced
+    if os.path.commonpath([os.path.abspath(path), TRACKED_DIR]) == TRACKED_DIR:
+        raise ValueError(f"{path} is in the tracked data directory, write synthetic data elsewhere (e.g. {SYNTHETIC_DIR})")
+
+
+def writeCrashCSV(n, path=os.path.join(SYNTHETIC_DIR, os.path.basename(CSV_PATH)), seed=0, chunk_rows=CHUNK_ROWS) -> str:
+    # generated in chunks so 10M rows never sit in memory at once
+    checkUntracked(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    sites = crashSites(n, seed)
+    with open(path + ".tmp", "w", newline="") as f:
+        for i, start in enumerate(range(0, n, chunk_rows)):
+            chunk = syntheticCrashes(min(chunk_rows, n - start), seed=seed + i, first_id=start, sites=sites)
+            chunk.to_csv(f, index=False, header=i == 0)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def syntheticHexGrid(hex_size, bounds=BOUNDS) -> gpd.GeoDataFrame:
+    # every hexagon of the cell id grid covering Victoria's bounding box, in lon/lat like the LFS grid files
+    corners = gpd.GeoSeries.from_xy([bounds[0], bounds[2], bounds[0], bounds[2]], [bounds[1], bounds[1], bounds[3], bounds[3]], crs=4326)
+    x0, y0, x1, y1 = corners.to_crs(hexbin.PROJECTED_CRS).total_bounds
+    step = hex_size / 2
+    x, y = np.meshgrid(np.arange(x0, x1 + step, step), np.arange(y0, y1 + step, step))
+    cell_ids = np.unique(hexbin.hexCellIds(x.ravel(), y.ravel(), hex_size))
+    return gpd.GeoDataFrame(geometry=hexbin.hexPolygons(cell_ids, hex_size).to_crs(4326))
+
+
+def writeHexGrids(directory=SYNTHETIC_DIR, grid_sizes=GRID_SIZES) -> list:
+    paths = []
+    for name, hex_size in grid_sizes.items():
+        path = os.path.join(directory, f"{name}.json")
+        checkUntracked(path)
+        os.makedirs(directory, exist_ok=True)
+        syntheticHexGrid(hex_size).to_file(path + ".tmp", driver="GeoJSON")
+        os.replace(path + ".tmp", path)
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    # python -m src.synthetic 1M         writes out/synthetic/Road_Crashes_for_five_Years_Victoria.csv with 1M rows
+    # python -m src.synthetic 1M grids   and the 1 km / 5 km hex grid files next to it
+    n = parseSize(sys.argv[1] if len(sys.argv) > 1 else "100k")
+    print(writeCrashCSV(n))
+    if "grids" in sys.argv[2:]:
+        print(*writeHexGrids(), sep="\n")
@@ -0,0 +1,154 @@
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+import streamlit as st
+from src.datastore import datasetFingerprint
+from src import aggregates, instrumentation
+
+CUBE_KEYS = ["ACCIDENT_YEAR", "ACCIDENT_MONTH", "ACCIDENT_TYPE", "RMA_ALL"]
+CASUALTY_COLUMNS = ["TOTAL_PERSONS", "FATALITY", "SERIOUSINJURY", "OTHERINJURY", "NONINJURED"]
+STACKED_COLUMNS = ["FATALITY", "SERIOUSINJURY", "OTHERINJURY", "NONINJURED"]
+
+
+def buildTimeCube(crashsite_df) -> pd.DataFrame:
+    # casualty sums and crash counts per (year, month, accident type, RMA), every landing chart is a roll up of this
+    accident_date = crashsite_df["ACCIDENT_DATE"]
+    keys = [
+        accident_date.dt.year.rename("ACCIDENT_YEAR"),
+        accident_date.dt.month.rename("ACCIDENT_MONTH"),
+        crashsite_df["ACCIDENT_TYPE"],
+        crashsite_df["RMA_ALL"],
+    ]
+    grouped = crashsite_df.groupby(keys, observed=True, dropna=False)
+    cube = grouped[CASUALTY_COLUMNS].sum()
+    cube["count"] = grouped.size()
+    return cube.reset_index()
+
+
+def timeCubePiece(crashsite_df) -> pd.DataFrame:
+    return buildTimeCube(crashsite_df).set_index(CUBE_KEYS)
+
+
+aggregates.register("timeseries", timeCubePiece, columns=["ACCIDENT_DATE", "ACCIDENT_TYPE", "RMA_ALL", *CASUALTY_COLUMNS])
+
+
+@st.cache_data
+def loadTimeCube(fingerprint) -> pd.DataFrame:
+    # sum of the per month pieces, an appended month only adds its own
+    return aggregates.updateAggregate("timeseries").reset_index()
+
+
+def yearMonthFigure(cube):
+    # undated crashes have no year or month, their keys are dropped and the float keys they left are cast back
+    by_year_month = cube.groupby(["ACCIDENT_YEAR", "ACCIDENT_MONTH"])[CASUALTY_COLUMNS].sum().reset_index()
+    by_year_month = by_year_month.astype({"ACCIDENT_YEAR": "Int64", "ACCIDENT_MONTH": "Int64"})
+    by_year_month["ACCIDENT_YEARMONTH"] = (
+        by_year_month["ACCIDENT_YEAR"].astype(str) + "-" + by_year_month["ACCIDENT_MONTH"].astype(str).str.zfill(2)
+    )
+
+    # number of casualties by year using plotly using stacked bar chart
+    fig = px.bar(
+        by_year_month,
+        x="ACCIDENT_YEARMONTH",
+        y=STACKED_COLUMNS,
+        title="Number of casualties by year month",
+        barmode='stack')
+
+    # add line chart for total number of casualties
+    fig.add_scatter(x=by_year_month['ACCIDENT_YEARMONTH'], y=by_year_month['TOTAL_PERSONS'], name="TOTAL_PERSONS", mode='lines')
+
+    fig.update_layout(
+        xaxis_title="Year Month",
+        yaxis_title="Number of casualties",
+        legend_title="Casualties Type"
+    )
+    return fig
+
+
+def monthFigure(cube):
+    # mean per crash is the month's casualty sum over its crash count
+    by_month = cube.groupby("ACCIDENT_MONTH")[[*CASUALTY_COLUMNS, "count"]].sum()
+    by_month = by_month[CASUALTY_COLUMNS].div(by_month["count"], axis=0).reset_index()
+    by_month["ACCIDENT_MONTH"] = by_month["ACCIDENT_MONTH"].astype("Int64").astype(str).str.zfill(2)
+
+    fig = px.bar(
+        by_month,
+        x="ACCIDENT_MONTH",
+        y=STACKED_COLUMNS,
+        title="Average Number of Casualties by month",
+        barmode='stack')
+    fig.add_scatter(x=by_month['ACCIDENT_MONTH'], y=by_month['TOTAL_PERSONS'], name="TOTAL_PERSONS", mode='lines')
+    fig.update_layout(
+        xaxis_title="Month",
+        yaxis_title="Average Number of casualties",
+        legend_title="Casualties Type"
+    )
+    return fig
+
+
+def accidentTypeFigure(cube):
+    by_accident_type = cube.groupby("ACCIDENT_TYPE", observed=True)[CASUALTY_COLUMNS].sum().reset_index()
+
+    fig = px.bar(
+        by_accident_type.sort_values(by=['TOTAL_PERSONS'], ascending=False),
+        x="ACCIDENT_TYPE",
+        y=STACKED_COLUMNS,
+        title="Average Number of Casualties by Accident Type",
+        barmode='stack')
+    fig.update_layout(
+        xaxis_title="Accident Type",
+        yaxis_title="Average Number of casualties in log scale",
+        legend_title="Casualties Type",
+    )
+    # log y
+    fig.update_yaxes(type="log")
+    # add number to the bar
+    fig.update_traces(
+        texttemplate='%{y:.2s}',
+        textposition='outside'
+    )
+    return fig
+
+
+def rmaFigure(cube):
+    by_rma_type = cube.groupby("RMA_ALL", observed=True)[CASUALTY_COLUMNS].sum().reset_index()
+
+    # horizontal bar chart
+    fig = px.bar(
+        by_rma_type.sort_values(by=['TOTAL_PERSONS'], ascending=True),
+        y="RMA_ALL",
+        x=STACKED_COLUMNS,
+        title="Average Number of Casualties by RMA Type",
+        barmode='stack',
+        orientation='h',
+        height=800,
+        )
+
+    fig.update_layout(
+        yaxis_title="RMA Type",
+        xaxis_title="Number of casualties",
+        legend_title="Casualties Type",
+    )
+    fig.update_traces(
+        texttemplate='%{x:.2s}',
+        textposition='outside'
+    )
+    fig.update_xaxes(type="log")
+    return fig
+
+
+@st.cache_data(persist="disk")
+def landingFigures(fingerprint) -> dict:
+    # serialized figures, a rerun only decodes these and never touches the raw rows
+    cube = loadTimeCube(fingerprint)
+    return {
+        "year_month": yearMonthFigure(cube).to_json(),
+        "month": monthFigure(cube).to_json(),
+        "accident_type": accidentTypeFigure(cube).to_json(),
+        "rma": rmaFigure(cube).to_json(),
+    }
+
+
+@instrumentation.stage()
+def getLandingFigures() -> dict:
+    return {name: pio.from_json(fig_json) for name, fig_json in landingFigures(datasetFingerprint()).items()}
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from src import clustering
+
+
+def crashPoints(n=20_000, seed=0):
+    # dense sites of repeated crashes over a sparse background, around Melbourne
+    rng = np.random.default_rng(seed)
+    sites = rng.uniform([-38.0, 144.7], [-37.6, 145.3], size=(n // 20, 2))
+    clustered = sites[rng.integers(len(sites), size=n // 2)] + rng.normal(scale=0.0001, size=(n // 2, 2))
+    background = rng.uniform([-38.0, 144.7], [-37.6, 145.3], size=(n - n // 2, 2))
+    return np.vstack([clustered, background])
+
+
+@pytest.mark.parametrize("eps_m, min_samples, block_size_m", [(10, 5, 5000), (30, 3, 500), (100, 10, 2000)])
+def test_partitioned_labels_identical_to_dbscan_labels(eps_m, min_samples, block_size_m):
+    lat_long = crashPoints()
+    eps = clustering.metresToRadians(eps_m)
+    expected = clustering.NeighbourGraph(lat_long, radius_m=eps_m).dbscan(eps, min_samples)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        labels = clustering.partitionedDBSCAN(lat_long, eps, min_samples, block_size_m=block_size_m,
+                                              batch_points=2_000, executor=executor)
+    assert (expected >= 0).sum() > 0
+    np.testing.assert_array_equal(labels, expected)
+
+
+@pytest.mark.parametrize("eps_m, min_samples", [(10, 5), (30, 3), (100, 10)])
+def test_dbscan_matches_sklearn_haversine_dbscan(eps_m, min_samples):
+    from sklearn.cluster import DBSCAN
+    from sklearn.metrics.pairwise import haversine_distances
+
+    lat_long = crashPoints()
+    eps = clustering.metresToRadians(eps_m)
+    labels = clustering.NeighbourGraph(lat_long, radius_m=eps_m).dbscan(eps, min_samples)
+    reference = DBSCAN(eps=eps, min_samples=min_samples, metric="haversine", algorithm="ball_tree").fit(np.radians(lat_long))
+    expected = reference.labels_
+    core = np.zeros(len(lat_long), dtype=bool)
+    core[reference.core_sample_indices_] = True
+
+    # the same noise, and core points split into the same clusters under other numbers
+    np.testing.assert_array_equal(labels < 0, expected < 0)
+    pairs = np.unique(np.column_stack([labels[core], expected[core]]), axis=0)
+    assert len(pairs) == len(np.unique(labels[core])) == len(np.unique(expected[core]))
+    to_expected = dict(map(tuple, pairs))
+
+    # a border point within eps of several clusters joins the one of its nearest core point, sklearn the one
+    # that reaches it first; either way it belongs to a cluster with a core point within eps
+    border = np.flatnonzero(~core & (labels >= 0))
+    differing = border[np.array([to_expected[label] for label in labels[border]]) != expected[border]]
+    for i in differing:
+        near = core & (haversine_distances(np.radians(lat_long[[i]]), np.radians(lat_long))[0] <= eps)
+        assert to_expected[labels[i]] in set(expected[near])
+    assert len(differing) <= len(border) // 100 + 1
@@ -0,0 +1,80 @@
+import os
+
+import pandas as pd
+import pytest
+
+from src import aggregates, datastore, synthetic
+# registers the stored aggregates
+from src import autocorrelation, factorcube, timeseries  # noqa: F401
+
+
+def writeCSV(df, path):
+    df.to_csv(path, index=False)
+    return path
+
+
+def plain(total) -> pd.DataFrame:
+    # a merged total keeps categorical keys as strings, the keys are compared by value
+    keys = list(total.index.names)
+    total = total.reset_index()
+    total[keys] = total[keys].astype(object)
+    return total.sort_values(keys, ignore_index=True)
+
+
+def storedAggregates() -> dict:
+    return {name: plain(aggregates.updateAggregate(name)) for name in aggregates.updateAll()}
+
+
+@pytest.fixture
+def deliveries():
+    base_df = synthetic.syntheticCrashes(2_000, seed=0, start="2018-01-01", years=2)
+    # re-delivered crashes with corrected counts, some of them moved to another month, and a new month
+    redelivered = base_df.sample(60, random_state=0).copy()
+    redelivered["NONINJURED"] += 1
+    redelivered["TOTAL_PERSONS"] += 1
+    moved = redelivered.index[:20]
+    redelivered.loc[moved, "ACCIDENT_DATE"] = (pd.to_datetime(redelivered.loc[moved, "ACCIDENT_DATE"]) + pd.DateOffset(days=45)).dt.strftime("%Y/%m/%d")
+    new_df = synthetic.syntheticCrashes(300, seed=1, start="2020-01-01", years=1, first_id=100_000)
+    return base_df, pd.concat([redelivered, new_df], ignore_index=True)
+
+
+def test_appended_delivery_matches_a_rebuild(tmp_path, monkeypatch, deliveries):
+    base_df, delivery_df = deliveries
+
+    # the store and its aggregates built from the base extract, then the delivery merged in
+    os.makedirs(tmp_path / "incremental")
+    monkeypatch.chdir(tmp_path / "incremental")
+    datastore.ingestCrashCSV(writeCSV(base_df, "base.csv"))
+    storedAggregates()
+    touched = datastore.appendCrashCSV(writeCSV(delivery_df, "delivery.csv"))
+    assert "2020-06" in touched
+    incremental = storedAggregates()
+    incremental_df = pd.read_parquet(datastore.STORE_PATH)
+
+    # every crash delivered so far in one extract, built from scratch
+    os.makedirs(tmp_path / "rebuilt")
+    monkeypatch.chdir(tmp_path / "rebuilt")
+    combined_df = pd.concat([base_df, delivery_df], ignore_index=True).drop_duplicates("ACCIDENT_NO", keep="last")
+    datastore.ingestCrashCSV(writeCSV(combined_df, "base.csv"))
+    rebuilt = storedAggregates()
+    rebuilt_df = pd.read_parquet(datastore.STORE_PATH)
+
+    assert len(incremental_df) == len(rebuilt_df) == len(combined_df)
+    assert set(incremental_df["ACCIDENT_NO"]) == set(combined_df["ACCIDENT_NO"])
+    assert set(incremental) == {"timeseries", "factors", "hex_pyramid", "hex_spacetime"}
+    for name, total in rebuilt.items():
+        pd.testing.assert_frame_equal(incremental[name], total, check_dtype=False, obj=name)
+
+
+def test_delivery_survives_a_base_rebuild(tmp_path, monkeypatch, deliveries):
+    base_df, delivery_df = deliveries
+    monkeypatch.chdir(tmp_path)
+    datastore.ingestCrashCSV(writeCSV(base_df, "base.csv"))
+    datastore.appendCrashCSV(writeCSV(delivery_df, "delivery.csv"))
+    appended_df = pd.read_parquet(datastore.STORE_PATH)
+    # a new base extract applies the recorded deliveries again
+    datastore.ingestCrashCSV("base.csv")
+    rebuilt_df = pd.read_parquet(datastore.STORE_PATH)
+    key = ["ACCIDENT_NO"]
+    pd.testing.assert_frame_equal(appended_df.sort_values(key, ignore_index=True), rebuilt_df.sort_values(key, ignore_index=True),
+                                  check_dtype=False, check_categorical=False)
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from src import hotspots
+
+
+def mannKendallLoop(series):
+    # S and its tie corrected variance straight from the definition
+    t = len(series)
+    S = sum(np.sign(series[j] - series[i]) for i in range(t) for j in range(i + 1, t))
+    _, counts = np.unique(series, return_counts=True)
+    variance = (t * (t - 1) * (2 * t + 5) - sum(c * (c - 1) * (2 * c + 5) for c in counts)) / 18
+    return S, variance
+
+
+def test_gi_star_matches_esda():
+    esda = pytest.importorskip("esda")
+    libpysal = pytest.importorskip("libpysal")
+    w = libpysal.weights.lat2W(10, 10, rook=False)
+    X = np.random.default_rng(0).poisson(3, size=(w.n, 4)).astype(float)
+    Z = hotspots.getisOrdGiStar(w.sparse, X)
+    for i in range(X.shape[1]):
+        reference = esda.G_Local(X[:, i], w, transform="B", star=True, permutations=0)
+        np.testing.assert_allclose(Z[:, i], reference.Zs, atol=1e-12)
+
+
+def test_mann_kendall_matches_the_definition():
+    rng = np.random.default_rng(0)
+    # rounded values give ties, the trend rows a significant S
+    Z = np.vstack([rng.normal(size=(20, 12)).round(1), np.arange(12) + rng.normal(0, 2, size=(5, 12)), np.full((1, 12), 1.0)])
+    S, z, p = hotspots.mannKendall(Z)
+    for row, series in enumerate(Z):
+        expected_S, variance = mannKendallLoop(series)
+        assert S[row] == expected_S
+        expected_z = (expected_S - np.sign(expected_S)) / np.sqrt(variance) if variance > 0 else 0.0
+        assert z[row] == pytest.approx(expected_z)
+    assert p[-1] == 1.0
+    assert (p[20:25] < hotspots.ALPHA).all()
+
+
+@pytest.mark.parametrize("hot, cold, trend, category", [
+    ("0000000001", "0000000000", 0, "New"),
+    ("0000000111", "0000000000", 0, "Consecutive"),
+    ("1111111111", "0000000000", 1, "Intensifying"),
+    ("1111111111", "0000000000", 0, "Persistent"),
+    ("1111111111", "0000000000", -1, "Diminishing"),
+    ("1010010001", "0000000000", 0, "Sporadic"),
+    ("1010010001", "0100000000", 0, "Oscillating"),
+    ("1111111110", "0000000000", 0, "Historical"),
+    ("0110000000", "0000000000", 0, ""),
+    ("0000000000", "0000000000", 0, ""),
+])
+def test_classify_emerging_hot_spot_patterns(hot, cold, trend, category):
+    significant = np.array([[c == "1" for c in hot]])
+    opposite = np.array([[c == "1" for c in cold]])
+    assert hotspots.classify(significant, opposite, np.array([trend]))[0] == category
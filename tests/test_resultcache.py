@@ -0,0 +1,77 @@
+import os
+
+import pandas as pd
+import pytest
+
+from src import hexbin, resultcache, spatialstats
+
+
+def summary(fingerprint, resolution, column="count"):
+    return {"fingerprint": fingerprint, "resolution": resolution, "column": column}
+
+
+def otherSummary(fingerprint, resolution, column="count"):
+    return {"fingerprint": fingerprint, "resolution": resolution, "column": column, "other": True}
+
+
+def writeEntry(result_dir, name, size, mtime):
+    path = os.path.join(result_dir, f"{name}.pkl")
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_key_covers_parameters_code_and_dependencies():
+    key = resultcache.resultKey(summary, (), ("abc", 7), {"column": "count"})
+    assert key == resultcache.resultKey(summary, (), ("abc", 7), {"column": "count"})
+    # a data refresh, another parameter, another function or another dependency is another result
+    assert key != resultcache.resultKey(summary, (), ("abd", 7), {"column": "count"})
+    assert key != resultcache.resultKey(summary, (), ("abc", 8), {"column": "count"})
+    assert key != resultcache.resultKey(summary, (), ("abc", 7), {"column": "FATALITY"})
+    assert key != resultcache.resultKey(otherSummary, (), ("abc", 7), {"column": "count"})
+    assert key != resultcache.resultKey(summary, (hexbin,), ("abc", 7), {"column": "count"})
+    assert resultcache.resultKey(summary, (hexbin,), ("abc", 7), {}) != resultcache.resultKey(summary, (spatialstats,), ("abc", 7), {})
+    # keyword order is not part of the key
+    assert (resultcache.resultKey(summary, (), ("abc",), {"resolution": 7, "column": "count"})
+            == resultcache.resultKey(summary, (), ("abc",), {"column": "count", "resolution": 7}))
+
+
+def test_key_rejects_frames():
+    with pytest.raises(TypeError):
+        resultcache.resultKey(summary, (), (pd.DataFrame({"a": [1]}), 7), {})
+
+
+def test_evict_removes_the_least_recently_used_first(tmp_path):
+    paths = [writeEntry(tmp_path, f"entry{i}", 100, 1_000_000 + i) for i in range(5)]
+    # a temporary file of a writer is not an entry
+    with open(tmp_path / "writer.tmp", "wb") as f:
+        f.write(b"\0" * 1_000)
+    resultcache.evict(tmp_path, max_bytes=250)
+    assert [os.path.exists(path) for path in paths] == [False, False, False, True, True]
+    assert (tmp_path / "writer.tmp").exists()
+
+
+def test_cached_hits_and_keeps_used_entries(tmp_path):
+    calls = []
+
+    @resultcache.cached(result_dir=tmp_path, max_bytes=1 << 20)
+    def square(fingerprint, value):
+        calls.append(value)
+        return {"value": value * value, "padding": b"\0" * 1_000}
+
+    assert square("abc", 3)["value"] == 9
+    assert square("abc", 3)["value"] == 9
+    assert square("abd", 3)["value"] == 9
+    assert calls == [3, 3]
+
+    # a hit touches its entry, so eviction drops the entry that was not read since
+    for i, entry in enumerate(sorted(tmp_path.glob("*.pkl"), key=os.path.getmtime)):
+        os.utime(entry, (1_000_000 + i, 1_000_000 + i))
+    square("abc", 3)
+    square("abc", 4)
+    resultcache.evict(tmp_path, max_bytes=2_500)
+    assert calls == [3, 3, 4]
+    square("abc", 3)
+    square("abd", 3)
+    assert calls == [3, 3, 4, 3]
@@ -0,0 +1,108 @@
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+import streamlit as st
+
+from src import scheduler
+
+TIMEOUT = 10
+
+
+@pytest.fixture(autouse=True)
+def session():
+    # every test is a fresh session of its own
+    st.session_state.pop("scheduled_jobs", None)
+    yield
+    st.session_state.pop("scheduled_jobs", None)
+
+
+def blocking(started, release, calls):
+    # a job that runs until it is released or cancelled
+    def body(name):
+        calls.append(name)
+        started.set()
+        while not release.wait(0.01):
+            scheduler.checkCancelled()
+        return f"{name} done"
+
+    return body
+
+
+def test_concurrent_requests_share_one_job():
+    started, release, calls = threading.Event(), threading.Event(), []
+    body = blocking(started, release, calls)
+    first = scheduler.submit("single-flight a", body, "map")
+    assert started.wait(TIMEOUT)
+    second = scheduler.submit("single-flight b", body, "map")
+    other = scheduler.submit("single-flight c", body, "other")
+    assert second is first and other is not first
+    release.set()
+    assert first.future.result(TIMEOUT) == second.future.result(TIMEOUT) == "map done"
+    assert other.future.result(TIMEOUT) == "other done"
+    assert sorted(calls) == ["map", "other"]
+    for job in (first, second, other):
+        scheduler.detach(job)
+    # a finished job is forgotten, the next request runs again
+    assert scheduler.submit("single-flight a", body, "map").future.result(TIMEOUT) == "map done"
+    assert sorted(calls) == ["map", "map", "other"]
+
+
+def test_superseded_job_is_cancelled():
+    started, release, calls = threading.Event(), threading.Event(), []
+    body = blocking(started, release, calls)
+    stale = scheduler.submit("cancel", body, "stale")
+    assert started.wait(TIMEOUT)
+    scheduler.detach(stale)
+    fresh = scheduler.submit("cancel", body, "fresh")
+    with pytest.raises((scheduler.JobCancelled, CancelledError)):
+        stale.future.result(TIMEOUT)
+    release.set()
+    assert fresh.future.result(TIMEOUT) == "fresh done"
+    scheduler.detach(fresh)
+
+
+def test_superseded_job_with_other_waiters_keeps_running():
+    started, release, calls = threading.Event(), threading.Event(), []
+    body = blocking(started, release, calls)
+    shared = scheduler.submit("cancel", body, "shared")
+    assert started.wait(TIMEOUT)
+    # another session still waits on the job
+    shared.waiters += 1
+    scheduler.detach(shared)
+    fresh = scheduler.submit("cancel", body, "fresh")
+    release.set()
+    assert shared.future.result(TIMEOUT) == "shared done"
+    assert fresh.future.result(TIMEOUT) == "fresh done"
+    for job in (shared, fresh):
+        scheduler.detach(job)
+
+
+def test_job_cancelled_in_the_queue_never_runs():
+    job = scheduler.Job("queued")
+    job.cancel()
+    calls = []
+    scheduler._runJob(job, calls.append, ("never",), {})
+    assert calls == [] and job.future.cancelled()
+
+
+def test_heavy_body_moves_to_the_heavy_pool():
+    threads = []
+
+    @scheduler.heavy
+    def body(value):
+        threads.append(threading.current_thread().name)
+        return value * 2
+
+    def page(value):
+        threads.append(threading.current_thread().name)
+        return body(value)
+
+    job = scheduler.submit("heavy", page, 21)
+    assert job.future.result(TIMEOUT) == 42
+    scheduler.detach(job)
+    # the shared attempt stops at the heavy body, the heavy pool runs the job again from the top
+    assert threads[0].startswith("scheduler_")
+    assert all(name.startswith("scheduler-heavy") for name in threads[1:]) and len(threads) == 3
+    # outside a job the body runs inline
+    assert body(2) == 4
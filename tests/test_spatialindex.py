@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from src import pointlayer, spatialindex
+
+
+def crashFrame(n=20_000, seed=0):
+    # crashes over the whole state, half of them around Melbourne
+    rng = np.random.default_rng(seed)
+    state = rng.uniform([-39.1, 141.0], [-34.0, 149.9], size=(n // 2, 2))
+    melbourne = rng.normal([-37.81, 144.96], 0.2, size=(n - n // 2, 2))
+    lat_long = np.vstack([state, melbourne])
+    return pd.DataFrame({"LATITUDE": lat_long[:, 0], "LONGITUDE": lat_long[:, 1]})
+
+
+def haversine(lat0, lon0, lat, lon):
+    lat0, lon0, lat, lon = map(np.radians, (lat0, lon0, lat, lon))
+    a = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat) * np.sin((lon - lon0) / 2) ** 2
+    return 2 * spatialindex.EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def test_bbox_matches_brute_force_over_map_viewports():
+    crashsite_df = crashFrame()
+    index = spatialindex.buildIndex(crashsite_df)
+    lat, lon = crashsite_df["LATITUDE"].to_numpy(), crashsite_df["LONGITUDE"].to_numpy()
+    rng = np.random.default_rng(1)
+    for _ in range(250):
+        centre = rng.uniform([-38.5, 142.0], [-35.0, 148.0])
+        lat_min, lat_max, lon_min, lon_max = pointlayer.viewport(*centre, rng.uniform(6, 13))
+        expected = np.flatnonzero((lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max))
+        np.testing.assert_array_equal(np.sort(index.bbox(lat_min, lat_max, lon_min, lon_max)), expected)
+
+
+def test_radius_matches_brute_force():
+    crashsite_df = crashFrame()
+    index = spatialindex.buildIndex(crashsite_df)
+    lat, lon = crashsite_df["LATITUDE"].to_numpy(), crashsite_df["LONGITUDE"].to_numpy()
+    rng = np.random.default_rng(2)
+    for radius_m in [50, 500, 5_000, 50_000, 300_000]:
+        for lat0, lon0 in rng.uniform([-38.5, 142.0], [-35.0, 148.0], size=(10, 2)):
+            expected = np.flatnonzero(haversine(lat0, lon0, lat, lon) <= radius_m)
+            np.testing.assert_array_equal(np.sort(index.radius(lat0, lon0, radius_m)), expected)
+
+
+def test_rows_of_a_larger_frame():
+    crashsite_df = crashFrame(2_000)
+    window = crashsite_df.iloc[::3]
+    index = spatialindex.buildIndex(window, crashsite_df.index.get_indexer(window.index))
+    positions = index.bbox(-39.2, -33.9, 140.9, 150.0)
+    np.testing.assert_array_equal(np.sort(positions), np.arange(0, len(crashsite_df), 3))
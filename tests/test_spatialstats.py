@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from src import spatialstats
+
+esda = pytest.importorskip("esda")
+libpysal = pytest.importorskip("libpysal")
+
+
+@pytest.fixture
+def grid():
+    # queen contiguity on a 12 x 12 grid, a smooth trend and noise in one column and noise only in the other
+    w = libpysal.weights.lat2W(12, 12, rook=False)
+    w.transform = "r"
+    rng = np.random.default_rng(0)
+    rows, cols = np.divmod(np.arange(w.n), 12)
+    X = np.column_stack([rows + cols + rng.normal(0, 2, w.n), rng.normal(0, 1, w.n)])
+    return w, X
+
+
+def test_global_moran_matches_esda(grid):
+    w, X = grid
+    result = spatialstats.moranGlobal(w.sparse, X, columns=["trend", "noise"], permutations=9999)
+    for i, column in enumerate(["trend", "noise"]):
+        reference = esda.Moran(X[:, i], w, permutations=9999)
+        assert result.loc[column, "I"] == pytest.approx(reference.I, abs=1e-12)
+        assert result.loc[column, "EI"] == pytest.approx(reference.EI, abs=1e-12)
+        # pseudo p-values of independent permutations agree to within their sampling error
+        assert result.loc[column, "p_sim"] == pytest.approx(reference.p_sim, abs=0.02)
+
+
+def test_local_moran_matches_esda(grid):
+    w, X = grid
+    result = spatialstats.moranLocal(w.sparse, X, permutations=9999, n_jobs=1)
+    for i in range(X.shape[1]):
+        reference = esda.Moran_Local(X[:, i], w, permutations=9999, seed=0)
+        np.testing.assert_allclose(result["Is"][:, i], reference.Is, atol=1e-12)
+        np.testing.assert_allclose(result["lag"][:, i], libpysal.weights.lag_spatial(w, X[:, i]), atol=1e-12)
+        np.testing.assert_allclose(result["p_sim"][:, i], reference.p_sim, atol=0.04)
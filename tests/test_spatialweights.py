@@ -0,0 +1,24 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import box
+
+from src import spatialweights
+
+
+def gridCells(n):
+    # unit squares in a row, every cell's nearest neighbours are the cells next to it
+    return gpd.GeoDataFrame(geometry=[box(i, 0, i + 1, 1) for i in range(n)])
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 30])
+def test_knn_weights_of_small_grids(tmp_path, monkeypatch, n):
+    monkeypatch.setattr(spatialweights, "WEIGHTS_DIR", str(tmp_path))
+    # the second lookup reads the stored neighbours
+    for _ in range(2):
+        W = spatialweights.getWeights(gridCells(n), kind="knn", k=2, grid_key="row")
+        assert W.shape == (n, n)
+        assert W.diagonal().sum() == 0
+        np.testing.assert_allclose(np.asarray(W.sum(axis=1)).ravel(), np.ones(n) if n > 1 else np.zeros(n))
+    if n == 30:
+        assert set(W[10].indices) == {9, 11}